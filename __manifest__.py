@@ -6,11 +6,20 @@
     'author': 'Olive Tech',
     'depends': ['point_of_sale'],
     'data': [
+        'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'views/assets.xml',
         'views/account_move_views.xml',
         'views/res_company_views.xml',
         'views/pos_order_views.xml',
         'views/pos_config_views.xml',
+        'views/fel_certification_queue_views.xml',
+        'views/fel_circuit_breaker_views.xml',
+        'views/fel_certification_request_views.xml',
+        'views/fel_reconciliation_views.xml',
+        'views/fel_recertify_batch_views.xml',
+        'wizard/fel_recertify_wizard_views.xml',
+        'report/fel_status_report_views.xml',
         ],
     'assets': {
         'point_of_sale._assets_pos': [
@@ -20,6 +29,7 @@
         'point_of_sale.assets': [
             'Odoo16-Digifact/static/src/xml/partner_details_edit.xml',
             'Odoo16-Digifact/static/src/css/partner_details_edit.css',
+            'Odoo16-Digifact/static/src/js/nit_index.js',
             'Odoo16-Digifact/static/src/js/partner_details_edit_extend.js',
         ],
     },
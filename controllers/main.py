@@ -0,0 +1,57 @@
+import hmac
+from odoo import http, api, fields
+from odoo.http import request, Response
+from ..models.fel_dte_export import EXPORT_FORMATS
+
+
+class FelMetricsController(http.Controller):
+
+    @http.route('/metrics', type='http', auth='none', methods=['GET'], csrf=False, save_session=False)
+    def fel_metrics(self, **kwargs):
+        """
+        Métricas FEL en el formato de texto de Prometheus.
+        Requiere el parámetro del sistema `fel_metrics_token`, enviado como `Authorization: Bearer <token>`.
+        """
+        if not request.db:
+            return request.not_found()
+
+        token = request.env['fel.settings'].sudo()._get().metrics_token
+        authorization = request.httprequest.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode()):
+            return request.make_response("Forbidden\n", status=403, headers=[('Content-Type', 'text/plain')])
+
+        body = request.env['fel.metric'].sudo()._render_prometheus()
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
+
+
+class FelDteExportController(http.Controller):
+
+    @http.route('/fel/dte_export', type='http', auth='user', methods=['GET'])
+    def fel_dte_export(self, date_from, date_to, export_format='csv', company_ids=None, **kwargs):
+        """
+        Descarga en un zip las facturas certificadas del rango, con su índice CSV o JSON y sus XML.
+        El zip se envía por partes mientras se genera.
+        """
+        if not request.env.user.has_group('account.group_account_manager'):
+            return request.make_response("Forbidden\n", status=403, headers=[('Content-Type', 'text/plain')])
+        if export_format not in EXPORT_FORMATS:
+            return request.make_response("Unsupported format\n", status=400, headers=[('Content-Type', 'text/plain')])
+        date_from = fields.Date.to_date(date_from)
+        date_to = fields.Date.to_date(date_to)
+        company_ids = [int(company_id) for company_id in company_ids.split(',') if company_id] if company_ids else None
+
+        registry = request.env.registry
+        uid = request.env.uid
+        context = dict(request.env.context)
+
+        def generate():
+            # El cursor de la petición ya está cerrado cuando se envía la respuesta: se abre uno propio
+            with registry.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                yield from env['fel.dte.export']._iter_zip(date_from, date_to, export_format, company_ids)
+
+        filename = f"dte_{date_from}_{date_to}.zip"
+        return Response(generate(), direct_passthrough=True, headers=[
+            ('Content-Type', 'application/zip'),
+            ('Content-Disposition', http.content_disposition(filename)),
+        ])
@@ -1,5 +1,18 @@
 from . import account_move
 from . import pos_order
 from . import pos_config
+from . import pos_session
 from . import res_company
-from . import res_partner
\ No newline at end of file
+from . import res_partner
+from . import fel_certification_queue
+from . import fel_token
+from . import fel_nit_cache
+from . import fel_qr_code
+from . import fel_certification_error
+from . import fel_circuit_breaker
+from . import fel_metric
+from . import fel_settings
+from . import fel_certification_request
+from . import fel_reconciliation
+from . import fel_dte_export
+from . import fel_recertify_batch
@@ -1,110 +1,165 @@
-import json
-import qrcode
+import gzip
 import base64
+import hashlib
 import logging
 import requests
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, AccessError
+from odoo.tools.sql import create_index
+from ..tools import dte_builder, fel_http, fel_metrics
+from ..tools.fel_http import ServiceUnavailable, DeadlineExceeded, OutcomeUnknown
+from .fel_certification_queue import MODULE_NAME
 
 
 _logger = logging.getLogger(__name__)
 
+RECERTIFY_NOTE = "Certificado exitosamente de Nuevo desde panel de facturas de venta en odoo"
+FEL_PDF_BATCH_SIZE = 50  # PDF generados por cada ejecución del cron
+FEL_PDF_LOOKBACK_DAYS = 3  # Las facturas más antiguas generan su PDF al pedirlo
+CERTIFY_TIMEOUT = 60  # Timeout de lectura máximo de la certificación
+CERTIFY_MIN_TIMEOUT = 15  # Con menos plazo no se envía el DTE: un corte a medias deja la certificación en duda
+CONTINGENCY_BATCH_SIZE = 100  # Facturas en contingencia certificadas por lote
+CONTINGENCY_MAX_WORKERS = 8  # Envíos en paralelo al certificar la contingencia
+CONTINGENCY_NOTE = "📴 Emitida en contingencia, pendiente de certificar"
+CONTINGENCY_CERTIFIED_NOTE = "Certificada después de emitirse en contingencia"
+SESSION_CLOSE_BATCH_SIZE = 200  # Facturas del cierre de sesión certificadas por lote
+SESSION_CLOSE_MAX_WORKERS = 8  # Envíos en paralelo al certificar las facturas del cierre
+SESSION_CLOSE_PENDING_NOTE = "⏳ Certificación FEL pendiente del cierre de sesión"
+SESSION_CLOSE_CERTIFIED_NOTE = "Certificada en lote al cerrar la sesión del POS"
+
+
+def send_certification_request(fel_request):
+    """
+    Envía a la API de la SAT una petición preparada por `_prepare_fel_certification_request`
+    y devuelve los datos de certificación. No usa el ORM, por lo que es seguro llamarla desde otros hilos.
+    """
+    try:
+        # Enviar la solicitud POST a la API de la SAT (sin reintentos: la certificación no es idempotente)
+        response = fel_http.post(
+            fel_request['url'],
+            headers=fel_request['headers'],
+            data=fel_request['data'],
+            timeout=CERTIFY_TIMEOUT,
+            min_timeout=CERTIFY_MIN_TIMEOUT,
+            pool_size=fel_request['pool_size'],
+            deadline=fel_request.get('deadline'),
+            endpoint='certify',
+        )
+    except requests.RequestException as e:
+        if fel_http.may_have_been_sent(e):
+            # El DTE pudo llegar a la SAT: no se reenvía hasta confirmar si quedó autorizado
+            raise OutcomeUnknown(f"Sin respuesta de API FEL tras enviar el DTE: {str(e)}")
+        raise ServiceUnavailable(f"Error al conectar con API FEL: {str(e)}")
+    if response.status_code == 503:
+        raise ServiceUnavailable(f"Error al conectar con API FEL: respuesta HTTP {response.status_code}")
+    if response.status_code >= 500:
+        raise OutcomeUnknown(f"Error de API FEL tras enviar el DTE: respuesta HTTP {response.status_code}")
+
+    try:
+        response_data = response.json()
+    except ValueError:
+        raise OutcomeUnknown(f"Respuesta ilegible de API FEL tras enviar el DTE (HTTP {response.status_code}).")
+
+    try:
+        # Si la certificación es exitosa, devolvemos los datos de certificación
+        if response.status_code == 200 and response_data.get("Codigo") == 1:
+            certification_data = {
+                "fel_number": response_data.get("NUMERO"),
+                "fel_reference": response_data.get("Serie"),
+                "fel_authorization_number": response_data.get("Autorizacion"),
+                "fel_certificate_date": response_data.get("Fecha_de_certificacion"),
+            }
+        else:
+            raise Exception(f"Error en certificación FEL: {response_data.get('Mensaje')} {response_data.get('ResponseDATA1')}")
+    except Exception as e:
+        raise Exception(f"Error al conectar con API FEL: {str(e)}")
+
+    # XML firmado por el certificador, en base64. La SAT ya autorizó el DTE: si el XML no se
+    # puede leer, se conserva la autorización sin él
+    certification_data["signed_xml"] = _decode_signed_xml(response_data.get("ResponseDATA1"),
+                                                          certification_data["fel_authorization_number"])
+    return certification_data
+
+
+def _decode_signed_xml(response_data1, authorization_number):
+    """Decodifica el XML firmado (base64) de la respuesta; None si no viene o está dañado."""
+    if not response_data1:
+        return None
+    try:
+        return base64.b64decode(response_data1)
+    except (TypeError, ValueError) as e:
+        _logger.warning(f"⚠ XML firmado ilegible en la autorización {authorization_number}, se guarda sin él: {e}")
+        return None
+
+
+def _send_certification_tracked(dbname, company_id, fel_request):
+    """`send_certification_request` con su duración y resultado registrados en las métricas."""
+    with fel_metrics.track(dbname, 'certification', company_id):
+        return send_certification_request(fel_request)
+
+
 class AccountMove(models.Model):
     _inherit = 'account.move'
 
-    qr_code = fields.Binary("Código QR", compute="_compute_qr_code_fel", store=True)
+    qr_code = fields.Binary("Código QR", compute="_compute_qr_code_fel")
     fel_reference = fields.Char("FEL Referencia")
     note = fields.Text("Notas")
     certified = fields.Boolean("Certificación")
     send_email_to = fields.Char("Enviar Correo A...")
     fel_number = fields.Char("FEL Número de Factura")
-    fel_authorization_number = fields.Char("FEL Número de Autorización")
+    fel_authorization_number = fields.Char("FEL Número de Autorización", index='btree_not_null')
     fel_certificate_date = fields.Char("FEL Fecha de Certificación")
     pos_config_id = fields.Char("Sesión que Creó la Factura")
-
-    @api.depends("fel_number", "fel_authorization_number")  
+    fel_pdf_attachment_id = fields.Many2one('ir.attachment', string="PDF FEL", copy=False, readonly=True)
+    fel_xml_attachment_id = fields.Many2one('ir.attachment', string="XML FEL Certificado", copy=False, readonly=True,
+                                            help="XML firmado devuelto por el certificador, comprimido con gzip.")
+    fel_xml_sha256 = fields.Char("SHA-256 del XML FEL", copy=False, readonly=True)
+    fel_contingency = fields.Boolean("Pendiente de Certificar (Contingencia)", copy=False, index=True)
+    fel_access_number = fields.Char("FEL Número de Acceso (Contingencia)", copy=False, readonly=True)
+    fel_issue_date = fields.Datetime("FEL Fecha de Emisión (Contingencia)", copy=False, readonly=True)
+    fel_session_close_pending = fields.Boolean("Pendiente de Certificar (Cierre de Sesión)", copy=False, index=True)
+
+    def init(self):
+        super().init()
+        # 🔹 Índices parciales para las facturas de venta sin certificar y los PDF pendientes del cron
+        create_index(self.env.cr, 'account_move_fel_uncertified_index', self._table, ['company_id', 'create_date'],
+                     where="certified IS NOT TRUE AND move_type = 'out_invoice'")
+        create_index(self.env.cr, 'account_move_fel_pdf_pending_index', self._table, ['create_date'],
+                     where="certified IS TRUE AND fel_pdf_attachment_id IS NULL")
+
+    @api.depends("fel_number", "fel_authorization_number")
     def _compute_qr_code_fel(self):
-        """Genera el código QR cada vez que se cambia el número de factura FEL o autorización"""
+        """El código QR se lee del adjunto compartido; solo se genera la primera vez que se pide"""
         for record in self:
             record.qr_code = record._generate_qr_code_fel()
 
+    def _get_qr_url_fel(self):
+        """URL de verificación del DTE en el portal de la SAT"""
+        return f"https://felpub.c.sat.gob.gt/verificador-web/publico/vistas/verificacionDte.jsf?tipo=autorizacion&numero={self.fel_authorization_number}&emisor={self.company_id.vat}&receptor={self.partner_id.vat}"
+
     def _generate_qr_code_fel(self):
         """Método que puede ser llamado en QWeb para obtener el QR"""
         # Si no hay número o autorización, retornar vacío
         if not self.fel_number or not self.fel_authorization_number:
             return ""
 
-        # Definir la URL personalizada para el QR
-        qr_url = f"https://felpub.c.sat.gob.gt/verificador-web/publico/vistas/verificacionDte.jsf?tipo=autorizacion&numero={self.fel_authorization_number}&emisor={self.company_id.vat}&receptor={self.partner_id.vat}"
-
-        # Generar el código QR
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_url)
-        qr.make(fit=True)
-
-        # Convertir la imagen QR a base64
-        img = qr.make_image(fill='black', back_color='white')
-        temp = BytesIO()
-        img.save(temp, format="PNG")
-        qr_code_base64 = base64.b64encode(temp.getvalue()).decode('utf-8')
+        return self.env['fel.qr.code']._get_qr_code(self._get_qr_url_fel())
 
-        return qr_code_base64
-    
     def _get_or_regenerate_token(self):
         """
-        Verifica si el token ha expirado y lo regenera si es necesario.
+        Devuelve un token vigente para la compañía de la factura, regenerándolo si es necesario.
         """
-        company = self.company_id
-        token_data = json.loads(company.fel_token or '{}')
-
-        # Verificar si el token ha expirado
-        _logger.info("Token data: %s", token_data)
-        token_expiry = fields.Datetime.from_string(token_data.get('expira_en').replace('T', ' ').split('.')[0])
-        token_expiry = fields.Datetime.context_timestamp(self, token_expiry)
-        now = fields.Datetime.context_timestamp(self, fields.Datetime.now())
-        _logger.info("Token Expiry: %s", token_expiry)
-        _logger.info("Now: %s", now)
-        _logger.info("Token Expiry Now?: %s", now >= token_expiry)
-        if not token_expiry or now >= token_expiry:
-            _logger.info("Token ha expirado, regenerar")
-            # Token ha expirado, regenerar
-            api_url = self.env['ir.config_parameter'].sudo().get_param('fel_token_url')
-
-            if not api_url:
-                raise Exception("URL de API de token no configurada en parámetros del sistema.")
-            username = f"GT.{company.vat.zfill(12)}.{company.fel_user}"
-            payload = {
-                "Username": username,
-                "Password": company.fel_password
-            }
-            headers = {
-                "Content-Type": "application/json",
-            }
-
-            try:
-                response = requests.post(api_url, headers=headers, json=payload, timeout=10)
-                response_data = response.json()
-
-                if response.status_code == 200 and response_data.get("Token"):
-                    # Guardar el nuevo token en la compañía
-                    token_data = {
-                        "Token": response_data["Token"],
-                        "expira_en": response_data["expira_en"],
-                        "otorgado_a": response_data["otorgado_a"]
-                    }
-                    company.write({'fel_token': json.dumps(token_data)})
-                else:
-                    raise Exception(f"Error al obtener nuevo token: {response_data.get('message')}")
-            except Exception as e:
-                raise Exception(f"Error al conectar con API de token: {str(e)}")
+        return self.env['fel.token']._get_token(self.company_id)
 
-        return token_data.get('Token')
+    def _get_fel_internal_reference(self):
+        """
+        Referencia interna que va en la Adenda del DTE y con la que se busca en Digifact.
+        Solo se envía con el parámetro `fel_reconcile_reference_lookup` activo.
+        """
+        self.ensure_one()
+        return self.name
 
     def _prepare_fel_invoice_data(self, pos_config):
         """
@@ -123,7 +178,7 @@ class AccountMove(models.Model):
 
         # Obtener o regenerar el token
         token = self._get_or_regenerate_token()
-        _logger.info("Token obtenido: %s", token)
+        settings = self.env['fel.settings']._get()
 
         # Construcción del payload para la certificación en SAT
         invoice_data = {
@@ -137,24 +192,73 @@ class AccountMove(models.Model):
             "direccion_emisor": company.street,  # Dirección de la empresa emisora
             "nit_receptor": self.partner_id.vat or "CF",  # NIT del cliente (CF si es consumidor final)
             "nombre_receptor": self.partner_id.name, # Nombre del cliente
-            "fecha_emision": fields.Datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),  # Fecha actual
+            "fecha_emision": (self.fel_issue_date or fields.Datetime.now()).strftime('%Y-%m-%dT%H:%M:%S'),  # Fecha de emisión (en contingencia, la original)
+            "numero_acceso": self.fel_access_number or None,  # Número de acceso de contingencia
+            "referencia_interna": self._get_fel_internal_reference() if settings.reconcile_reference_lookup else None,  # Adenda para buscar el DTE en Digifact
             "moneda": self.currency_id.name,  # Moneda de la factura
             "monto_total": self.amount_total,  # Total de la factura
-            "productos": [  # Detalle de los productos vendidos
-                {
-                    "descripcion": line.product_id.name,
-                    "cantidad": line.quantity,
-                    "precio_unitario": line.price_unit,
-                    "subtotal": line.price_total,
-                } for line in self.invoice_line_ids
-            ],
         }
+        # Detalle de los productos vendidos y total de impuestos, leídos en una sola consulta
+        invoice_data["productos"], invoice_data["total_impuestos"] = self._read_fel_lines()
 
         return invoice_data
 
+    def _read_fel_lines(self):
+        """
+        Lee en una sola consulta las líneas de producto (como `dte_builder.DteLine`) y las
+        líneas de impuesto de la factura. La base gravable y el impuesto de cada línea son los
+        que Odoo calculó con los impuestos reales; el total de impuestos sale de las líneas de impuesto.
+        """
+        self.ensure_one()
+        self.env['account.move.line'].flush_model([
+            'move_id', 'display_type', 'sequence', 'product_id', 'name', 'quantity', 'price_unit',
+            'price_subtotal', 'price_total', 'amount_currency',
+        ])
+        self.env['product.product'].flush_model(['product_tmpl_id'])
+        self.env['product.template'].flush_model(['name'])
+        self.env.cr.execute("""
+            SELECT l.display_type,
+                   COALESCE(pt.name->>%(lang)s, pt.name->>'en_US', l.name),
+                   l.quantity, l.price_unit, l.price_subtotal, l.price_total, l.amount_currency
+              FROM account_move_line l
+              LEFT JOIN product_product pp ON pp.id = l.product_id
+              LEFT JOIN product_template pt ON pt.id = pp.product_tmpl_id
+             WHERE l.move_id = %(move_id)s
+               AND l.display_type IN ('product', 'tax')
+             ORDER BY l.sequence, l.id
+        """, {'move_id': self.id, 'lang': self.env.lang or 'en_US'})
+
+        lines = []
+        tax_lines_total = 0.0
+        for display_type, name, quantity, price_unit, price_subtotal, price_total, amount_currency in self.env.cr.fetchall():
+            if display_type == 'tax':
+                tax_lines_total += amount_currency or 0.0
+                continue
+            price_subtotal = price_subtotal or 0.0
+            price_total = price_total or 0.0
+            lines.append(dte_builder.DteLine(
+                name, quantity or 0.0, price_unit or 0.0, price_total, price_subtotal, price_total - price_subtotal,
+            ))
+        # Las líneas de impuesto de una factura de venta van al crédito (montos negativos)
+        sign = -1 if self.is_inbound(include_receipts=True) else 1
+        return lines, sign * tax_lines_total
+
     def _certify_invoice_with_sat(self, pos_config = None):
         """
         Envía la información de la factura a la API de la SAT y devuelve la respuesta con los datos de certificación.
+        Si la factura ya fue autorizada se devuelve la autorización guardada, sin llamar de nuevo al API.
+        """
+        def send():
+            fel_request = self._prepare_fel_certification_request(pos_config)
+            return self.env['fel.circuit.breaker']._call(
+                'certify', self.company_id, _send_certification_tracked, self.env.cr.dbname, self.company_id.id, fel_request)
+
+        return self.env['fel.certification.request']._certify_once(self, send)
+
+    def _prepare_fel_certification_request(self, pos_config = None):
+        """
+        Prepara la petición de certificación (URL, headers y XML) sin enviarla.
+        Todo el acceso al ORM ocurre aquí, de modo que el envío puede hacerse desde otro hilo.
         """
 
         if not pos_config:
@@ -164,11 +268,11 @@ class AccountMove(models.Model):
         invoice_data = self._prepare_fel_invoice_data(pos_config)
 
         # Generar el XML de la factura
-        invoice_xml = self._generate_invoice_xml(invoice_data)
+        invoice_xml = self._generate_invoice_xml(invoice_data, pos_config)
 
-        _logger.info("Datos de la factura a enviar a SAT: %s", invoice_xml)
+        _logger.debug("Datos de la factura a enviar a SAT: %s", invoice_xml)
 
-        base_url = self.env['ir.config_parameter'].sudo().get_param('fel_certify_url')
+        base_url = self.env['fel.settings']._get().certify_url
 
         if not base_url:
             raise Exception("URL de API de certificación no configurada en parámetros del sistema.")
@@ -182,121 +286,367 @@ class AccountMove(models.Model):
             "Authorization": invoice_data['token'],
         }
 
-        _logger.info("Datos de la factura a enviar a SAT: %s", invoice_xml)
+        options = fel_http.get_transport_options(self.env)
+        return {
+            "url": api_url,
+            "headers": headers,
+            "data": invoice_xml,
+            "pool_size": options['pool_size'],
+            # Plazo del punto de entrada: el envío se hace desde otro hilo, que no lo hereda
+            "deadline": options['deadline'],
+        }
 
-        try:
-            # Enviar la solicitud POST a la API de la SAT
-            response = requests.post(api_url, headers=headers, data=invoice_xml, timeout=60)
-            response_data = response.json()
+    def _generate_invoice_xml(self, invoice_data, pos_config=None):
+        """
+        Genera el XML de la factura (bytes UTF-8) a partir de los datos proporcionados.
+        El encabezado del emisor se reutiliza por compañía y punto de venta.
+        """
+        header = dte_builder.get_header(self.company_id, pos_config or self.env['pos.config'])
+        _logger.debug(f"Regimen ISR detectado: {header['regimen_isr']}, TipoFrase: {header['tipo_frase']}, CodigoEscenario: {header['codigo_escenario']}")
+        with fel_metrics.track(self.env.cr.dbname, 'xml_build', self.company_id.id):
+            return dte_builder.build_invoice_xml(header, invoice_data)
 
-            # Si la certificación es exitosa, devolvemos los datos de certificación
-            if response.status_code == 200 and response_data.get("Codigo") == 1:
-                return {
-                    "fel_number": response_data.get("NUMERO"),
-                    "fel_reference": response_data.get("Serie"),
-                    "fel_authorization_number": response_data.get("Autorizacion"),
-                    "fel_certificate_date": response_data.get("Fecha_de_certificacion")
+    def _certify_concurrently(self, pos_order_by_move, max_workers):
+        """
+        Certifica las facturas enviando las peticiones a la SAT en paralelo, con a lo sumo
+        `max_workers` hilos. La preparación y el registro en el circuito se hacen en el hilo
+        principal; los hilos solo hacen el envío HTTP.
+        Devuelve {factura: datos de certificación o la excepción}; no guarda los resultados.
+        Las facturas ya autorizadas devuelven la autorización guardada y las que otro proceso
+        está enviando fallan sin reenviarse.
+        """
+        results = {}
+        requests_by_move = {}
+        claimed = []
+        breaker = self.env['fel.circuit.breaker']
+        dedup = self.env['fel.certification.request']
+
+        # 🔹 Preparar las peticiones (acceso al ORM, hilo principal)
+        for move in self:
+            pos_order = pos_order_by_move.get(move.id)
+            try:
+                if not pos_order:
+                    raise UserError(_("No se encontró una orden de POS relacionada con esta factura."))
+                # Si el circuito está abierto, la factura falla sin llamar a la SAT
+                breaker._check('certify', move.company_id)
+                state, certification_data = dedup._try_claim(move)
+                if state == 'done':
+                    results[move] = certification_data
+                    continue
+                if state == 'busy':
+                    raise UserError(_("La certificación de esta factura ya está en curso en otro proceso."))
+                if state == 'unknown':
+                    raise UserError(dedup._get_unknown_message(move))
+                claimed.append(move)
+                requests_by_move[move] = move._prepare_fel_certification_request(pos_order.session_id.config_id)
+            except Exception as e:
+                results[move] = e
+
+        # 🔹 Enviar las peticiones a la SAT en paralelo
+        if requests_by_move:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    move: executor.submit(_send_certification_tracked, self.env.cr.dbname, move.company_id.id, fel_request)
+                    for move, fel_request in requests_by_move.items()
                 }
-            else:
-                raise Exception(f"Error en certificación FEL: {response_data.get('Mensaje')} {response_data.get('ResponseDATA1')}")
-        except Exception as e:
-            raise Exception(f"Error al conectar con API FEL: {str(e)}")
+                for move, future in futures.items():
+                    try:
+                        results[move] = future.result()
+                    except Exception as e:
+                        results[move] = e
+
+        # 🔹 Guardar el resultado de los envíos reservados, para no repetirlos
+        for move in claimed:
+            dedup._finish(move, results[move])
+
+        # 🔹 Informar al circuito el resultado de los envíos, por compañía; sin plazo no se envió nada
+        for company in self.mapped('company_id'):
+            sent = [results[move] for move in requests_by_move
+                    if move.company_id == company and not isinstance(results[move], DeadlineExceeded)]
+            for result in sent:
+                if isinstance(result, ServiceUnavailable):
+                    breaker._record_failure('certify', company)
+            if any(not isinstance(result, ServiceUnavailable) for result in sent):
+                breaker._record_success('certify', company)
+
+        return results
+
+    def _issue_fel_contingency(self, pos_order=None):
+        """
+        Emite la factura en contingencia: asigna un número de acceso local y guarda la fecha
+        de emisión, sin llamar a la SAT. `_cron_certify_contingency` la certifica después.
+        """
+        self.ensure_one()
+        access_number = self.env['ir.sequence'].sudo().next_by_code('fel.contingency')
+        contingency_data = {
+            "fel_reference": "CONT",
+            "fel_number": access_number,
+            "fel_authorization_number": "",
+            "fel_certificate_date": "",
+            "note": CONTINGENCY_NOTE,
+            "certified": False,
+        }
+        self.write(dict(contingency_data,
+                        fel_contingency=True,
+                        fel_access_number=access_number,
+                        fel_issue_date=fields.Datetime.now()))
+        if pos_order:
+            pos_order.write(contingency_data)
+        return access_number
+
+    @api.model
+    def _cron_certify_contingency(self, batch_size=CONTINGENCY_BATCH_SIZE, max_workers=CONTINGENCY_MAX_WORKERS):
+        """
+        Certifica, en orden de emisión, las facturas emitidas en contingencia de las compañías
+        que ya salieron de ella. Los lotes se envían en paralelo y se confirman uno a uno.
+        Si la SAT rechaza una factura, pasa a la cola de certificación, que reintenta y notifica;
+        si el servicio vuelve a fallar, el resto espera a la siguiente ejecución.
+        """
+        companies = self.env['res.company'].search([]).filtered(lambda company: not company._is_fel_contingency_active())
+        domain = [('fel_contingency', '=', True), ('certified', '=', False), ('company_id', 'in', companies.ids)]
+        queue = self.env['fel.certification.queue']
+
+        while True:
+            moves = self.search(domain, order='id', limit=batch_size)
+            if not moves:
+                break
+
+            pos_orders = self.env['pos.order'].search([('account_move', 'in', moves.ids)])
+            pos_order_by_move = {order.account_move.id: order for order in pos_orders}
+            with fel_http.deadline(self.env['fel.settings']._get_deadline('cron')):
+                results = moves._certify_concurrently(pos_order_by_move, max_workers)
+
+            unavailable = False
+            for move in moves:
+                result = results[move]
+                pos_order = pos_order_by_move.get(move.id)
+                if isinstance(result, ServiceUnavailable):
+                    unavailable = True
+                elif isinstance(result, Exception):
+                    _logger.error(f"❌ Factura en contingencia {move.name} rechazada, pasa a la cola: {result}")
+                    move.fel_contingency = False
+                    queue._enqueue(move, pos_order)
+                else:
+                    move._write_certification_result(dict(result, certified=True), pos_order, {'note': CONTINGENCY_CERTIFIED_NOTE})
 
-    def _generate_invoice_xml(self, invoice_data):
+            self.env.cr.commit()
+            _logger.info(f"✅ Lote de {len(moves)} facturas en contingencia procesado.")
+            if unavailable:
+                break
+
+    @api.model
+    def _cron_certify_session_close(self, batch_size=SESSION_CLOSE_BATCH_SIZE, max_workers=SESSION_CLOSE_MAX_WORKERS):
         """
-        Genera el XML de la factura a partir de los datos proporcionados.
+        Certifica las facturas creadas en lote al cerrar las sesiones del POS. Cada lote se envía
+        en paralelo y sus resultados se guardan juntos, en un solo flush del ORM.
+        Las facturas rechazadas pasan a la cola de certificación; si el servicio falla, el resto
+        espera a la siguiente ejecución.
         """
-        # Ejemplo de XML, se debe ajustar según los requisitos de la SAT
-        # Determinar el TipoFrase y CodigoEscenario basado en el campo regimen_ISR
-        if self.company_id.regimen_ISR == 'quarterly':
-            tipo_frase = 1
-            codigo_escenario = 1
-        elif self.company_id.regimen_ISR == 'monthly':
-            tipo_frase = 1
-            codigo_escenario = 2
-        else:
-            tipo_frase = None
-            codigo_escenario = None
+        domain = [('fel_session_close_pending', '=', True), ('certified', '=', False)]
+        queue = self.env['fel.certification.queue']
+        breaker = self.env['fel.circuit.breaker']
+
+        while True:
+            # Con el circuito abierto, las facturas de esa compañía esperan sin ocupar el lote
+            companies = self.env['res.company'].search([]).filtered(lambda company: breaker._is_available('certify', company))
+            moves = self.search(domain + [('company_id', 'in', companies.ids)], order='id', limit=batch_size)
+            if not moves:
+                break
+
+            pos_orders = self.env['pos.order'].search([('account_move', 'in', moves.ids)])
+            pos_order_by_move = {order.account_move.id: order for order in pos_orders}
+            with fel_http.deadline(self.env['fel.settings']._get_deadline('cron')):
+                results = moves._certify_concurrently(pos_order_by_move, max_workers)
+
+            certified = {move: result for move, result in results.items() if not isinstance(result, Exception)}
+            rejected = self.browse([move.id for move, result in results.items()
+                                    if isinstance(result, Exception) and not isinstance(result, ServiceUnavailable)])
+            self.browse([move.id for move in certified])._write_certification_results_bulk(
+                certified, pos_order_by_move, SESSION_CLOSE_CERTIFIED_NOTE)
+            if rejected:
+                rejected.write({'fel_session_close_pending': False})
+                for move in rejected:
+                    _logger.error(f"❌ Factura {move.name} del cierre de sesión rechazada, pasa a la cola: {results[move]}")
+                    queue._enqueue(move, pos_order_by_move.get(move.id))
+
+            self.env.cr.commit()
+            self.env.invalidate_all()
+            _logger.info(f"✅ Lote de {len(moves)} facturas del cierre de sesión procesado: "
+                         f"{len(certified)} certificadas, {len(rejected)} a la cola.")
+            if len(certified) + len(rejected) < len(moves):
+                break
+
+    def _write_certification_results_bulk(self, results, pos_order_by_move, note):
+        """
+        Guarda con el ORM los datos de certificación de varias facturas y de sus órdenes de POS.
+        Los valores comunes se escriben en una sola llamada y los de cada factura por separado;
+        el ORM agrupa todo en el siguiente flush. Los adjuntos del XML firmado se crean en una
+        sola llamada y el chatter de cada factura registra su autorización.
+        `results` es {factura: datos de certificación} y `pos_order_by_move` {id de factura: orden}.
+        """
+        if not self:
+            return
+
+        # 🔹 Adjuntos del XML firmado, creados en una sola llamada
+        signed = [(move, results[move]) for move in self if results[move].get('signed_xml')]
+        attachments = self.env['ir.attachment'].sudo().create([
+            move._prepare_fel_signed_xml_attachment_vals(data['signed_xml'], data) for move, data in signed
+        ])
+        xml_vals_by_move = {
+            move.id: {
+                'fel_xml_attachment_id': attachment.id,
+                'fel_xml_sha256': hashlib.sha256(data['signed_xml']).hexdigest(),
+            }
+            for (move, data), attachment in zip(signed, attachments)
+        }
 
-        _logger.info(f"Regimen ISR detectado: {self.company_id.regimen_ISR}, TipoFrase: {tipo_frase}, CodigoEscenario: {codigo_escenario}")
+        # 🔹 Valores comunes a todas las facturas; el PDF se genera de nuevo con los datos certificados
+        self.write({
+            'note': note,
+            'certified': True,
+            'fel_session_close_pending': False,
+            'fel_contingency': False,
+            'fel_pdf_attachment_id': False,
+        })
+        for move in self:
+            data = results[move]
+            certification_data = {name: data[name] for name in (
+                'fel_number', 'fel_reference', 'fel_authorization_number', 'fel_certificate_date')}
+            fel_ref = f"{data['fel_reference']}-{data['fel_number']}"
+            move.write(dict(certification_data, ref=f"{fel_ref} ({move.ref})" if move.ref else fel_ref,
+                            **xml_vals_by_move.get(move.id, {})))
+            pos_order = pos_order_by_move.get(move.id)
+            if pos_order:
+                pos_order.write(dict(certification_data, certified=True))
+
+        self._message_log_batch({
+            move.id: _("✅ Factura certificada: %s-%s, autorización %s.", results[move]['fel_reference'],
+                       results[move]['fel_number'], results[move]['fel_authorization_number'])
+            for move in self
+        })
+        self._trigger_fel_pdf_render()
+
+    @api.model
+    def _get_certify_allowed_companies(self):
+        """ Ids de las compañías permitidas para certificar (parámetro `certify_allowed_companies`). """
+        return self.env['fel.settings']._get().certify_allowed_company_ids
+
+    @api.model
+    def _get_certification_error_values(self, error):
+        """ Valores que se guardan en la factura y en la orden de POS cuando la certificación falla. """
+        return {
+            "fel_number": "",
+            "fel_reference": "",
+            "fel_authorization_number": "",
+            "fel_certificate_date": "",
+            "note": f"⚠ Error en certificación FEL: {error}",
+            "certified": False
+        }
 
-        # Generar el XML de la factura
-        invoice_xml = f"""
-        <?xml version='1.0' encoding='UTF-8'?>
-        <dte:GTDocumento 
-            xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-            xmlns:dte="http://www.sat.gob.gt/dte/fel/0.2.0" 
-            Version="0.1"
-        >
-            <dte:SAT ClaseDocumento="dte">
-                <dte:DTE ID="DatosCertificados">
-                    <dte:DatosEmision ID="DatosEmision">
-                    <dte:DatosGenerales 
-                        Tipo="FACT" 
-                        FechaHoraEmision="{invoice_data['fecha_emision']}"
-                        CodigoMoneda="{invoice_data['moneda']}" 
-                    />
-                    <dte:Emisor 
-                        NITEmisor="{invoice_data['nit_emisor']}" 
-                        NombreEmisor="{invoice_data['nombre_emisor']}" 
-                        CodigoEstablecimiento="{invoice_data['codigo_establecimiento']}"
-                        NombreComercial="{invoice_data['nombre_establecimiento']}" 
-                        AfiliacionIVA="GEN"
-                    >
-                        <dte:DireccionEmisor>
-                            <dte:Direccion>{invoice_data['direccion_emisor']}</dte:Direccion>
-                            <dte:CodigoPostal>0100</dte:CodigoPostal>
-                            <dte:Municipio>GUATEMALA</dte:Municipio>
-                            <dte:Departamento>GUATEMALA</dte:Departamento>
-                            <dte:Pais>GT</dte:Pais>
-                        </dte:DireccionEmisor>
-                    </dte:Emisor>
-                    <dte:Receptor 
-                        NombreReceptor="{invoice_data['nombre_receptor']}" 
-                        IDReceptor="{invoice_data['nit_receptor']}"
-                    >
-                        <dte:DireccionReceptor>
-                            <dte:Direccion>GUATEMALA</dte:Direccion>
-                            <dte:CodigoPostal>01010</dte:CodigoPostal>
-                            <dte:Municipio>GUATEMALA</dte:Municipio>
-                            <dte:Departamento>GUATEMALA</dte:Departamento>
-                            <dte:Pais>GT</dte:Pais>
-                        </dte:DireccionReceptor>
-                    </dte:Receptor>
-                    <dte:Frases>
-                        {f'<dte:Frase TipoFrase="{tipo_frase}" CodigoEscenario="{codigo_escenario}"/>' if tipo_frase and codigo_escenario else ''}
-                    </dte:Frases>
-                    <dte:Items>
-                        {"".join([f'''
-                        <dte:Item NumeroLinea="{i+1}" BienOServicio="B">
-                            <dte:Cantidad>{p['cantidad']:.4f}</dte:Cantidad>
-                            <dte:UnidadMedida>CA</dte:UnidadMedida>
-                            <dte:Descripcion>{p['descripcion']}</dte:Descripcion>
-                            <dte:PrecioUnitario>{p['precio_unitario']:.4f}</dte:PrecioUnitario>
-                            <dte:Precio>{p['subtotal']:.4f}</dte:Precio>
-                            <dte:Descuento>0</dte:Descuento>
-                            <dte:Impuestos>
-                                <dte:Impuesto>
-                                <dte:NombreCorto>IVA</dte:NombreCorto>
-                                <dte:CodigoUnidadGravable>1</dte:CodigoUnidadGravable>
-                                <dte:MontoGravable>{p['subtotal']/1.12:.4f}</dte:MontoGravable>
-                                <dte:MontoImpuesto>{(p['subtotal']/1.12) * 0.12:.4f}</dte:MontoImpuesto>
-                                </dte:Impuesto>
-                            </dte:Impuestos>
-                            <dte:Total>{p['subtotal']:.4f}</dte:Total>
-                        </dte:Item>''' for i, p in enumerate(invoice_data['productos'])])}
-                    </dte:Items>
-                    <dte:Totales>
-                        <dte:TotalImpuestos>
-                            <dte:TotalImpuesto NombreCorto="IVA" TotalMontoImpuesto="{(sum(p['subtotal'] for p in invoice_data['productos'])/1.12)*0.12:.4f}"/>
-                        </dte:TotalImpuestos>
-                        <dte:GranTotal>{invoice_data['monto_total']:.4f}</dte:GranTotal>
-                    </dte:Totales>
-                    </dte:DatosEmision>
-                </dte:DTE>
-            </dte:SAT>
-        </dte:GTDocumento>"""
-        return invoice_xml.strip()
+    def _write_certification_result(self, certification_data, pos_order=None, extra_move_vals=None):
+        """
+        Guarda el resultado de la certificación en la factura y en su orden de POS.
+        Si la certificación fue exitosa, antepone fel_reference-fel_number a la referencia.
+        `extra_move_vals` se guarda solo en la factura, en la misma escritura.
+        """
+        self.ensure_one()
+        certification_data = dict(certification_data)
+        signed_xml = certification_data.pop('signed_xml', None)
+        move_vals = dict(certification_data, **(extra_move_vals or {}))
+        if signed_xml:
+            move_vals.update(self._prepare_fel_signed_xml_vals(signed_xml, certification_data))
+        if certification_data.get('certified'):
+            fel_ref = f"{certification_data['fel_reference']}-{certification_data['fel_number']}"
+            move_vals['ref'] = f"{fel_ref} ({self.ref})" if self.ref else fel_ref
+            # El PDF se genera de nuevo, fuera de esta petición, con los datos certificados
+            move_vals['fel_pdf_attachment_id'] = False
+            move_vals['fel_contingency'] = False
+
+        self.write(move_vals)
+        if pos_order:
+            pos_order.write(certification_data)
+        if certification_data.get('certified'):
+            self._trigger_fel_pdf_render()
+
+    def _prepare_fel_signed_xml_attachment_vals(self, signed_xml, certification_data):
+        """ Valores del adjunto con el XML firmado comprimido. """
+        self.ensure_one()
+        name = certification_data.get('fel_authorization_number') or (self.name or 'DTE').replace('/', '_')
+        return {
+            'name': f"{name}.xml.gz",
+            'type': 'binary',
+            'raw': gzip.compress(signed_xml),
+            'res_model': 'account.move',
+            'res_id': self.id,
+            'mimetype': 'application/gzip',
+        }
+
+    def _prepare_fel_signed_xml_vals(self, signed_xml, certification_data):
+        """ Guarda el XML firmado comprimido en un adjunto y devuelve los valores que lo ligan a la factura. """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().create(
+            self._prepare_fel_signed_xml_attachment_vals(signed_xml, certification_data))
+        return {
+            'fel_xml_attachment_id': attachment.id,
+            'fel_xml_sha256': hashlib.sha256(signed_xml).hexdigest(),
+        }
+
+    def _get_fel_signed_xml(self):
+        """
+        Devuelve el XML firmado de la factura (bytes) desde su adjunto, sin llamar al API,
+        o None si no se guardó. Lanza una excepción si no coincide con su checksum.
+        """
+        self.ensure_one()
+        attachment = self.sudo().fel_xml_attachment_id
+        if not attachment:
+            return None
+        signed_xml = gzip.decompress(attachment.raw)
+        if self.fel_xml_sha256 and hashlib.sha256(signed_xml).hexdigest() != self.fel_xml_sha256:
+            raise Exception(f"El XML FEL guardado de la factura {self.name} no coincide con su checksum.")
+        return signed_xml
+
+    @api.model
+    def _trigger_fel_pdf_render(self):
+        """ Solicita al cron que genere los PDF de las facturas recién certificadas. """
+        cron = self.env.ref(f'{MODULE_NAME}.ir_cron_fel_render_pdf', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    def _get_fel_pdf_attachment(self):
+        """ Devuelve el PDF de la factura certificada, generándolo solo si aún no existe. """
+        self.ensure_one()
+        return self.fel_pdf_attachment_id or self._render_fel_pdf()
+
+    def _render_fel_pdf(self):
+        """ Genera el PDF de la factura y lo guarda como adjunto de la factura. """
+        self.ensure_one()
+        pdf_content, _content_type = self.env['ir.actions.report'].sudo()._render_qweb_pdf("account.account_invoices", self.ids)
+        attachment = self.env['ir.attachment'].sudo().create({
+            'name': f"{(self.name or 'INV').replace('/', '_')}.pdf",
+            'type': 'binary',
+            'raw': pdf_content,
+            'res_model': 'account.move',
+            'res_id': self.id,
+            'mimetype': 'application/pdf',
+        })
+        self.sudo().fel_pdf_attachment_id = attachment
+        return attachment
+
+    @api.model
+    def _cron_render_fel_pdfs(self, batch_size=FEL_PDF_BATCH_SIZE):
+        """ Genera los PDF pendientes de las facturas certificadas recientes. """
+        moves = self.search([
+            ('certified', '=', True),
+            ('fel_pdf_attachment_id', '=', False),
+            ('create_date', '>=', fields.Datetime.now() - timedelta(days=FEL_PDF_LOOKBACK_DAYS)),
+        ], limit=batch_size)
+        for move in moves:
+            try:
+                with self.env.cr.savepoint():
+                    move._render_fel_pdf()
+            except Exception as e:
+                _logger.error(f"❌ No se pudo generar el PDF de la factura {move.name}: {str(e)}")
+            self.env.cr.commit()
 
     def action_certify_again(self):
         """ Intenta certificar la factura nuevamente si la certificación falló. """
@@ -305,12 +655,8 @@ class AccountMove(models.Model):
         if not self.env.user.has_group('account.group_account_manager'):
             raise AccessError(_("No tienes permisos para certificar facturas."))
 
-        # 🔹 Obtener lista de empresas permitidas desde la configuración
-        allowed_companies_str = self.env['ir.config_parameter'].sudo().get_param('certify_allowed_companies', '')
-        allowed_companies = list(map(int, allowed_companies_str.split(','))) if allowed_companies_str else []
-
         # 🔹 Verificar si la empresa actual está en la lista de permitidas
-        if self.company_id.id not in allowed_companies:
+        if self.company_id.id not in self._get_certify_allowed_companies():
             raise AccessError(_("No tienes permiso para certificar facturas en esta empresa."))
 
         for record in self:
@@ -327,23 +673,14 @@ class AccountMove(models.Model):
 
                 pos_config = pos_order.session_id.config_id
 
-                # 🔹 Intentar certificar nuevamente
-                certification_data = record._certify_invoice_with_sat(pos_config)
+                # 🔹 Intentar certificar nuevamente, dentro del plazo de la petición
+                with fel_http.deadline(self.env['fel.settings']._get_deadline('manual')):
+                    certification_data = record._certify_invoice_with_sat(pos_config)
                 certification_data['certified'] = True
 
-                # 🔹 Guardar los nuevos datos de certificación
-                record.write(certification_data)
-                pos_order.write(certification_data)
-
-                # 🔹 Actualizar la referencia de la factura con la certificación
-                if record.ref:
-                    record.ref = f"{certification_data['fel_reference']}-{certification_data['fel_number']} ({record.ref})"
-                else:
-                    record.ref = f"{certification_data['fel_reference']}-{certification_data['fel_number']}"
-
-                # 🔹 Actualizar la nota y la fecha de la factura
-                record.write({
-                    'note': "Certificado exitosamente de Nuevo desde panel de facturas de venta en odoo",
+                # 🔹 Guardar los nuevos datos de certificación, la referencia, la nota y la fecha
+                record._write_certification_result(certification_data, pos_order, {
+                    'note': RECERTIFY_NOTE,
                     'invoice_date': fields.Datetime.now()
                 })
 
@@ -355,49 +692,11 @@ class AccountMove(models.Model):
                 _logger.error(error_message)
                 record.message_post(body=error_message)
 
-                certification_data = {
-                    "fel_number": "",
-                    "fel_reference": "",
-                    "fel_authorization_number": "",
-                    "fel_certificate_date": "",
-                    "note": f"⚠ Error en certificación FEL: {str(e)}",
-                    "certified": False
-                }
+                certification_data = self._get_certification_error_values(str(e))
 
                 # 🔹 Guardar estado de error en la factura y en la orden de POS
-                record.write(certification_data)
-                pos_order.write(certification_data)
+                record._write_certification_result(certification_data, pos_order)
 
-                # 🔹 Enviar correo de notificación de error
-                self._send_certification_error_email(record, certification_data)
+                # 🔹 Registrar el error; el cron de resumen envía la notificación por correo
+                self.env['fel.certification.error']._record(certification_data['note'], record, pos_order, autonomous=True)
                 raise UserError(_("No se pudo certificar la factura. Revisa el registro de errores."))
-
-    def _send_certification_error_email(self, record, certification_data):
-        """ Envía un correo cuando la certificación falla """
-        order_name = record.name or "Factura desconocida"
-        order_note = certification_data.get("note", "No hay detalles disponibles")
-
-        # 🔹 Crear el contenido del correo
-        email_body = f"""
-            <p><strong>ERROR DE CERTIFICACIÓN</strong></p>
-            <p><strong>Factura:</strong> {order_name}</p>
-            <p><strong>Detalles del error:</strong> {order_note}</p>
-            <p>Por favor, revise y solucione el problema.</p>
-            <p>Saludos,</p>
-            <p>El equipo de soporte</p>
-        """
-
-        # 🔹 Obtener el correo del destinatario desde la configuración
-        email_to = self.env['ir.config_parameter'].sudo().get_param('fel_error_email', 'juancarlos@olivegt.com')
-
-        mail_values = {
-            'subject': f"Error en Certificación FEL para la Factura {order_name}",
-            'email_from': self.env.user.email or 'noreply@tuempresa.com',
-            'email_to': email_to,
-            'body_html': email_body,
-        }
-        mail = self.env['mail.mail'].create(mail_values)
-        mail.send()
-
-        _logger.info(f"📩 Correo enviado a {email_to} con contenido:\n{email_body}")
-
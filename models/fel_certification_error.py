@@ -0,0 +1,101 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from markupsafe import escape
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+ERROR_RETENTION_DAYS = 30  # Días que se conservan los errores ya notificados
+DIGEST_MAX_DOCUMENTS = 20  # Documentos listados por cada mensaje de error en el resumen
+
+
+class FelCertificationError(models.Model):
+    _name = 'fel.certification.error'
+    _description = 'Error de Certificación FEL'
+    _order = 'id desc'
+
+    company_id = fields.Many2one('res.company', string="Compañía", required=True, index=True)
+    move_id = fields.Many2one('account.move', string="Factura", ondelete='cascade')
+    pos_order_id = fields.Many2one('pos.order', string="Orden POS", ondelete='cascade')
+    document_name = fields.Char("Documento")
+    message = fields.Text("Error")
+    notified = fields.Boolean("Notificado", default=False, index=True)
+
+    @api.model
+    def _record(self, message, move=None, pos_order=None, autonomous=False):
+        """
+        Registra un error de certificación. El correo se envía después, agrupado, por el cron
+        de resumen; aquí solo se inserta una fila.
+        Con `autonomous` la fila se guarda en su propia transacción, para que no se pierda
+        cuando el llamador lanza una excepción y revierte la suya.
+        """
+        if autonomous:
+            with self.env.registry.cursor() as cr:
+                self.with_env(self.env(cr=cr))._record(message, move and move.with_env(self.env(cr=cr)),
+                                                       pos_order and pos_order.with_env(self.env(cr=cr)))
+            return self.browse()
+
+        document = pos_order or move
+        return self.sudo().create({
+            'company_id': document.company_id.id if document else self.env.company.id,
+            'move_id': move.id if move else False,
+            'pos_order_id': pos_order.id if pos_order else False,
+            'document_name': document.name if document else False,
+            'message': message,
+        })
+
+    @api.model
+    def _cron_send_digest(self):
+        """ Envía un correo por compañía con los errores pendientes, agrupados por mensaje. """
+        errors = self.search([('notified', '=', False)], order='id')
+        if not errors:
+            return
+
+        email_to = self.env['fel.settings']._get().error_email
+        errors_by_company = defaultdict(lambda: self.browse())
+        for error in errors:
+            errors_by_company[error.company_id] |= error
+
+        for company, company_errors in errors_by_company.items():
+            self.env['mail.mail'].sudo().create({
+                'subject': f"Errores de Certificación FEL - {company.name} ({len(company_errors)})",
+                'email_from': company.email or 'noreply@tuempresa.com',
+                'email_to': email_to,
+                'body_html': company_errors._get_digest_body(),
+            }).send()
+            company_errors.write({'notified': True})
+            self.env.cr.commit()
+            _logger.info(f"📩 Resumen de {len(company_errors)} errores FEL enviado a {email_to} para {company.name}")
+
+    def _get_digest_body(self):
+        """ Cuerpo HTML del resumen: una fila por mensaje de error con sus documentos. """
+        documents_by_message = defaultdict(list)
+        for error in self:
+            documents_by_message[error.message or ""].append(error.document_name or "Documento desconocido")
+
+        rows = []
+        for message, documents in sorted(documents_by_message.items(), key=lambda item: -len(item[1])):
+            listed = ", ".join(str(escape(name)) for name in documents[:DIGEST_MAX_DOCUMENTS])
+            if len(documents) > DIGEST_MAX_DOCUMENTS:
+                listed += f" y {len(documents) - DIGEST_MAX_DOCUMENTS} más"
+            rows.append(f"<tr><td>{len(documents)}</td><td>{escape(message)}</td><td>{listed}</td></tr>")
+
+        return f"""
+            <p><strong>ERRORES DE CERTIFICACIÓN</strong></p>
+            <table border="1" cellpadding="4" style="border-collapse: collapse;">
+                <tr><th>Cantidad</th><th>Detalles del error</th><th>Documentos</th></tr>
+                {"".join(rows)}
+            </table>
+            <p>Por favor, revise y solucione el problema.</p>
+            <p>Saludos,</p>
+            <p>El equipo de soporte</p>
+        """
+
+    @api.autovacuum
+    def _gc_notified_errors(self):
+        """ Elimina los errores ya notificados más antiguos que ERROR_RETENTION_DAYS. """
+        self.search([
+            ('notified', '=', True),
+            ('create_date', '<', fields.Datetime.now() - timedelta(days=ERROR_RETENTION_DAYS)),
+        ]).unlink()
@@ -0,0 +1,165 @@
+import logging
+from datetime import timedelta
+from odoo import models, fields, api, _
+from ..tools import fel_http
+from ..tools.fel_http import DeadlineExceeded
+
+_logger = logging.getLogger(__name__)
+
+# Nombre técnico del módulo, usado para resolver los XML ids de los crons
+MODULE_NAME = __name__.split('.')[2]
+
+QUEUE_BATCH_SIZE = 20  # Facturas procesadas por cada ejecución del cron
+QUEUE_MAX_ATTEMPTS = 6  # Intentos antes de marcar la factura como fallida
+QUEUE_BACKOFF_BASE = 60  # Segundos de espera tras el primer fallo
+QUEUE_BACKOFF_MAX = 3600  # Espera máxima entre intentos
+
+
+class FelCertificationQueue(models.Model):
+    _name = 'fel.certification.queue'
+    _description = 'Cola de Certificación FEL'
+    _order = 'next_attempt_at, id'
+
+    move_id = fields.Many2one('account.move', string="Factura", required=True, ondelete='cascade', index=True)
+    pos_order_id = fields.Many2one('pos.order', string="Orden POS", ondelete='set null', index=True)
+    pos_config_id = fields.Many2one('pos.config', string="Punto de Venta", ondelete='set null')
+    company_id = fields.Many2one(related='move_id.company_id', store=True)
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Certificada'),
+        ('failed', 'Fallida'),
+    ], string="Estado", default='pending', required=True, index=True)
+    attempts = fields.Integer("Intentos", default=0)
+    next_attempt_at = fields.Datetime("Próximo Intento", default=fields.Datetime.now, required=True, index=True)
+    last_error = fields.Text("Último Error")
+
+    @api.model
+    def _enqueue(self, move, pos_order=None):
+        """
+        Encola una factura para certificación FEL y despierta a los crons de la cola.
+        Si la factura ya tiene un registro pendiente, se reutiliza.
+        """
+        job = self.search([('move_id', '=', move.id), ('state', '=', 'pending')], limit=1)
+        if not job:
+            job = self.create({
+                'move_id': move.id,
+                'pos_order_id': pos_order.id if pos_order else False,
+                'pos_config_id': pos_order.session_id.config_id.id if pos_order else False,
+            })
+        # Con el circuito abierto no tiene sentido despertar a los crons; el registro espera en la cola
+        if self.env['fel.circuit.breaker']._is_available('certify', move.company_id):
+            self._trigger_workers()
+        return job
+
+    @api.model
+    def _trigger_workers(self):
+        """Solicita la ejecución inmediata de los crons de la cola."""
+        for xml_id in ('ir_cron_fel_certification_queue', 'ir_cron_fel_certification_queue_2'):
+            cron = self.env.ref(f'{MODULE_NAME}.{xml_id}', raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger()
+
+    @api.model
+    def _claim_next(self):
+        """
+        Reserva el siguiente registro pendiente. `SKIP LOCKED` permite que varios
+        crons trabajen en paralelo sin bloquearse ni procesar la misma factura.
+        """
+        self.env.cr.execute("""
+            SELECT id
+              FROM fel_certification_queue
+             WHERE state = 'pending'
+               AND next_attempt_at <= (now() at time zone 'UTC')
+             ORDER BY next_attempt_at, id
+             LIMIT 1
+               FOR UPDATE SKIP LOCKED
+        """)
+        row = self.env.cr.fetchone()
+        return self.browse(row[0]) if row else self.browse()
+
+    @api.model
+    def _cron_process_queue(self, batch_size=QUEUE_BATCH_SIZE):
+        """ Procesa hasta `batch_size` facturas, confirmando la transacción tras cada una. """
+        for _i in range(batch_size):
+            job = self._claim_next()
+            if not job:
+                break
+            with fel_http.deadline(self.env['fel.settings']._get_deadline('cron')):
+                job._process()
+            self.env.cr.commit()
+
+    @api.model
+    def _get_backoff_delay(self, attempts):
+        """Espera exponencial en segundos tras `attempts` fallos, acotada por QUEUE_BACKOFF_MAX."""
+        return min(QUEUE_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), QUEUE_BACKOFF_MAX)
+
+    def _process(self):
+        """ Certifica la factura del registro y guarda el resultado en `account.move` y `pos.order`. """
+        self.ensure_one()
+        move = self.move_id
+
+        if move.certified:
+            self.write({'state': 'done'})
+            return
+
+        # 🔹 Con el circuito abierto no se llama a la SAT ni se consume un intento
+        if not self.env['fel.circuit.breaker']._is_available('certify', move.company_id):
+            self.write({'next_attempt_at': fields.Datetime.now() + timedelta(seconds=QUEUE_BACKOFF_BASE)})
+            return
+
+        pos_config = self.pos_config_id or self.pos_order_id.session_id.config_id
+
+        try:
+            _logger.info(f"🔄 Certificando desde la cola la factura {move.name} (intento {self.attempts + 1})...")
+            certification_data = move._certify_invoice_with_sat(pos_config)
+            certification_data['certified'] = True
+        except DeadlineExceeded as e:
+            # No se envió nada a la SAT: se reprograma sin consumir un intento
+            _logger.warning(f"⚠ Factura {move.name} sin plazo para certificarse, se reprograma: {e}")
+            self.write({'last_error': str(e), 'next_attempt_at': fields.Datetime.now()})
+            return
+        except Exception as e:
+            self._handle_failure(str(e))
+            return
+
+        move._write_certification_result(certification_data, self.pos_order_id)
+        self.write({
+            'state': 'done',
+            'attempts': self.attempts + 1,
+            'last_error': False,
+        })
+        _logger.info(f"✅ Factura {move.name} certificada correctamente desde la cola.")
+
+    def _handle_failure(self, error):
+        """ Registra el error y programa un nuevo intento, o marca la factura como fallida. """
+        self.ensure_one()
+        attempts = self.attempts + 1
+        _logger.error(f"❌ Error en la certificación FEL de {self.move_id.name} (intento {attempts}): {error}")
+
+        if attempts < QUEUE_MAX_ATTEMPTS:
+            self.write({
+                'attempts': attempts,
+                'last_error': error,
+                'next_attempt_at': fields.Datetime.now() + timedelta(seconds=self._get_backoff_delay(attempts)),
+            })
+            return
+
+        self.write({
+            'state': 'failed',
+            'attempts': attempts,
+            'last_error': error,
+        })
+        certification_data = self.move_id._get_certification_error_values(error)
+        self.move_id._write_certification_result(certification_data, self.pos_order_id)
+
+        # 🔹 Registrar el error solo cuando se agotan los intentos; el cron de resumen lo notifica
+        self.env['fel.certification.error']._record(certification_data['note'], self.move_id, self.pos_order_id)
+
+    def action_retry(self):
+        """ Vuelve a poner en cola los registros fallidos. """
+        self.filtered(lambda job: job.state == 'failed').write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt_at': fields.Datetime.now(),
+        })
+        self._trigger_workers()
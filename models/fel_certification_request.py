@@ -0,0 +1,242 @@
+import gzip
+import time
+import logging
+import psycopg2
+from datetime import timedelta
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError, AccessError
+from ..tools import fel_http
+from ..tools.fel_http import OutcomeUnknown
+
+_logger = logging.getLogger(__name__)
+
+DEDUP_STALE_SECONDS = 120  # Un envío en curso más antiguo quedó abandonado y sin confirmar; supera el timeout de la SAT
+DEDUP_WAIT_SECONDS = 90  # Espera máxima por un envío en curso de la misma factura en otro proceso
+DEDUP_POLL_INTERVAL = 0.5  # Segundos entre cada consulta mientras se espera
+DEDUP_RETENTION_DAYS = 30  # Días que se conservan los registros de facturas ya certificadas
+
+CERTIFICATION_FIELDS = ('fel_number', 'fel_reference', 'fel_authorization_number', 'fel_certificate_date')
+
+
+class FelCertificationRequest(models.Model):
+    """
+    Registro de idempotencia de la certificación: una fila por factura.
+    Garantiza que el DTE de una factura se envíe a la SAT una sola vez a la vez, y que una vez
+    autorizada se reutilice la autorización guardada en lugar de llamar de nuevo al API.
+    Las filas se escriben en transacciones propias: la autorización queda guardada aunque la
+    transacción del llamador se revierta después. Por eso solo se certifican facturas ya
+    confirmadas en la base de datos. El XML firmado se guarda comprimido junto con la
+    autorización, así la factura recibe su adjunto también cuando se reutiliza.
+    Un envío que pudo llegar a la SAT sin que se conozca la respuesta (timeout de lectura,
+    conexión cortada o proceso caído a media llamada) queda sin confirmar y no se reenvía
+    hasta que la conciliación o un administrador confirmen si la SAT lo autorizó.
+    """
+    _name = 'fel.certification.request'
+    _description = 'Solicitud de Certificación FEL'
+    _rec_name = 'move_id'
+    _order = 'id desc'
+
+    move_id = fields.Many2one('account.move', string="Factura", required=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string="Compañía", required=True, ondelete='cascade')
+    state = fields.Selection([
+        ('in_flight', 'En Curso'),
+        ('done', 'Certificada'),
+        ('failed', 'Fallida'),
+        ('unknown', 'Sin Confirmar'),
+    ], string="Estado", required=True, default='in_flight')
+    started_at = fields.Datetime("Enviada", required=True, default=fields.Datetime.now)
+    fel_number = fields.Char("FEL Número de Factura")
+    fel_reference = fields.Char("FEL Referencia")
+    fel_authorization_number = fields.Char("FEL Número de Autorización")
+    fel_certificate_date = fields.Char("FEL Fecha de Certificación")
+    fel_signed_xml = fields.Binary("XML Firmado (gzip)", attachment=False, readonly=True)
+    last_error = fields.Text("Último Error")
+
+    _sql_constraints = [
+        ('move_unique', 'unique(move_id)', 'La factura ya tiene una solicitud de certificación.'),
+    ]
+
+    @api.model
+    def _try_claim(self, move):
+        """
+        Intenta reservar el envío del DTE de la factura.
+        Devuelve ('owner', None) si este llamador debe enviarlo, ('done', datos) si ya fue
+        autorizado, ('busy', None) si otro proceso lo está enviando en este momento, o
+        ('unknown', None) si un envío anterior quedó sin confirmar.
+        """
+        with self.env.registry.cursor() as cr:
+            # La fila referencia la factura: si aún no está confirmada, el INSERT esperaría a la
+            # transacción del llamador, que a su vez espera esta respuesta
+            cr.execute("SELECT 1 FROM account_move WHERE id = %s", (move.id,))
+            if not cr.fetchone():
+                raise UserError(_("La factura %s debe guardarse antes de certificarse; "
+                                  "certifíquela después de confirmar la transacción.", move.name))
+            cr.execute("""
+                INSERT INTO fel_certification_request (move_id, company_id, state, started_at,
+                                                       create_uid, create_date, write_uid, write_date)
+                VALUES (%(move_id)s, %(company_id)s, 'in_flight', (now() at time zone 'UTC'),
+                        %(uid)s, (now() at time zone 'UTC'), %(uid)s, (now() at time zone 'UTC'))
+                ON CONFLICT (move_id) DO UPDATE
+                   SET state = 'in_flight', started_at = EXCLUDED.started_at, last_error = NULL,
+                       write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+                 WHERE fel_certification_request.state = 'failed'
+             RETURNING id
+            """, {'move_id': move.id, 'company_id': move.company_id.id, 'uid': self.env.uid})
+            if cr.fetchone():
+                return 'owner', None
+
+            # Un envío en curso que no terminó a tiempo pudo llegar a la SAT: queda sin confirmar
+            cr.execute("""
+                UPDATE fel_certification_request
+                   SET state = 'unknown', last_error = %s, write_date = (now() at time zone 'UTC')
+                 WHERE move_id = %s AND state = 'in_flight'
+                   AND started_at < (now() at time zone 'UTC') - %s * interval '1 second'
+            """, ("El envío en curso se abandonó sin respuesta.", move.id, DEDUP_STALE_SECONDS))
+
+            cr.execute(f"""
+                SELECT state, {', '.join(CERTIFICATION_FIELDS)}, fel_signed_xml
+                  FROM fel_certification_request
+                 WHERE move_id = %s
+            """, (move.id,))
+            state, *values = cr.fetchone()
+        if state == 'done':
+            return 'done', self._to_certification_data(values)
+        if state == 'unknown':
+            return 'unknown', None
+        return 'busy', None
+
+    @api.model
+    def _get_unknown_message(self, move):
+        return _("La certificación de la factura %s quedó sin confirmar: el DTE pudo llegar a la SAT. "
+                 "No se reenvía hasta confirmar en Digifact si fue autorizado.", move.name)
+
+    @api.model
+    def _to_certification_data(self, values):
+        """Datos de certificación (como los devuelve el API) a partir de una fila `done`."""
+        *values, signed_xml_gz = values
+        certification_data = dict(zip(CERTIFICATION_FIELDS, values))
+        certification_data['signed_xml'] = gzip.decompress(bytes(signed_xml_gz)) if signed_xml_gz else None
+        return certification_data
+
+    @api.model
+    def _get_done_results(self, move_ids):
+        """Devuelve {id de factura: datos de certificación} de las facturas con una autorización guardada."""
+        if not move_ids:
+            return {}
+        self.env.cr.execute(f"""
+            SELECT move_id, {', '.join(CERTIFICATION_FIELDS)}, fel_signed_xml
+              FROM fel_certification_request
+             WHERE move_id IN %s AND state = 'done'
+        """, (tuple(move_ids),))
+        return {move_id: self._to_certification_data(values) for move_id, *values in self.env.cr.fetchall()}
+
+    @api.model
+    def _finish(self, move, result):
+        """
+        Guarda el resultado del envío: los datos de certificación o la excepción. Una excepción
+        OutcomeUnknown deja el envío sin confirmar; las demás ocurrieron antes de enviar el DTE
+        o son un rechazo de la SAT, y permiten enviarlo de nuevo.
+        """
+        with self.env.registry.cursor() as cr:
+            if isinstance(result, Exception):
+                cr.execute("""
+                    UPDATE fel_certification_request
+                       SET state = %s, last_error = %s, write_date = (now() at time zone 'UTC')
+                     WHERE move_id = %s AND state = 'in_flight'
+                """, ('unknown' if isinstance(result, OutcomeUnknown) else 'failed', str(result), move.id))
+            else:
+                # La fila se crea si no existe: la autorización puede venir de otro lado (conciliación)
+                signed_xml = result.get('signed_xml')
+                cr.execute(f"""
+                    INSERT INTO fel_certification_request (move_id, company_id, state, started_at,
+                                                           {', '.join(CERTIFICATION_FIELDS)}, fel_signed_xml,
+                                                           create_uid, create_date, write_uid, write_date)
+                    VALUES (%(move_id)s, %(company_id)s, 'done', (now() at time zone 'UTC'),
+                            {', '.join(f'%({name})s' for name in CERTIFICATION_FIELDS)}, %(signed_xml)s,
+                            %(uid)s, (now() at time zone 'UTC'), %(uid)s, (now() at time zone 'UTC'))
+                    ON CONFLICT (move_id) DO UPDATE
+                       SET state = 'done', last_error = NULL, write_uid = EXCLUDED.write_uid,
+                           write_date = EXCLUDED.write_date,
+                           {', '.join(f'{name} = EXCLUDED.{name}' for name in CERTIFICATION_FIELDS)},
+                           fel_signed_xml = EXCLUDED.fel_signed_xml
+                """, dict(
+                    {name: result.get(name) for name in CERTIFICATION_FIELDS},
+                    move_id=move.id,
+                    company_id=move.company_id.id,
+                    uid=self.env.uid,
+                    signed_xml=psycopg2.Binary(gzip.compress(signed_xml)) if signed_xml else None,
+                ))
+
+    @api.model
+    def _release_unknown(self, move, reason):
+        """ Permite enviar de nuevo un DTE sin confirmar que se comprobó que la SAT no autorizó. """
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                UPDATE fel_certification_request
+                   SET state = 'failed', last_error = %s, write_date = (now() at time zone 'UTC')
+                 WHERE move_id = %s AND state = 'unknown'
+            """, (reason, move.id))
+
+    @api.model
+    def _certify_once(self, move, send):
+        """
+        Certifica la factura con `send()` a lo sumo una vez. Si la factura ya fue autorizada
+        devuelve la autorización guardada; si otro proceso la está enviando, espera su resultado.
+        """
+        # La espera no pasa del plazo del punto de entrada, si lo hay
+        remaining = fel_http.get_remaining()
+        deadline = time.monotonic() + (min(DEDUP_WAIT_SECONDS, remaining) if remaining is not None else DEDUP_WAIT_SECONDS)
+        while True:
+            state, certification_data = self._try_claim(move)
+            if state == 'done':
+                _logger.info(f"♻ Factura {move.name} ya certificada, se reutiliza la autorización guardada.")
+                return certification_data
+            if state == 'owner':
+                break
+            if state == 'unknown':
+                raise UserError(self._get_unknown_message(move))
+            if time.monotonic() >= deadline:
+                raise Exception(f"La certificación de la factura {move.name} sigue en curso en otro proceso.")
+            time.sleep(DEDUP_POLL_INTERVAL)
+
+        try:
+            certification_data = send()
+        except Exception as e:
+            self._finish(move, e)
+            raise
+        self._finish(move, certification_data)
+        return certification_data
+
+    def action_confirm_not_sent(self):
+        """
+        El administrador confirmó en Digifact que el DTE no fue autorizado: la factura puede
+        enviarse de nuevo en el siguiente intento.
+        """
+        self._check_can_settle()
+        self.write({'state': 'failed', 'last_error': _("Confirmado sin autorizar en Digifact por %s.", self.env.user.name)})
+
+    def action_confirm_authorized(self):
+        """
+        El administrador copió de Digifact la autorización del DTE: se reutiliza en el siguiente
+        intento de la cola o del asistente, sin enviarlo de nuevo.
+        """
+        self._check_can_settle()
+        for request in self:
+            if not request.fel_authorization_number or not request.fel_number:
+                raise UserError(_("Indique el número de autorización y el número FEL que muestra Digifact."))
+        self.write({'state': 'done', 'last_error': False})
+
+    def _check_can_settle(self):
+        if not self.env.user.has_group('account.group_account_manager'):
+            raise AccessError(_("No tienes permisos para confirmar certificaciones."))
+        if any(request.state != 'unknown' for request in self):
+            raise UserError(_("Solo pueden confirmarse las certificaciones sin confirmar."))
+
+    @api.autovacuum
+    def _gc_certified_requests(self):
+        """ Elimina los registros antiguos de facturas cuya certificación ya quedó guardada en la factura. """
+        self.search([
+            ('state', '!=', 'in_flight'),
+            ('write_date', '<', fields.Datetime.now() - timedelta(days=DEDUP_RETENTION_DAYS)),
+            '|', ('state', '=', 'failed'), ('move_id.certified', '=', True),
+        ]).unlink()
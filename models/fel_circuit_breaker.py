@@ -0,0 +1,166 @@
+import logging
+from odoo import models, fields, api
+from ..tools.fel_http import ServiceUnavailable, DeadlineExceeded
+
+_logger = logging.getLogger(__name__)
+
+CIRCUIT_FAILURE_THRESHOLD = 5  # Fallos consecutivos que abren el circuito
+CIRCUIT_OPEN_SECONDS = 60  # Segundos que el circuito permanece abierto antes de probar
+CIRCUIT_PROBE_SECONDS = 90  # Tiempo máximo de una prueba; debe superar el timeout de la llamada
+
+
+class FelCircuitBreaker(models.Model):
+    """
+    Circuit breaker por endpoint de Digifact y compañía, compartido por todos los workers.
+    El estado vive en la base de datos y se actualiza en transacciones propias, así los
+    cambios se ven de inmediato en los demás workers aunque el llamador revierta la suya.
+    """
+    _name = 'fel.circuit.breaker'
+    _description = 'Circuit Breaker FEL'
+    _rec_name = 'endpoint'
+
+    endpoint = fields.Selection([
+        ('token', 'Token'),
+        ('certify', 'Certificación'),
+        ('document', 'Consulta de DTE'),
+    ], string="Endpoint", required=True)
+    company_id = fields.Many2one('res.company', string="Compañía", required=True, ondelete='cascade')
+    state = fields.Selection([
+        ('closed', 'Cerrado'),
+        ('open', 'Abierto'),
+        ('half_open', 'Probando'),
+    ], string="Estado", default='closed', required=True)
+    failure_count = fields.Integer("Fallos Consecutivos", default=0)
+    opened_until = fields.Datetime("Abierto Hasta")
+    probe_until = fields.Datetime("Prueba Hasta")
+
+    _sql_constraints = [
+        ('endpoint_company_unique', 'unique(endpoint, company_id)', 'Ya existe un circuito para este endpoint y compañía.'),
+    ]
+
+    @api.model
+    def _get_settings(self):
+        settings = self.env['fel.settings']._get()
+        return {
+            'threshold': settings.circuit_failure_threshold,
+            'open_seconds': settings.circuit_open_seconds,
+        }
+
+    @api.model
+    def _get_status(self, endpoint, company):
+        """
+        Estado actual del circuito: (estado, fallos, si la ventana de apertura o de prueba ya venció).
+        """
+        self.env.cr.execute("""
+            SELECT state, failure_count,
+                   CASE state
+                       WHEN 'open' THEN opened_until <= (now() at time zone 'UTC')
+                       WHEN 'half_open' THEN probe_until <= (now() at time zone 'UTC')
+                       ELSE TRUE
+                   END
+              FROM fel_circuit_breaker
+             WHERE endpoint = %s AND company_id = %s
+        """, (endpoint, company.id))
+        return self.env.cr.fetchone() or ('closed', 0, True)
+
+    @api.model
+    def _is_available(self, endpoint, company):
+        """Indica, sin hacer cambios, si una llamada al endpoint podría hacerse ahora."""
+        state, _failure_count, expired = self._get_status(endpoint, company)
+        return state == 'closed' or expired
+
+    @api.model
+    def _check(self, endpoint, company):
+        """
+        Lanza ServiceUnavailable si el circuito está abierto. Cuando la ventana de apertura vence,
+        solo un llamador (en cualquier worker) pasa como prueba; los demás siguen fallando rápido.
+        Devuelve True si el circuito estaba limpio (cerrado y sin fallos).
+        """
+        state, failure_count, expired = self._get_status(endpoint, company)
+        if state == 'closed':
+            return failure_count == 0
+        if expired and self._claim_probe(endpoint, company):
+            _logger.info("🔌 Circuito FEL %s de la compañía %s en prueba.", endpoint, company.name)
+            return False
+        raise ServiceUnavailable(f"Servicio FEL '{endpoint}' no disponible temporalmente (circuito abierto).")
+
+    @api.model
+    def _claim_probe(self, endpoint, company):
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                UPDATE fel_circuit_breaker
+                   SET state = 'half_open',
+                       probe_until = (now() at time zone 'UTC') + %s * interval '1 second',
+                       write_date = (now() at time zone 'UTC')
+                 WHERE endpoint = %s AND company_id = %s
+                   AND ((state = 'open' AND opened_until <= (now() at time zone 'UTC'))
+                        OR (state = 'half_open' AND probe_until <= (now() at time zone 'UTC')))
+             RETURNING id
+            """, (CIRCUIT_PROBE_SECONDS, endpoint, company.id))
+            return bool(cr.fetchone())
+
+    @api.model
+    def _record_success(self, endpoint, company):
+        """Cierra el circuito y reinicia el contador de fallos."""
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                UPDATE fel_circuit_breaker
+                   SET state = 'closed', failure_count = 0, opened_until = NULL, probe_until = NULL,
+                       write_date = (now() at time zone 'UTC')
+                 WHERE endpoint = %s AND company_id = %s
+                   AND (state != 'closed' OR failure_count != 0)
+            """, (endpoint, company.id))
+
+    @api.model
+    def _record_failure(self, endpoint, company):
+        """
+        Suma un fallo. El circuito se abre al llegar al umbral, o de inmediato si falla la prueba.
+        """
+        settings = self._get_settings()
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                INSERT INTO fel_circuit_breaker (endpoint, company_id, state, failure_count,
+                                                 create_uid, create_date, write_uid, write_date)
+                VALUES (%s, %s, 'closed', 0, %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))
+                ON CONFLICT (endpoint, company_id) DO NOTHING
+            """, (endpoint, company.id, self.env.uid, self.env.uid))
+            cr.execute("""
+                UPDATE fel_circuit_breaker
+                   SET failure_count = failure_count + 1,
+                       state = CASE WHEN state = 'half_open' OR failure_count + 1 >= %(threshold)s
+                                    THEN 'open' ELSE state END,
+                       opened_until = CASE WHEN state = 'half_open' OR failure_count + 1 >= %(threshold)s
+                                           THEN (now() at time zone 'UTC') + %(open_seconds)s * interval '1 second'
+                                           ELSE opened_until END,
+                       probe_until = NULL,
+                       write_date = (now() at time zone 'UTC')
+                 WHERE endpoint = %(endpoint)s AND company_id = %(company_id)s
+             RETURNING state
+            """, dict(settings, endpoint=endpoint, company_id=company.id))
+            state = cr.fetchone()[0]
+        if state == 'open':
+            _logger.warning("⚡ Circuito FEL %s de la compañía %s abierto.", endpoint, company.name)
+
+    @api.model
+    def _call(self, endpoint, company, func, *args, **kwargs):
+        """
+        Ejecuta `func` protegida por el circuito. Solo los errores ServiceUnavailable (conexión,
+        timeout o 5xx) cuentan como fallos; los rechazos de la SAT no abren el circuito.
+        """
+        clean = self._check(endpoint, company)
+        try:
+            result = func(*args, **kwargs)
+        except DeadlineExceeded:
+            # Se agotó el plazo del llamador antes de enviar: no dice nada del servicio
+            raise
+        except ServiceUnavailable:
+            self._record_failure(endpoint, company)
+            raise
+        except Exception:
+            # El servicio respondió, aunque haya rechazado la petición
+            if not clean:
+                self._record_success(endpoint, company)
+            raise
+        if not clean:
+            self._record_success(endpoint, company)
+        return result
@@ -0,0 +1,167 @@
+import io
+import csv
+import json
+import uuid
+import shutil
+import logging
+import tempfile
+import zipfile
+from odoo import models, api, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+EXPORT_FETCH_SIZE = 500  # Filas leídas del cursor del servidor por vez
+EXPORT_SPOOL_SIZE = 1024 * 1024  # Bytes del índice que se guardan en memoria antes de pasar a disco
+EXPORT_FORMATS = ('csv', 'json')
+EXPORT_COLUMNS = (
+    'id', 'name', 'invoice_date', 'company', 'partner_vat', 'partner_name', 'currency', 'amount_total',
+    'fel_reference', 'fel_number', 'fel_authorization_number', 'fel_certificate_date', 'xml_file',
+)
+
+
+class _ZipStream(io.RawIOBase):
+    """Destino del zip que acumula lo escrito hasta que se lee con `pop`; no admite seek."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class FelDteExport(models.AbstractModel):
+    """
+    Exportación de las facturas certificadas en un zip: un índice (CSV o JSON) y el XML
+    de cada factura. Las facturas se leen con un cursor del lado del servidor por bloques y
+    el zip se produce por partes, así la memoria no depende del número de facturas.
+    Desde un shell de Odoo:
+        with open('/tmp/dte.zip', 'wb') as f:
+            env['fel.dte.export']._export_to_file(f, '2024-01-01', '2024-01-31')
+    """
+    _name = 'fel.dte.export'
+    _description = 'Exportación de DTE Certificados'
+
+    @api.model
+    def _export_to_file(self, fileobj, date_from, date_to, export_format='csv', company_ids=None):
+        """Escribe el zip de la exportación en `fileobj`."""
+        for chunk in self._iter_zip(date_from, date_to, export_format, company_ids):
+            fileobj.write(chunk)
+
+    @api.model
+    def _iter_zip(self, date_from, date_to, export_format='csv', company_ids=None):
+        """Genera el zip de la exportación por partes (bytes)."""
+        if export_format not in EXPORT_FORMATS:
+            raise UserError(_("Formato de exportación no soportado: %s", export_format))
+        self.env['account.move'].check_access_rights('read')
+        companies = self.env.companies
+        if company_ids:
+            companies = companies.filtered(lambda company: company.id in company_ids)
+        if not companies:
+            return
+
+        stream = _ZipStream()
+        count = 0
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode='w+t', encoding='utf-8', newline='') as index, \
+                zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            writer = csv.DictWriter(index, fieldnames=EXPORT_COLUMNS) if export_format == 'csv' else None
+            if writer:
+                writer.writeheader()
+            else:
+                index.write("[")
+
+            for rows in self._iter_rows(date_from, date_to, companies.ids):
+                xml_by_move = self._read_xml_batch([row['id'] for row in rows])
+                for row in rows:
+                    xml_content = xml_by_move.get(row['id'])
+                    if xml_content:
+                        row['xml_file'] = f"xml/{row['fel_authorization_number'] or row['id']}.xml"
+                        archive.writestr(row['xml_file'], xml_content)
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        index.write(("," if count else "") + "\n" + json.dumps(row, ensure_ascii=False))
+                    count += 1
+                yield stream.pop()
+                # Cada bloque se descarta de la caché del ORM al terminar
+                self.env.invalidate_all()
+
+            if not writer:
+                index.write("\n]\n")
+            index.seek(0)
+            with archive.open(f"dtes.{export_format}", 'w', force_zip64=True) as entry, \
+                    io.TextIOWrapper(entry, encoding='utf-8', newline='') as entry_text:
+                shutil.copyfileobj(index, entry_text)
+        yield stream.pop()
+        _logger.info(f"📦 Exportación FEL de {count} facturas ({date_from} a {date_to}) generada.")
+
+    @api.model
+    def _iter_rows(self, date_from, date_to, company_ids):
+        """Lee las facturas certificadas con un cursor del servidor, en bloques de EXPORT_FETCH_SIZE filas."""
+        self.env.flush_all()
+        # Cursor con nombre: PostgreSQL entrega las filas por partes dentro de la transacción actual
+        server_cursor = self.env.cr._cnx.cursor(name=f"fel_dte_export_{uuid.uuid4().hex}")
+        try:
+            server_cursor.execute("""
+                SELECT m.id, m.name, m.invoice_date, c.name, p.vat, p.name, cur.name, m.amount_total,
+                       m.fel_reference, m.fel_number, m.fel_authorization_number, m.fel_certificate_date
+                  FROM account_move m
+                  JOIN res_company c ON c.id = m.company_id
+                  JOIN res_currency cur ON cur.id = m.currency_id
+                  LEFT JOIN res_partner p ON p.id = m.partner_id
+                 WHERE m.move_type = 'out_invoice'
+                   AND m.state = 'posted'
+                   AND m.certified IS TRUE
+                   AND m.invoice_date BETWEEN %s AND %s
+                   AND m.company_id IN %s
+                 ORDER BY m.invoice_date, m.id
+            """, (date_from, date_to, tuple(company_ids)))
+            while True:
+                rows = server_cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                yield [dict(zip(EXPORT_COLUMNS, [
+                    row_id, name, invoice_date and invoice_date.isoformat(), company, partner_vat, partner_name,
+                    currency, float(amount_total or 0.0), fel_reference, fel_number, authorization, certificate_date, None,
+                ])) for (row_id, name, invoice_date, company, partner_vat, partner_name, currency, amount_total,
+                         fel_reference, fel_number, authorization, certificate_date) in rows]
+        finally:
+            server_cursor.close()
+
+    @api.model
+    def _read_xml_batch(self, move_ids):
+        """
+        Devuelve {id de la factura: XML}: el XML firmado guardado al certificar o, si no
+        existe, el adjunto XML más reciente de la factura.
+        """
+        xml_by_move = {}
+        for move in self.env['account.move'].browse(move_ids).filtered('fel_xml_attachment_id'):
+            try:
+                xml_by_move[move.id] = move._get_fel_signed_xml()
+            except Exception as e:
+                _logger.error(f"❌ {e}")
+
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', 'account.move'),
+            ('res_id', 'in', [move_id for move_id in move_ids if move_id not in xml_by_move]),
+            ('mimetype', 'in', ('application/xml', 'text/xml')),
+        ], order='id desc')
+        for attachment in attachments:
+            if attachment.res_id not in xml_by_move:
+                xml_by_move[attachment.res_id] = attachment.raw
+        return xml_by_move
@@ -0,0 +1,87 @@
+import math
+from odoo import models, fields, api
+from ..tools import fel_metrics
+
+HISTOGRAM_NAME = 'fel_operation_duration_seconds'
+COUNTER_NAME = 'fel_operations_total'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels.items())
+
+
+def _format_le(le):
+    return "+Inf" if math.isinf(le) else repr(le)
+
+
+class FelMetric(models.Model):
+    """
+    Acumulados de las métricas FEL de todos los workers: una fila por operación, compañía,
+    resultado y bucket del histograma. Las filas las suma `tools.fel_metrics.flush`.
+    """
+    _name = 'fel.metric'
+    _description = 'Métrica FEL'
+    _order = 'operation, company_id, outcome, le'
+    _rec_name = 'operation'
+
+    operation = fields.Char("Operación", required=True)
+    company_id = fields.Many2one('res.company', string="Compañía", required=True, ondelete='cascade')
+    outcome = fields.Char("Resultado", required=True)
+    le = fields.Float("Límite del Bucket", required=True, help="Duración máxima en segundos de las llamadas del bucket.")
+    count = fields.Integer("Llamadas", default=0)
+    total_seconds = fields.Float("Segundos Totales", default=0.0)
+
+    _sql_constraints = [
+        ('series_unique', 'unique(operation, company_id, outcome, le)', 'La serie de la métrica ya existe.'),
+    ]
+
+    @api.model
+    def _render_prometheus(self):
+        """
+        Devuelve las métricas en el formato de texto de Prometheus. Antes de leerlas se vuelcan
+        los acumulados de este proceso; los de los demás workers llegan en su próximo volcado.
+        """
+        dbname = self.env.cr.dbname
+        fel_metrics.flush(dbname)
+
+        # Cursor nuevo: ve lo que otros workers hayan volcado después de empezar esta transacción
+        with self.env.registry.cursor() as cr:
+            cr.execute("""
+                SELECT m.operation, c.name, m.outcome, m.le, m.count, m.total_seconds
+                  FROM fel_metric m
+                  JOIN res_company c ON c.id = m.company_id
+                 ORDER BY m.operation, c.name, m.outcome, m.le
+            """)
+            rows = cr.fetchall()
+
+        series = {}
+        for operation, company, outcome, le, count, total_seconds in rows:
+            buckets = series.setdefault((operation, company, outcome), {})
+            buckets[le] = (count, total_seconds)
+
+        histogram = [
+            f"# HELP {HISTOGRAM_NAME} Duración de las operaciones FEL en segundos.",
+            f"# TYPE {HISTOGRAM_NAME} histogram",
+        ]
+        counter = [
+            f"# HELP {COUNTER_NAME} Operaciones FEL realizadas.",
+            f"# TYPE {COUNTER_NAME} counter",
+        ]
+        for (operation, company, outcome), buckets in series.items():
+            labels = _labels(operation=operation, company=company, outcome=outcome)
+            cumulative = 0
+            total_seconds = 0.0
+            for le in fel_metrics.BUCKETS:
+                count, seconds = buckets.get(le, (0, 0.0))
+                cumulative += count
+                total_seconds += seconds
+                histogram.append(f'{HISTOGRAM_NAME}_bucket{{{labels},le="{_format_le(le)}"}} {cumulative}')
+            histogram.append(f"{HISTOGRAM_NAME}_sum{{{labels}}} {total_seconds!r}")
+            histogram.append(f"{HISTOGRAM_NAME}_count{{{labels}}} {cumulative}")
+            counter.append(f"{COUNTER_NAME}{{{labels}}} {cumulative}")
+
+        return "\n".join(histogram + counter) + "\n"
@@ -0,0 +1,124 @@
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+NIT_CACHE_TTL = 7 * 24 * 3600  # Segundos que se reutiliza un NIT válido
+NIT_CACHE_NEGATIVE_TTL = 3600  # Segundos que se reutiliza un NIT inválido
+NIT_LRU_SIZE = 2048  # Entradas de la caché en memoria por proceso
+
+# Caché en memoria del proceso: (base de datos, NIT) -> (resultado, vence en time.monotonic())
+_nit_lru = OrderedDict()
+_nit_lru_lock = threading.Lock()
+
+
+def normalize_nit(vat):
+    """Normaliza un NIT para usarlo como llave: sin espacios ni guiones y en mayúsculas."""
+    return re.sub(r'[\s-]', '', vat or '').upper()
+
+
+def _lru_get(key):
+    with _nit_lru_lock:
+        entry = _nit_lru.get(key)
+        if not entry:
+            return None
+        result, expires_at = entry
+        if expires_at <= time.monotonic():
+            del _nit_lru[key]
+            return None
+        _nit_lru.move_to_end(key)
+        return dict(result)
+
+
+def _lru_put(key, result, ttl):
+    with _nit_lru_lock:
+        _nit_lru[key] = (dict(result), time.monotonic() + ttl)
+        _nit_lru.move_to_end(key)
+        while len(_nit_lru) > NIT_LRU_SIZE:
+            _nit_lru.popitem(last=False)
+
+
+class FelNitCache(models.Model):
+    _name = 'fel.nit.cache'
+    _description = 'Caché de Verificación de NIT'
+    _rec_name = 'nit'
+
+    nit = fields.Char("NIT", required=True, index=True)
+    name = fields.Char("Nombre")
+    address = fields.Char("Dirección")
+    valid = fields.Boolean("Válido")
+    error = fields.Char("Error")
+    fetched_at = fields.Datetime("Consultado", required=True)
+
+    _sql_constraints = [
+        ('nit_unique', 'unique(nit)', 'El NIT ya existe en la caché.'),
+    ]
+
+    @api.model
+    def _get_ttl(self, valid):
+        """TTL en segundos según el resultado, configurable en los parámetros del sistema."""
+        settings = self.env['fel.settings']._get()
+        return settings.nit_cache_ttl if valid else settings.nit_cache_negative_ttl
+
+    @api.model
+    def _get_cached_result(self, nit):
+        """
+        Devuelve el resultado guardado para el NIT si sigue vigente, o None.
+        Primero consulta la caché en memoria y luego la tabla.
+        """
+        key = (self.env.cr.dbname, nit)
+        result = _lru_get(key)
+        if result is not None:
+            return result
+
+        entry = self.sudo().search([('nit', '=', nit)], limit=1)
+        if not entry:
+            return None
+
+        ttl = self._get_ttl(entry.valid)
+        remaining = (entry.fetched_at + timedelta(seconds=ttl) - fields.Datetime.now()).total_seconds()
+        if remaining <= 0:
+            return None
+
+        result = entry._to_result()
+        _lru_put(key, result, remaining)
+        return dict(result)
+
+    def _to_result(self):
+        self.ensure_one()
+        if self.valid:
+            return {"valid": True, "company_name": self.name or "", "address": self.address or ""}
+        return {"valid": False, "error": self.error}
+
+    @api.model
+    def _store_result(self, nit, result):
+        """Guarda (o actualiza) el resultado de la verificación del NIT en la tabla y en memoria."""
+        valid = bool(result.get('valid'))
+        self.env.cr.execute("""
+            INSERT INTO fel_nit_cache (nit, name, address, valid, error, fetched_at,
+                                       create_uid, create_date, write_uid, write_date)
+            VALUES (%(nit)s, %(name)s, %(address)s, %(valid)s, %(error)s, (now() at time zone 'UTC'),
+                    %(uid)s, (now() at time zone 'UTC'), %(uid)s, (now() at time zone 'UTC'))
+            ON CONFLICT (nit) DO UPDATE
+               SET name = EXCLUDED.name,
+                   address = EXCLUDED.address,
+                   valid = EXCLUDED.valid,
+                   error = EXCLUDED.error,
+                   fetched_at = EXCLUDED.fetched_at,
+                   write_uid = EXCLUDED.write_uid,
+                   write_date = EXCLUDED.write_date
+        """, {
+            'nit': nit,
+            'name': result.get('company_name') if valid else None,
+            'address': result.get('address') if valid else None,
+            'valid': valid,
+            'error': None if valid else result.get('error'),
+            'uid': self.env.uid,
+        })
+        self.invalidate_model()
+        _lru_put((self.env.cr.dbname, nit), result, self._get_ttl(valid))
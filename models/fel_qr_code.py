@@ -0,0 +1,99 @@
+import base64
+import hashlib
+import logging
+import threading
+import qrcode
+import qrcode.image.svg
+from collections import OrderedDict
+from io import BytesIO
+from psycopg2 import IntegrityError
+from odoo import models, fields, api
+from ..tools import fel_metrics
+
+_logger = logging.getLogger(__name__)
+
+QR_FORMATS = ('png', 'svg')
+QR_LRU_SIZE = 512  # Códigos QR en memoria por proceso
+
+# Caché en memoria del proceso: (base de datos, llave) -> imagen en base64
+_qr_lru = OrderedDict()
+_qr_lru_lock = threading.Lock()
+
+
+def render_qr(qr_url, qr_format='png'):
+    """
+    Genera la imagen del código QR y la devuelve como bytes.
+    'png' produce un PNG de 1 bit optimizado; 'svg' produce un SVG de trazos que escala sin pérdida.
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(qr_url)
+    qr.make(fit=True)
+
+    temp = BytesIO()
+    if qr_format == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(temp)
+    else:
+        # Blanco y negro: la imagen es de modo '1' y se guarda como PNG de 1 bit
+        qr.make_image(fill_color='black', back_color='white').save(temp, format="PNG", optimize=True)
+    return temp.getvalue()
+
+
+class FelQrCode(models.Model):
+    _name = 'fel.qr.code'
+    _description = 'Código QR FEL'
+    _rec_name = 'key'
+
+    key = fields.Char("Llave", required=True, index=True, help="Hash del formato y la URL de verificación.")
+    qr_format = fields.Selection([('png', 'PNG'), ('svg', 'SVG')], string="Formato", required=True, default='png')
+    image = fields.Binary("Imagen", attachment=True)
+
+    _sql_constraints = [
+        ('key_unique', 'unique(key)', 'El código QR ya existe.'),
+    ]
+
+    @api.model
+    def _get_qr_format(self):
+        return self.env['fel.settings']._get().qr_format
+
+    @api.model
+    def _get_qr_code(self, qr_url, qr_format=None):
+        """
+        Devuelve en base64 el código QR de la URL. La imagen se genera la primera vez que
+        se pide y se guarda como adjunto; las siguientes lecturas la reutilizan.
+        """
+        qr_format = qr_format or self._get_qr_format()
+        key = hashlib.sha256(f"{qr_format}:{qr_url}".encode()).hexdigest()
+        lru_key = (self.env.cr.dbname, key)
+
+        with _qr_lru_lock:
+            image = _qr_lru.get(lru_key)
+            if image is not None:
+                _qr_lru.move_to_end(lru_key)
+                return image
+
+        qr_code = self.sudo().search([('key', '=', key)], limit=1)
+        if not qr_code:
+            qr_code = self.sudo()._create_qr_code(key, qr_url, qr_format)
+        image = qr_code.image.decode() if isinstance(qr_code.image, bytes) else qr_code.image
+
+        with _qr_lru_lock:
+            _qr_lru[lru_key] = image
+            while len(_qr_lru) > QR_LRU_SIZE:
+                _qr_lru.popitem(last=False)
+        return image
+
+    @api.model
+    def _create_qr_code(self, key, qr_url, qr_format):
+        """Genera y guarda el código QR; si otro proceso lo creó al mismo tiempo, usa ese."""
+        with fel_metrics.track(self.env.cr.dbname, 'qr_render', self.env.company.id):
+            image = base64.b64encode(render_qr(qr_url, qr_format))
+        try:
+            with self.env.cr.savepoint():
+                return self.create({'key': key, 'qr_format': qr_format, 'image': image})
+        except IntegrityError:
+            return self.search([('key', '=', key)], limit=1)
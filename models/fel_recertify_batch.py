@@ -0,0 +1,168 @@
+import time
+import logging
+from odoo import models, fields, api, _
+from ..tools import fel_http
+from ..tools.fel_http import DeadlineExceeded
+from .account_move import RECERTIFY_NOTE
+from .fel_certification_queue import MODULE_NAME
+
+_logger = logging.getLogger(__name__)
+
+RECERTIFY_CHUNK_SIZE = 50  # Facturas certificadas y confirmadas por lote
+RECERTIFY_MAX_WORKERS = 4  # Envíos en paralelo dentro de cada lote
+RECERTIFY_TIME_BUDGET = 240  # Segundos por ejecución del cron; después se vuelve a programar
+
+
+class FelRecertifyBatch(models.Model):
+    """
+    Certificación FEL masiva creada desde el asistente. Las facturas se certifican en el cron,
+    por lotes: los envíos de cada lote van en paralelo y la transacción se confirma tras cada
+    lote, así miles de facturas no dependen del plazo de una petición HTTP.
+    """
+    _name = 'fel.recertify.batch'
+    _description = 'Certificación FEL Masiva'
+    _order = 'id desc'
+
+    name = fields.Char("Descripción", required=True, default=lambda self: _("Certificación FEL masiva"))
+    user_id = fields.Many2one('res.users', string="Solicitada Por", default=lambda self: self.env.user, readonly=True)
+    state = fields.Selection([
+        ('running', 'En Proceso'),
+        ('done', 'Terminada'),
+        ('cancelled', 'Cancelada'),
+    ], string="Estado", default='running', required=True, index=True)
+    max_workers = fields.Integer("Certificaciones en Paralelo", default=RECERTIFY_MAX_WORKERS, required=True)
+    chunk_size = fields.Integer("Facturas por Lote", default=RECERTIFY_CHUNK_SIZE, required=True)
+    line_ids = fields.One2many('fel.recertify.batch.line', 'batch_id', string="Resultados")
+    pending_count = fields.Integer("Pendientes", compute='_compute_counts')
+    success_count = fields.Integer("Certificadas", compute='_compute_counts')
+    failure_count = fields.Integer("Con Error", compute='_compute_counts')
+    progress = fields.Float("Avance", compute='_compute_counts')
+    finished_at = fields.Datetime("Fin", readonly=True)
+
+    @api.depends('line_ids.state')
+    def _compute_counts(self):
+        groups = self.env['fel.recertify.batch.line']._read_group(
+            [('batch_id', 'in', self.ids)], ['batch_id', 'state'], ['batch_id', 'state'], lazy=False)
+        counts = {(group['batch_id'][0], group['state']): group['__count'] for group in groups}
+        for batch in self:
+            batch.pending_count = counts.get((batch.id, 'pending'), 0)
+            batch.success_count = counts.get((batch.id, 'done'), 0)
+            batch.failure_count = counts.get((batch.id, 'failed'), 0)
+            total = batch.pending_count + batch.success_count + batch.failure_count
+            batch.progress = 100.0 * (total - batch.pending_count) / total if total else 100.0
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref(f'{MODULE_NAME}.ir_cron_fel_recertify', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    def action_cancel(self):
+        """ Detiene la certificación; las facturas pendientes quedan como estaban. """
+        self.filtered(lambda batch: batch.state == 'running').write({
+            'state': 'cancelled',
+            'finished_at': fields.Datetime.now(),
+        })
+
+    @api.model
+    def _cron_process(self, time_budget=RECERTIFY_TIME_BUDGET):
+        """
+        Avanza las certificaciones masivas en proceso dentro del tiempo disponible. Lo que no
+        alcanza se continúa en una nueva ejecución del cron.
+        """
+        deadline = time.monotonic() + time_budget
+        for batch in self.search([('state', '=', 'running')], order='id'):
+            while batch.state == 'running':
+                if time.monotonic() >= deadline:
+                    self._trigger_cron()
+                    return
+                try:
+                    with fel_http.deadline(self.env['fel.settings']._get_deadline('cron')):
+                        complete = batch._process_next_chunk()
+                except Exception:
+                    self.env.cr.rollback()
+                    _logger.exception(f"❌ Error en la certificación FEL masiva '{batch.name}', se reintentará.")
+                    return
+                self.env.cr.commit()
+                # Liberar la caché del ORM: la memoria no crece con el número de lotes
+                self.env.invalidate_all()
+                if not complete:
+                    # El lote no alcanzó a enviarse dentro del plazo: se retoma en otra ejecución
+                    self._trigger_cron()
+                    return
+
+    def _process_next_chunk(self):
+        """
+        Certifica el siguiente lote de facturas pendientes y guarda una línea de resultado por
+        factura. Devuelve False si alguna factura quedó pendiente por falta de plazo.
+        """
+        self.ensure_one()
+        lines = self.env['fel.recertify.batch.line'].search(
+            [('batch_id', '=', self.id), ('state', '=', 'pending')], order='id', limit=self.chunk_size)
+        if not lines:
+            self.write({'state': 'done', 'finished_at': fields.Datetime.now()})
+            _logger.info(f"✅ Certificación FEL masiva '{self.name}' terminada: {self.success_count} certificadas, "
+                         f"{self.failure_count} con error.")
+            return True
+
+        # 🔹 Las facturas ya certificadas (por la cola, por ejemplo) y las de compañías no permitidas no se envían
+        allowed_companies = self.env['account.move']._get_certify_allowed_companies()
+        already_certified = lines.filtered(lambda line: line.move_id.certified)
+        already_certified.write({'state': 'done', 'message': _("Ya estaba certificada.")})
+        not_allowed = (lines - already_certified).filtered(lambda line: line.move_id.company_id.id not in allowed_companies)
+        not_allowed.write({'state': 'failed', 'message': _("No tienes permiso para certificar facturas en esta empresa.")})
+        lines -= already_certified | not_allowed
+        if not lines:
+            return True
+
+        # 🔹 Resolver las órdenes de POS del lote en una sola consulta y certificar en paralelo
+        moves = lines.move_id
+        pos_orders = self.env['pos.order'].search([('account_move', 'in', moves.ids)])
+        pos_order_by_move = {order.account_move.id: order for order in pos_orders}
+        results = moves._certify_concurrently(pos_order_by_move, max(self.max_workers, 1))
+
+        # 🔹 Guardar los resultados (hilo principal)
+        complete = True
+        for line in lines:
+            move = line.move_id
+            result = results[move]
+            pos_order = pos_order_by_move.get(move.id)
+            if isinstance(result, DeadlineExceeded):
+                # No se envió nada: la factura queda pendiente y como estaba
+                complete = False
+                continue
+            if isinstance(result, Exception):
+                _logger.error(f"❌ Error en la certificación FEL de {move.name}: {result}")
+                certification_data = move._get_certification_error_values(str(result))
+                move._write_certification_result(certification_data, pos_order)
+                self.env['fel.certification.error']._record(certification_data['note'], move, pos_order)
+                line.write({'state': 'failed', 'message': str(result)})
+                continue
+
+            certification_data = dict(result, certified=True)
+            move._write_certification_result(certification_data, pos_order, {
+                'note': RECERTIFY_NOTE,
+                'invoice_date': fields.Datetime.now(),
+            })
+            move.message_post(body="✅ La factura ha sido certificada nuevamente con éxito.")
+            line.write({
+                'state': 'done',
+                'message': f"{certification_data['fel_reference']}-{certification_data['fel_number']}",
+            })
+        return complete
+
+
+class FelRecertifyBatchLine(models.Model):
+    _name = 'fel.recertify.batch.line'
+    _description = 'Resultado de Certificación FEL Masiva'
+    _order = 'id'
+
+    batch_id = fields.Many2one('fel.recertify.batch', string="Certificación Masiva", required=True, ondelete='cascade', index=True)
+    move_id = fields.Many2one('account.move', string="Factura", required=True, ondelete='cascade', readonly=True)
+    company_id = fields.Many2one(related='move_id.company_id')
+    state = fields.Selection([
+        ('pending', 'Pendiente'),
+        ('done', 'Certificada'),
+        ('failed', 'Con Error'),
+    ], string="Estado", default='pending', required=True, index=True, readonly=True)
+    message = fields.Char("Resultado", readonly=True)
@@ -0,0 +1,416 @@
+import time
+import logging
+import requests
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from odoo import models, fields, api, _
+from ..tools import fel_http
+from ..tools.fel_http import ServiceUnavailable, DeadlineExceeded
+from .fel_certification_queue import MODULE_NAME
+
+_logger = logging.getLogger(__name__)
+
+RECONCILE_CHUNK_SIZE = 200  # Facturas leídas y confirmadas por lote
+RECONCILE_MAX_WORKERS = 4  # Consultas simultáneas a Digifact
+RECONCILE_TIME_BUDGET = 240  # Segundos por ejecución del cron; después se vuelve a programar
+RECONCILE_DEFAULT_DAYS = 7  # Días que revisa la conciliación automática diaria
+RECONCILE_NOTE = "Certificación recuperada por la conciliación con Digifact"
+RECONCILE_COMPARED_FIELDS = ('fel_number', 'fel_reference')  # Datos que se comparan con Digifact
+# Circuito propio de las consultas: sus fallos no abren el de certificación ni activan la contingencia
+RECONCILE_BREAKER_ENDPOINT = 'document'
+RECONCILE_REFERENCE_BATCH = 50  # Referencias internas consultadas en cada llamada a Digifact
+# Consulta de DTE por la referencia interna de la Adenda. No está confirmada en el contrato de
+# Digifact: solo se usa con el parámetro `fel_reconcile_reference_lookup` activo
+REFERENCE_LOOKUP_TIPO = 'GET_DOCUMENTS_BY_REFERENCE'
+
+
+def _parse_document(document):
+    return {
+        "fel_number": document.get("NUMERO"),
+        "fel_reference": document.get("Serie"),
+        "fel_authorization_number": document.get("Autorizacion"),
+        "fel_certificate_date": document.get("Fecha_de_certificacion"),
+    }
+
+
+def _get_document_response(lookup_request, endpoint):
+    """GET a Digifact; devuelve el JSON de la respuesta o None si Digifact responde 404."""
+    try:
+        response = fel_http.get(
+            lookup_request['url'],
+            params=lookup_request.get('params'),
+            headers=lookup_request['headers'],
+            timeout=30,
+            endpoint=endpoint,
+            **lookup_request['options'],
+        )
+    except requests.RequestException as e:
+        raise ServiceUnavailable(f"Error al consultar el DTE en Digifact: {str(e)}")
+    if response.status_code >= 500:
+        raise ServiceUnavailable(f"Error al consultar el DTE en Digifact: respuesta HTTP {response.status_code}")
+    if response.status_code == 404:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        raise Exception(f"Respuesta inválida de Digifact (HTTP {response.status_code}).")
+
+
+def fetch_document_status(status_request):
+    """
+    Consulta en Digifact el DTE de un número de autorización y devuelve sus datos de
+    certificación, o None si Digifact no lo tiene. No usa el ORM: es seguro desde otros hilos.
+    """
+    response_data = _get_document_response(status_request, 'document')
+    if not response_data or response_data.get("Codigo") != 1:
+        return None
+    return _parse_document(response_data)
+
+
+def fetch_documents_by_reference(lookup_request):
+    """
+    Consulta en Digifact, en una sola llamada, los DTE de varias referencias internas.
+    Devuelve {referencia: datos de certificación} solo con las que Digifact tiene certificadas.
+    No usa el ORM: es seguro desde otros hilos.
+    """
+    response_data = _get_document_response(lookup_request, 'document_reference')
+    documents = (response_data or {}).get("DOCUMENTOS") or []
+    return {
+        document["ReferenciaInterna"]: _parse_document(document)
+        for document in documents
+        if document.get("ReferenciaInterna") and document.get("Autorizacion") and document.get("Codigo", 1) == 1
+    }
+
+
+class FelReconciliation(models.Model):
+    """
+    Conciliación de las facturas de venta con los documentos que Digifact tiene certificados.
+    Recorre las facturas del rango por lotes (por id, sin cargarlas todas), confirma la
+    transacción tras cada lote y guarda el último id revisado, así puede continuar en la
+    siguiente ejecución del cron y recorrer rangos de un año completo.
+    """
+    _name = 'fel.reconciliation'
+    _description = 'Conciliación FEL'
+    _order = 'id desc'
+
+    name = fields.Char("Descripción", required=True, default=lambda self: _("Conciliación FEL"))
+    automatic = fields.Boolean("Automática", readonly=True, help="Creada por el cron de conciliación diaria.")
+    company_ids = fields.Many2many('res.company', string="Compañías",
+                                   help="Vacío: todas las compañías permitidas para certificar.")
+    date_from = fields.Date("Desde", required=True, default=lambda self: fields.Date.today() - timedelta(days=RECONCILE_DEFAULT_DAYS))
+    date_to = fields.Date("Hasta", required=True, default=fields.Date.today)
+    state = fields.Selection([
+        ('draft', 'Borrador'),
+        ('running', 'En Proceso'),
+        ('done', 'Terminada'),
+    ], string="Estado", default='draft', required=True, index=True)
+    last_move_id = fields.Integer("Última Factura Revisada", default=0, readonly=True)
+    checked_count = fields.Integer("Revisadas", default=0, readonly=True)
+    fixed_count = fields.Integer("Corregidas", default=0, readonly=True)
+    mismatch_count = fields.Integer("Con Diferencias", default=0, readonly=True)
+    started_at = fields.Datetime("Inicio", readonly=True)
+    finished_at = fields.Datetime("Fin", readonly=True)
+    line_ids = fields.One2many('fel.reconciliation.line', 'reconciliation_id', string="Diferencias")
+
+    def action_start(self):
+        """ Inicia (o reinicia desde el principio) la conciliación y despierta al cron. """
+        self.write({
+            'state': 'running',
+            'last_move_id': 0,
+            'checked_count': 0,
+            'fixed_count': 0,
+            'mismatch_count': 0,
+            'started_at': fields.Datetime.now(),
+            'finished_at': False,
+        })
+        self.line_ids.unlink()
+        self._trigger_cron()
+
+    @api.model
+    def _trigger_cron(self):
+        cron = self.env.ref(f'{MODULE_NAME}.ir_cron_fel_reconciliation', raise_if_not_found=False)
+        if cron:
+            cron.sudo()._trigger()
+
+    @api.model
+    def _cron_reconcile(self, chunk_size=RECONCILE_CHUNK_SIZE, max_workers=RECONCILE_MAX_WORKERS,
+                        time_budget=RECONCILE_TIME_BUDGET):
+        """
+        Avanza las conciliaciones en proceso dentro del tiempo disponible. Si no hay ninguna,
+        crea la conciliación diaria de los últimos días. Lo que no alcanza se continúa en una
+        nueva ejecución del cron.
+        """
+        reconciliations = self.search([('state', '=', 'running')], order='id')
+        if not reconciliations:
+            today = fields.Date.today()
+            if self.search_count([('automatic', '=', True), ('create_date', '>=', fields.Datetime.to_datetime(today))]):
+                return
+            reconciliations = self.create({'name': _("Conciliación diaria %s", today), 'automatic': True})
+            reconciliations.action_start()
+            self.env.cr.commit()
+
+        deadline = time.monotonic() + time_budget
+        for reconciliation in reconciliations:
+            while reconciliation.state == 'running':
+                if time.monotonic() >= deadline:
+                    self._trigger_cron()
+                    return
+                try:
+                    with fel_http.deadline(self.env['fel.settings']._get_deadline('cron')):
+                        reconciliation._reconcile_next_chunk(chunk_size, max_workers)
+                except DeadlineExceeded:
+                    # El lote no alcanzó a consultarse dentro del plazo: se retoma en otra ejecución
+                    self.env.cr.rollback()
+                    self._trigger_cron()
+                    return
+                except ServiceUnavailable as e:
+                    # Circuito abierto, Digifact no responde: se retoma desde el último lote confirmado
+                    self.env.cr.rollback()
+                    _logger.warning(f"⚠ Conciliación FEL pausada, Digifact no disponible: {e}")
+                    return
+                except Exception:
+                    self.env.cr.rollback()
+                    _logger.exception(f"❌ Error en la conciliación FEL '{reconciliation.name}', se reintentará.")
+                    return
+                self.env.cr.commit()
+                # Liberar la caché del ORM: la memoria no crece con el número de lotes
+                self.env.invalidate_all()
+
+    def _get_move_domain(self):
+        self.ensure_one()
+        company_ids = self.company_ids.ids or list(self.env['account.move']._get_certify_allowed_companies())
+        return [
+            ('move_type', '=', 'out_invoice'),
+            ('state', '=', 'posted'),
+            ('company_id', 'in', company_ids),
+            ('invoice_date', '>=', self.date_from),
+            ('invoice_date', '<=', self.date_to),
+            ('fel_contingency', '=', False),
+        ]
+
+    def _reconcile_next_chunk(self, chunk_size, max_workers):
+        """ Revisa el siguiente lote de facturas después de `last_move_id`. """
+        self.ensure_one()
+        moves = self.env['account.move'].search(
+            self._get_move_domain() + [('id', '>', self.last_move_id)], order='id', limit=chunk_size)
+        if not moves:
+            self.write({'state': 'done', 'finished_at': fields.Datetime.now()})
+            _logger.info(f"✅ Conciliación FEL '{self.name}' terminada: {self.checked_count} revisadas, "
+                         f"{self.fixed_count} corregidas, {self.mismatch_count} con diferencias.")
+            return
+
+        certified = moves.filtered(lambda move: move.certified and move.fel_authorization_number)
+        fixed, mismatches = self._reconcile_uncertified(self._get_settled_uncertified(moves - certified), max_workers)
+        chunk_fixed, chunk_mismatches = self._reconcile_certified(certified, max_workers)
+        self.write({
+            'last_move_id': moves[-1].id,
+            'checked_count': self.checked_count + len(moves),
+            'fixed_count': self.fixed_count + fixed + chunk_fixed,
+            'mismatch_count': self.mismatch_count + mismatches + chunk_mismatches,
+        })
+
+    def _run_lookups(self, lookup_requests, fetch, max_workers):
+        """
+        Ejecuta `fetch` para cada petición en paralelo (solo HTTP en los hilos) y devuelve
+        {clave: resultado o la excepción}. `lookup_requests` es {clave: (compañía, petición)}.
+        Informa al circuito el resultado por compañía; solo si el circuito queda abierto, o si
+        se agotó el plazo, se detiene el lote para retomarlo después. Los demás errores quedan
+        en el resultado de cada factura.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {key: executor.submit(fetch, lookup_request)
+                       for key, (_company, lookup_request) in lookup_requests.items()}
+            results = {}
+            for key, future in futures.items():
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = e
+
+        deadline_errors = [result for result in results.values() if isinstance(result, DeadlineExceeded)]
+        if deadline_errors:
+            raise deadline_errors[0]
+
+        breaker = self.env['fel.circuit.breaker']
+        for company in {company for company, _lookup_request in lookup_requests.values()}:
+            company_results = [results[key] for key, (lookup_company, _lookup_request) in lookup_requests.items()
+                               if lookup_company == company]
+            if any(isinstance(result, ServiceUnavailable) for result in company_results):
+                breaker._record_failure(RECONCILE_BREAKER_ENDPOINT, company)
+            if any(not isinstance(result, ServiceUnavailable) for result in company_results):
+                breaker._record_success(RECONCILE_BREAKER_ENDPOINT, company)
+            # Con el circuito de consultas abierto Digifact no está disponible: se pausa toda la conciliación
+            breaker._check(RECONCILE_BREAKER_ENDPOINT, company)
+        return results
+
+    def _get_lookup_base(self, company):
+        """ URL base, headers y opciones de transporte para consultar los DTE de la compañía. """
+        self.env['fel.circuit.breaker']._check(RECONCILE_BREAKER_ENDPOINT, company)
+        base_url = self.env['fel.settings']._get().certify_url
+        headers = {"Content-Type": "application/json", "Authorization": self.env['fel.token']._get_token(company)}
+        return base_url, headers, fel_http.get_transport_options(self.env)
+
+    def _get_settled_uncertified(self, moves):
+        """
+        De las facturas sin certificar, las que ya no tienen un envío pendiente: su solicitud de
+        certificación terminó (con autorización, con error o sin confirmar) o su registro en la
+        cola falló.
+        Las que siguen en la cola o esperan el cierre de sesión del POS no se revisan.
+        """
+        if not moves:
+            return moves
+        jobs = self.env['fel.certification.queue'].search([
+            ('move_id', 'in', moves.ids), ('state', 'in', ('pending', 'failed'))])
+        queued = set(jobs.filtered(lambda job: job.state == 'pending').move_id.ids)
+        settled = set(jobs.filtered(lambda job: job.state == 'failed').move_id.ids)
+        settled.update(self.env['fel.certification.request'].search([
+            ('move_id', 'in', moves.ids), ('state', 'in', ('done', 'failed', 'unknown'))]).move_id.ids)
+        return moves.filtered(lambda move: move.id in settled and move.id not in queued
+                              and not move.fel_session_close_pending)
+
+    def _reconcile_uncertified(self, moves, max_workers):
+        """
+        Facturas sin certificar cuyo envío ya terminó. Si el registro de idempotencia tiene la autorización
+        (por ejemplo, la respuesta llegó pero la transacción se revirtió), se recupera de ahí.
+        Con `fel_reconcile_reference_lookup` activo, las demás se buscan en Digifact por su
+        referencia interna, por bloques de referencias: las que Digifact tiene certificadas (por
+        ejemplo, tras un timeout) se recuperan y las que no, se marcan como sin certificar y,
+        si su envío había quedado sin confirmar, pueden enviarse de nuevo. Sin él, siguen en
+        manos de la cola y del asistente de certificación.
+        """
+        if not moves:
+            return 0, 0
+        dedup = self.env['fel.certification.request']
+        pos_orders = self.env['pos.order'].search([('account_move', 'in', moves.ids)])
+        pos_order_by_move = {order.account_move.id: order for order in pos_orders}
+
+        # 🔹 Autorizaciones ya guardadas localmente; incluyen el XML firmado
+        stored = dedup._get_done_results(moves.ids)
+        for move_id, certification_data in stored.items():
+            move = self.env['account.move'].browse(move_id)
+            move._write_certification_result(dict(certification_data, certified=True),
+                                             pos_order_by_move.get(move_id), {'note': RECONCILE_NOTE})
+            self._add_line(move, 'recovered', _("Autorización %s recuperada del registro de certificación.",
+                                                certification_data['fel_authorization_number']))
+
+        # 🔹 Las que tienen un envío en curso en otro proceso se revisan en la próxima conciliación
+        in_flight = set(dedup.search([('move_id', 'in', moves.ids), ('state', '=', 'in_flight')]).move_id.ids)
+        lookup = self.env['fel.settings']._get().reconcile_reference_lookup
+        pending = moves.filtered(lambda move: lookup and move.id not in stored and move.id not in in_flight)
+
+        lookup_requests = {}
+        moves_by_batch = {}
+        for company in pending.company_id:
+            base_url, headers, options = self._get_lookup_base(company)
+            company_moves = pending.filtered(lambda move: move.company_id == company)
+            for index in range(0, len(company_moves), RECONCILE_REFERENCE_BATCH):
+                batch = company_moves[index:index + RECONCILE_REFERENCE_BATCH]
+                key = (company.id, index)
+                moves_by_batch[key] = batch
+                lookup_requests[key] = (company, {
+                    'url': f"{base_url}?NIT={company.vat}&TIPO={REFERENCE_LOOKUP_TIPO}&FORMAT=JSON"
+                           f"&USERNAME={company.fel_user}",
+                    'params': {'REFERENCIAS': "|".join(move._get_fel_internal_reference() for move in batch)},
+                    'headers': headers,
+                    'options': options,
+                })
+        results = self._run_lookups(lookup_requests, fetch_documents_by_reference, max_workers) if lookup_requests else {}
+
+        recovered, mismatches = len(stored), 0
+        for key, batch in moves_by_batch.items():
+            documents = results[key]
+            for move in batch:
+                if isinstance(documents, Exception):
+                    mismatches += 1
+                    self._add_line(move, 'error', _("No se pudo consultar el DTE en Digifact: %s", documents))
+                    continue
+                document = documents.get(move._get_fel_internal_reference())
+                if not document:
+                    mismatches += 1
+                    # Un envío sin confirmar que Digifact no tiene puede enviarse de nuevo
+                    dedup._release_unknown(move, _("Digifact no tiene el DTE, según la conciliación."))
+                    self._add_line(move, 'mismatch', _("Digifact no tiene un DTE certificado con la referencia %s.",
+                                                       move._get_fel_internal_reference()))
+                    continue
+                recovered += 1
+                # Guardar también en el registro de idempotencia (se crea si no existe): ni la cola
+                # ni el asistente la vuelven a enviar
+                dedup._finish(move, document)
+                move._write_certification_result(dict(document, certified=True),
+                                                 pos_order_by_move.get(move.id), {'note': RECONCILE_NOTE})
+                self._add_line(move, 'recovered', _("Autorización %s encontrada en Digifact por la referencia %s.",
+                                                    document['fel_authorization_number'],
+                                                    move._get_fel_internal_reference()))
+        return recovered, mismatches
+
+    def _reconcile_certified(self, moves, max_workers):
+        """
+        Facturas certificadas: consulta su DTE en Digifact en paralelo (solo HTTP en los hilos),
+        corrige los datos que difieren y marca las que Digifact no tiene.
+        """
+        if not moves:
+            return 0, 0
+
+        lookup_requests = {}
+        for company in moves.company_id:
+            base_url, headers, options = self._get_lookup_base(company)
+            for move in moves.filtered(lambda move: move.company_id == company):
+                lookup_requests[move] = (company, {
+                    'url': f"{base_url}?NIT={company.vat}&TIPO=GET_DOCUMENT&FORMAT=JSON"
+                           f"&USERNAME={company.fel_user}&GUID={move.fel_authorization_number}",
+                    'headers': headers,
+                    'options': options,
+                })
+        results = self._run_lookups(lookup_requests, fetch_document_status, max_workers)
+
+        pos_orders = self.env['pos.order'].search([('account_move', 'in', moves.ids)])
+        pos_order_by_move = {order.account_move: order for order in pos_orders}
+        fixed = mismatches = 0
+        for move, document in results.items():
+            if isinstance(document, Exception):
+                # La factura no detiene la conciliación: queda marcada y se sigue con las demás
+                mismatches += 1
+                _logger.warning(f"⚠ No se pudo conciliar la factura {move.name}: {document}")
+                self._add_line(move, 'error', _("No se pudo consultar el DTE en Digifact: %s", document))
+                continue
+            if document is None:
+                mismatches += 1
+                self._add_line(move, 'not_found', _("Digifact no tiene el DTE con autorización %s.",
+                                                     move.fel_authorization_number))
+                continue
+            differences = {name: document[name] for name in RECONCILE_COMPARED_FIELDS
+                           if document[name] and document[name] != move[name]}
+            if differences:
+                fixed += 1
+                self._add_line(move, 'fixed', ", ".join(
+                    f"{name}: {move[name] or ''} → {value}" for name, value in differences.items()))
+                move.write(differences)
+                if move in pos_order_by_move:
+                    pos_order_by_move[move].write(differences)
+        return fixed, mismatches
+
+    def _add_line(self, move, issue, details):
+        self.env['fel.reconciliation.line'].create({
+            'reconciliation_id': self.id,
+            'move_id': move.id,
+            'issue': issue,
+            'details': details,
+        })
+
+
+class FelReconciliationLine(models.Model):
+    _name = 'fel.reconciliation.line'
+    _description = 'Diferencia de Conciliación FEL'
+    _order = 'id'
+
+    reconciliation_id = fields.Many2one('fel.reconciliation', string="Conciliación", required=True, ondelete='cascade', index=True)
+    move_id = fields.Many2one('account.move', string="Factura", ondelete='cascade')
+    company_id = fields.Many2one(related='move_id.company_id', store=True)
+    issue = fields.Selection([
+        ('not_found', 'No Existe en Digifact'),
+        ('fixed', 'Datos Corregidos'),
+        ('recovered', 'Certificación Recuperada'),
+        ('mismatch', 'Sin Certificar en Digifact'),
+        ('error', 'Error de Consulta'),
+    ], string="Diferencia", required=True)
+    details = fields.Char("Detalle")
@@ -0,0 +1,134 @@
+import logging
+from typing import NamedTuple, FrozenSet
+from odoo import models, api, tools
+from odoo.tools import config
+from ..tools import fel_http
+from .fel_circuit_breaker import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS
+from .fel_nit_cache import NIT_CACHE_TTL, NIT_CACHE_NEGATIVE_TTL
+from .fel_qr_code import QR_FORMATS
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_ERROR_EMAIL = 'juancarlos@olivegt.com'
+DEADLINE_POS_SECONDS = 20  # Plazo de las llamadas hechas al sincronizar o consultar desde el POS
+DEADLINE_MANUAL_SECONDS = 90  # Plazo de la certificación manual desde el backend
+DEADLINE_CRON_SECONDS = 120  # Plazo de cada unidad de trabajo de los crons
+REQUEST_LIMIT_FRACTION = 0.8  # Fracción del límite de tiempo de Odoo que pueden usar las llamadas
+
+
+class FelSettings(NamedTuple):
+    """Configuración FEL ya interpretada. Es inmutable: se comparte entre todas las peticiones."""
+    certify_allowed_company_ids: FrozenSet[int]
+    certify_url: str
+    token_url: str
+    nit_validation_url: str
+    error_email: str
+    metrics_token: str
+    http_pool_size: int
+    http_retries: int
+    http_backoff: float
+    nit_cache_ttl: int
+    nit_cache_negative_ttl: int
+    circuit_failure_threshold: int
+    circuit_open_seconds: int
+    qr_format: str
+    deadline_pos_seconds: float
+    deadline_manual_seconds: float
+    deadline_cron_seconds: float
+    reconcile_reference_lookup: bool
+
+
+def _parse_company_ids(value):
+    return frozenset(int(company_id) for company_id in value.split(',') if company_id.strip())
+
+
+def _parse_bool(value):
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def _parse_qr_format(value):
+    if value not in QR_FORMATS:
+        raise ValueError(value)
+    return value
+
+
+# Parámetro del sistema -> (campo de FelSettings, conversión, valor por defecto)
+SETTINGS_PARAMS = {
+    'certify_allowed_companies': ('certify_allowed_company_ids', _parse_company_ids, frozenset()),
+    'fel_certify_url': ('certify_url', str, ''),
+    'fel_token_url': ('token_url', str, ''),
+    'fel_nit_validation_url': ('nit_validation_url', str, ''),
+    'fel_error_email': ('error_email', str, DEFAULT_ERROR_EMAIL),
+    'fel_metrics_token': ('metrics_token', str, ''),
+    'fel_http_pool_size': ('http_pool_size', int, fel_http.DEFAULT_POOL_SIZE),
+    'fel_http_retries': ('http_retries', int, fel_http.DEFAULT_RETRIES),
+    'fel_http_backoff': ('http_backoff', float, fel_http.DEFAULT_BACKOFF),
+    'fel_nit_cache_ttl': ('nit_cache_ttl', int, NIT_CACHE_TTL),
+    'fel_nit_cache_negative_ttl': ('nit_cache_negative_ttl', int, NIT_CACHE_NEGATIVE_TTL),
+    'fel_circuit_failure_threshold': ('circuit_failure_threshold', int, CIRCUIT_FAILURE_THRESHOLD),
+    'fel_circuit_open_seconds': ('circuit_open_seconds', int, CIRCUIT_OPEN_SECONDS),
+    'fel_qr_format': ('qr_format', _parse_qr_format, 'png'),
+    'fel_deadline_pos_seconds': ('deadline_pos_seconds', float, DEADLINE_POS_SECONDS),
+    'fel_deadline_manual_seconds': ('deadline_manual_seconds', float, DEADLINE_MANUAL_SECONDS),
+    'fel_deadline_cron_seconds': ('deadline_cron_seconds', float, DEADLINE_CRON_SECONDS),
+    # Consulta de DTE por referencia interna: sin confirmar en el contrato de Digifact, apagada por defecto
+    'fel_reconcile_reference_lookup': ('reconcile_reference_lookup', _parse_bool, False),
+}
+
+
+class FelSettingsModel(models.AbstractModel):
+    """
+    Configuración FEL leída de los parámetros del sistema.
+    Se carga con una sola consulta y queda en el ormcache del registro. Cada cambio en
+    ir.config_parameter limpia esa caché, y Odoo avisa del cambio a los demás workers.
+    """
+    _name = 'fel.settings'
+    _description = 'Configuración FEL'
+
+    @api.model
+    def _get(self):
+        """Devuelve la configuración FEL (FelSettings) de la base de datos."""
+        return self._load_settings()
+
+    @api.model
+    def _get_deadline(self, entry_point):
+        """
+        Segundos de plazo de las llamadas a Digifact para el punto de entrada ('pos', 'manual'
+        o 'cron'), sin pasar de REQUEST_LIMIT_FRACTION del límite de tiempo real de Odoo.
+        """
+        settings = self._get()
+        seconds = {
+            'pos': settings.deadline_pos_seconds,
+            'manual': settings.deadline_manual_seconds,
+            'cron': settings.deadline_cron_seconds,
+        }[entry_point]
+        limit = config.get('limit_time_real') or 0
+        if entry_point == 'cron' and config.get('limit_time_real_cron', -1) != -1:
+            limit = config.get('limit_time_real_cron') or 0
+        if limit > 0:
+            seconds = min(seconds, limit * REQUEST_LIMIT_FRACTION)
+        return seconds
+
+    @api.model
+    @tools.ormcache()
+    def _load_settings(self):
+        self.env.cr.execute("SELECT key, value FROM ir_config_parameter WHERE key IN %s", (tuple(SETTINGS_PARAMS),))
+        stored = dict(self.env.cr.fetchall())
+
+        values = {}
+        for key, (field_name, parser, default) in SETTINGS_PARAMS.items():
+            raw_value = (stored.get(key) or '').strip()
+            if not raw_value:
+                values[field_name] = default
+                continue
+            try:
+                values[field_name] = parser(raw_value)
+            except ValueError:
+                _logger.warning(f"⚠ Valor inválido '{raw_value}' en el parámetro {key}, se usa {default!r}.")
+                values[field_name] = default
+        return FelSettings(**values)
@@ -0,0 +1,184 @@
+import json
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from odoo import models, fields, api, SUPERUSER_ID
+from ..tools import fel_http, fel_metrics
+from ..tools.fel_http import ServiceUnavailable
+
+_logger = logging.getLogger(__name__)
+
+TOKEN_REFRESH_MARGIN = timedelta(minutes=15)  # Renovar el token antes de que expire
+TOKEN_LOCK_NAMESPACE = 4605260  # Espacio de los advisory locks del token ('FEL')
+TOKEN_LOCK_TIMEOUT = '30s'  # Espera máxima por el worker que está renovando el token
+TOKEN_WARMUP_MARGIN = timedelta(minutes=45)  # El cron renueva los tokens que vencen dentro de este margen
+TOKEN_WARMUP_MAX_WORKERS = 4  # Compañías renovadas en paralelo por el cron
+
+# Caché del proceso: (base de datos, compañía) -> (token, expiración en UTC)
+_token_cache = {}
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def _parse_token_expiry(expira_en):
+    """Convierte `expira_en` de Digifact (ej. 2024-01-31T10:20:30.123) en un datetime sin zona."""
+    if not expira_en:
+        return None
+    return datetime.strptime(expira_en.replace('T', ' ').split('.')[0], '%Y-%m-%d %H:%M:%S')
+
+
+def _is_token_fresh(expiry, margin=TOKEN_REFRESH_MARGIN):
+    """Indica si el token sigue vigente más allá del margen de renovación."""
+    return bool(expiry) and fields.Datetime.now() + margin < expiry
+
+
+def _get_refresh_lock(key):
+    with _refresh_locks_guard:
+        return _refresh_locks.setdefault(key, threading.Lock())
+
+
+class FelToken(models.AbstractModel):
+    _name = 'fel.token'
+    _description = 'Gestor del Token FEL'
+
+    @api.model
+    def _get_token(self, company):
+        """
+        Devuelve un token vigente para la compañía.
+        El token se guarda en memoria por proceso; solo un hilo por proceso y un worker
+        por base de datos (advisory lock) lo renuevan, los demás esperan y reutilizan el nuevo.
+        """
+        key = (self.env.cr.dbname, company.id)
+        cached = _token_cache.get(key)
+        if cached and _is_token_fresh(cached[1]):
+            return cached[0]
+
+        with _get_refresh_lock(key):
+            cached = _token_cache.get(key)
+            if cached and _is_token_fresh(cached[1]):
+                return cached[0]
+
+            token, expiry = self._refresh_token(company)
+            _token_cache[key] = (token, expiry)
+            return token
+
+    @api.model
+    def _invalidate_token(self, companies):
+        """Descarta el token en memoria de las compañías indicadas."""
+        for company in companies:
+            _token_cache.pop((self.env.cr.dbname, company.id), None)
+
+    @api.model
+    def _refresh_token(self, company, margin=TOKEN_REFRESH_MARGIN):
+        """
+        Lee el token guardado en la compañía y lo renueva si vence dentro de `margin`.
+        Se usan cursores propios: el primero mantiene el advisory lock y el segundo,
+        abierto después de obtenerlo, ve el token que otro worker haya guardado mientras tanto.
+        """
+        registry = self.env.registry
+        with registry.cursor() as lock_cr:
+            lock_cr.execute(f"SET LOCAL lock_timeout = '{TOKEN_LOCK_TIMEOUT}'")
+            lock_cr.execute("SELECT pg_advisory_xact_lock(%s, %s)", (TOKEN_LOCK_NAMESPACE, company.id))
+
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                company_su = env['res.company'].browse(company.id)
+                token_data = json.loads(company_su.fel_token or '{}')
+                expiry = _parse_token_expiry(token_data.get('expira_en'))
+
+                if token_data.get('Token') and _is_token_fresh(expiry, margin):
+                    return token_data['Token'], expiry
+
+                _logger.info("🔄 Token FEL de la compañía %s por expirar, regenerando...", company_su.name)
+                try:
+                    with fel_metrics.track(cr.dbname, 'token_refresh', company_su.id):
+                        new_token_data = env['fel.token']._request_token(company_su)
+                except Exception:
+                    # Si el token anterior aún no ha expirado, se sigue usando hasta el próximo intento
+                    if token_data.get('Token') and _is_token_fresh(expiry, margin=timedelta(0)):
+                        _logger.warning("⚠ No se pudo renovar el token FEL, se usa el vigente.", exc_info=True)
+                        return token_data['Token'], expiry
+                    raise
+
+                company_su.write({'fel_token': json.dumps(new_token_data)})
+                return new_token_data['Token'], _parse_token_expiry(new_token_data['expira_en'])
+
+    @api.model
+    def _cron_warm_up_tokens(self, margin_minutes=None, max_workers=TOKEN_WARMUP_MAX_WORKERS):
+        """
+        Renueva, antes de que el margen de las órdenes los alcance, los tokens de todas las
+        compañías permitidas para certificar, varias compañías a la vez. Así la renovación
+        del token no ocurre durante la certificación de una orden.
+        """
+        margin = timedelta(minutes=margin_minutes) if margin_minutes else TOKEN_WARMUP_MARGIN
+        companies = self.env['res.company'].sudo().browse(
+            self.env['account.move']._get_certify_allowed_companies()
+        ).exists().filtered(lambda company: company.fel_user and company.fel_password and company.vat)
+        if not companies:
+            return
+
+        registry = self.env.registry
+        dbname = self.env.cr.dbname
+        deadline = time.monotonic() + self.env['fel.settings']._get_deadline('cron')
+
+        def warm_up(company_id):
+            # Cada hilo usa sus propios cursores; _refresh_token abre los suyos para el lock y la lectura
+            with registry.cursor() as cr, fel_http.deadline_at(deadline):
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                company = env['res.company'].browse(company_id)
+                token, expiry = env['fel.token']._refresh_token(company, margin)
+            _token_cache[(dbname, company_id)] = (token, expiry)
+            return expiry
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {company: executor.submit(warm_up, company.id) for company in companies}
+            for company, future in futures.items():
+                try:
+                    expiry = future.result()
+                    _logger.info(f"🔑 Token FEL de {company.name} vigente hasta {expiry}.")
+                except Exception as e:
+                    _logger.error(f"❌ No se pudo renovar el token FEL de {company.name}: {e}")
+
+    @api.model
+    def _post_token_request(self, api_url, headers, payload, options):
+        try:
+            response = fel_http.post(api_url, headers=headers, json=payload, timeout=10, endpoint='token', **options)
+        except requests.RequestException as e:
+            raise ServiceUnavailable(f"Error al conectar con API de token: {str(e)}")
+        if response.status_code >= 500:
+            raise ServiceUnavailable(f"Error al conectar con API de token: respuesta HTTP {response.status_code}")
+        return response
+
+    @api.model
+    def _request_token(self, company):
+        """Solicita un nuevo token al API de Digifact."""
+        api_url = self.env['fel.settings']._get().token_url
+        if not api_url:
+            raise Exception("URL de API de token no configurada en parámetros del sistema.")
+
+        username = f"GT.{company.vat.zfill(12)}.{company.fel_user}"
+        payload = {
+            "Username": username,
+            "Password": company.fel_password
+        }
+        headers = {"Content-Type": "application/json"}
+
+        options = fel_http.get_transport_options(self.env)
+        response = self.env['fel.circuit.breaker']._call(
+            'token', company, self._post_token_request, api_url, headers, payload, options)
+        try:
+            response_data = response.json()
+        except Exception as e:
+            raise Exception(f"Error al conectar con API de token: {str(e)}")
+
+        if response.status_code == 200 and response_data.get("Token"):
+            return {
+                "Token": response_data["Token"],
+                "expira_en": response_data["expira_en"],
+                "otorgado_a": response_data["otorgado_a"]
+            }
+        _logger.error(f"❌ Error al obtener nuevo token: {response_data}")
+        raise Exception(f"Error al obtener nuevo token: {response_data.get('message')}")
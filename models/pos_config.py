@@ -5,3 +5,7 @@ class PosConfig(models.Model):
 
     establishment_name = fields.Char("Nombre del Establecimiento")
     establishment_id = fields.Char("ID del Establecimiento")
+    fel_invoice_at_close = fields.Boolean(
+        "Facturar al Cerrar la Sesión",
+        help="Las órdenes no se facturan al sincronizarse: las facturas se crean en lote al cerrar la sesión "
+             "y se certifican en segundo plano. Recomendado para tiendas con mucho volumen.")
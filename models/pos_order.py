@@ -3,6 +3,10 @@ import requests
 import json
 import base64
 from odoo import models, fields, api, _
+from odoo.tools.sql import create_index
+from ..tools import fel_http
+from .account_move import SESSION_CLOSE_PENDING_NOTE
+from .fel_certification_queue import MODULE_NAME
 
 _logger = logging.getLogger(__name__)
 
@@ -13,11 +17,21 @@ class PosOrder(models.Model):
     certified = fields.Boolean("Certificado FEL", default=False)
     fel_reference = fields.Char("FEL Referencia")
     fel_number = fields.Char("FEL Número de Factura")
-    fel_authorization_number = fields.Char("FEL Número de Autorización")
+    fel_authorization_number = fields.Char("FEL Número de Autorización", index='btree_not_null')
     fel_certificate_date = fields.Char("FEL Fecha de Certificación")
     certified = fields.Boolean("Certificado FEL", default=False)
     note = fields.Text("Nota")
     state = fields.Selection(selection_add=[('error', 'Error en Certificación')])  # Nuevo estado
+    account_move = fields.Many2one(index='btree_not_null')  # Búsqueda de la orden a partir de su factura
+
+    def init(self):
+        super().init()
+        # 🔹 Índices parciales: solo contienen las órdenes facturadas sin certificar o con error,
+        # una fracción pequeña de la tabla
+        create_index(self.env.cr, 'pos_order_fel_uncertified_index', self._table, ['company_id', 'date_order'],
+                     where="certified IS NOT TRUE AND account_move IS NOT NULL")
+        create_index(self.env.cr, 'pos_order_fel_error_index', self._table, ['company_id', 'date_order'],
+                     where="state = 'error'")
 
     @api.model
     def create(self, vals):
@@ -31,106 +45,133 @@ class PosOrder(models.Model):
             vals['to_invoice'] = True
         return super(PosOrder, self).write(vals)
 
+    @api.model
+    def create_from_ui(self, orders, draft=False):
+        """
+        Las órdenes sincronizadas desde el POS con facturación al cierre no se facturan aquí.
+        Las llamadas a Digifact hechas durante la sincronización respetan el plazo del POS.
+        """
+        with fel_http.deadline(self.env['fel.settings']._get_deadline('pos')):
+            return super(PosOrder, self.with_context(fel_defer_invoice=True)).create_from_ui(orders, draft=draft)
+
+    def _generate_pos_order_invoice(self):
+        """
+        Al sincronizar desde el POS, las órdenes de un punto de venta con "Facturar al Cerrar la
+        Sesión" quedan pagadas sin factura; `pos.session` las factura en lote al cerrar.
+        """
+        if self.env.context.get('fel_defer_invoice'):
+            deferred = self.filtered(lambda order: order.config_id.fel_invoice_at_close)
+            if deferred:
+                _logger.info(f"🕒 {len(deferred)} órdenes se facturarán al cerrar la sesión.")
+            if deferred == self:
+                return False
+            return super(PosOrder, self - deferred)._generate_pos_order_invoice()
+        return super(PosOrder, self)._generate_pos_order_invoice()
+
+    def _fel_invoice_at_session_close(self):
+        """
+        Factura en lote las órdenes pagadas al cerrar la sesión. Los datos FEL comunes se guardan
+        con una escritura por modelo y la certificación queda para `_cron_certify_session_close`,
+        que envía las facturas en paralelo cuando el cierre ya está confirmado.
+        """
+        orders = self.with_context(fel_session_close_invoice=True)
+        orders._generate_pos_order_invoice()
+
+        # 🔹 Separar las facturas que se certifican de los reembolsos y compañías no permitidas
+        allowed_companies = self.env['account.move']._get_certify_allowed_companies()
+        to_certify = orders.filtered(lambda order: order.amount_total >= 0 and order.company_id.id in allowed_companies)
+        contingency = to_certify.filtered(lambda order: order.company_id._is_fel_contingency_active())
+        pending = to_certify - contingency
+
+        for config in orders.config_id:
+            config_orders = orders.filtered(lambda order: order.config_id == config)
+            (config_orders - to_certify).account_move.write({'pos_config_id': config.id})
+            (config_orders & to_certify).account_move.write({'pos_config_id': config.id, 'tipo_gasto': "compra"})
+
+        for order in contingency:
+            order.account_move._issue_fel_contingency(order)
+
+        if pending:
+            pending_data = {"certified": False, "note": SESSION_CLOSE_PENDING_NOTE}
+            pending.account_move.write(dict(pending_data, fel_session_close_pending=True))
+            pending.write(pending_data)
+            cron = self.env.ref(f'{MODULE_NAME}.ir_cron_fel_certify_session_close', raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger()
+        _logger.info(f"📥 {len(orders)} órdenes facturadas al cerrar la sesión: {len(pending)} pendientes de "
+                     f"certificar, {len(contingency)} en contingencia.")
+
     def _create_invoice(self, move_vals):
         """
-        Modifica la función original de Odoo para enviar la factura a la SAT antes de guardarla en Odoo.
+        Modifica la función original de Odoo para encolar la factura en la cola de certificación FEL.
+        La certificación con la SAT se realiza en segundo plano por los crons de la cola,
+        para no bloquear la sincronización del POS con la llamada HTTP.
         Solo certifica facturas normales, no reembolsos/rectificativas.
+        Al facturar en lote al cerrar la sesión, los datos FEL se guardan después para todas.
         """
         self.ensure_one()
 
         # 🔹 Llamamos a la función original de Odoo para crear la factura
         new_move = super(PosOrder, self)._create_invoice(move_vals)
-        new_move.pos_config_id = self.session_id.config_id.id
+        if self.env.context.get('fel_session_close_invoice'):
+            return new_move
 
         # 🔹 Verificar si es un reembolso (amount_total negativo)
         is_refund = self.amount_total < 0
         if is_refund:
+            new_move.pos_config_id = self.session_id.config_id.id
             _logger.info(f"🔄 Omitiendo certificación FEL para reembolso: {self.name}")
             return new_move
 
         # 🔹 Obtener la lista de compañías permitidas para certificar
-        allowed_companies_str = self.env['ir.config_parameter'].sudo().get_param('certify_allowed_companies', '')
-        allowed_companies = [int(company_id) for company_id in allowed_companies_str.split(',') if company_id]
+        allowed_companies = self.env['account.move']._get_certify_allowed_companies()
 
         if self.company_id.id not in allowed_companies:
+            new_move.pos_config_id = self.session_id.config_id.id
             _logger.info(f"🔒 La compañía {self.company_id.name} no está permitida para certificar facturas.")
             return new_move
 
-        try:
-            # 🔹 Enviar factura a la API SAT y obtener datos de certificación
-            pos_config = self.session_id.config_id
-            certification_data = new_move._certify_invoice_with_sat(pos_config)
-            certification_data['certified'] = True
-        except Exception as e:
-            _logger.error(f"❌ Error en la certificación FEL: {str(e)}")
-            certification_data = {
-                "fel_number": "",
-                "fel_reference": "",
-                "fel_authorization_number": "",
-                "fel_certificate_date": "",
-                "note": f"⚠ Error en certificación FEL: {str(e)}",
-                "certified": False
-            }
-
-        # 🔹 Guardamos los datos de certificación en la factura creada
-        new_move.write(certification_data)  # Guarda datos en `account.move`
-        self.write(certification_data)  # Guarda datos en `pos.order`
-        self.flush_model()  # Forzar la escritura de los datos en la base de datos
-
-        # 🔹 Agregar fel_reference-fel_number al inicio de la referencia de la factura
-        if new_move.ref:
-            new_move.ref = f"{certification_data['fel_reference']}-{certification_data['fel_number']} ({new_move.ref})"
-        else:
-            new_move.ref = f"{certification_data['fel_reference']}-{certification_data['fel_number']}"
-
-        # 🔹 Establecer el campo tipo_gasto de la factura a "compra"
-        new_move.tipo_gasto = "compra"
-
-        # 🔹 Enviar correo electrónico si la certificación falló
-        if not certification_data['certified']:
-            # 🔹 Verifica que el pedido tiene datos correctos
-            order_name = self.name or "Pedido desconocido"
-            order_note = certification_data.get("note", "No hay detalles disponibles")
-
-            # 🔹 Crea el contenido del correo
-            email_body = f"""
-                <p><strong>ERROR DE CERTIFICACIÓN</strong></p>
-                <p><strong>Pedido:</strong> {order_name}</p>
-                <p><strong>Detalles del error:</strong> {order_note}</p>
-                <p>Por favor, revise y solucione el problema.</p>
-                <p>Saludos,</p>
-                <p>El equipo de soporte</p>
-            """
-
-            # 🔹 Crea y envía el correo
-            # Obtener el correo electrónico del destinatario desde la configuración del sistema
-            email_to = self.env['ir.config_parameter'].sudo().get_param('fel_error_email', 'juancarlos@olivegt.com')
-
-            mail_values = {
-                'subject': f"Error en Certificación FEL para la Orden {order_name}",
-                'email_from': self.env.user.email or 'noreply@tuempresa.com',
-                'email_to': email_to,  # Utilizar el correo configurado
-                'body_html': email_body,
-            }
-            mail = self.env['mail.mail'].create(mail_values)
-            mail.send()
-
-            _logger.info(f"📩 Correo enviado a juancarlos@olivegt.com con contenido:\n{email_body}")
+        # 🔹 En contingencia la factura se emite con un número de acceso local, sin llamar a la SAT
+        if self.company_id._is_fel_contingency_active():
+            new_move.write({'pos_config_id': self.session_id.config_id.id, 'tipo_gasto': "compra"})
+            access_number = new_move._issue_fel_contingency(self)
+            _logger.info(f"📴 Factura {new_move.name} de la orden {self.name} emitida en contingencia ({access_number}).")
+            return new_move
+
+        # 🔹 Encolar la factura; los crons de la cola la certifican y guardan el resultado
+        pending_data = {
+            "certified": False,
+            "note": "⏳ Certificación FEL en cola",
+        }
+        new_move.write(dict(pending_data, tipo_gasto="compra", pos_config_id=self.session_id.config_id.id))
+        self.write(pending_data)
+        self.env['fel.certification.queue'].sudo()._enqueue(new_move, self)
+        _logger.info(f"📥 Factura {new_move.name} de la orden {self.name} encolada para certificación FEL.")
 
         return new_move
 
-    import base64
-
     def _add_mail_attachment(self, name, ticket):
+        """
+        Adjunta el ticket y, si la factura está certificada, su PDF.
+        El ticket se reutiliza si ya existe uno idéntico (mismo checksum) para la orden, y el
+        PDF es el que se generó tras la certificación, así reenviar el recibo no crea copias.
+        """
         filename = 'Receipt-' + name + '.jpg'
-        receipt = self.env['ir.attachment'].create({
-            'name': filename,
-            'type': 'binary',
-            'datas': ticket,
-            'res_model': 'pos.order',
-            'res_id': self.ids[0],
-            'mimetype': 'image/jpeg',
-        })
+        Attachment = self.env['ir.attachment']
+        receipt = Attachment.search([
+            ('res_model', '=', 'pos.order'),
+            ('res_id', '=', self.ids[0]),
+            ('checksum', '=', Attachment._compute_checksum(base64.b64decode(ticket))),
+        ], limit=1)
+        if not receipt:
+            receipt = Attachment.create({
+                'name': filename,
+                'type': 'binary',
+                'datas': ticket,
+                'res_model': 'pos.order',
+                'res_id': self.ids[0],
+                'mimetype': 'image/jpeg',
+            })
         attachment = [(4, receipt.id)]
 
         # Verificar si el pedido tiene una factura (account_move)
@@ -138,17 +179,7 @@ class PosOrder(models.Model):
             invoice = self.account_move
             if invoice.certified:
                 # Si la factura está certificada, se adjunta el PDF
-                report = self.env['ir.actions.report']._render_qweb_pdf("account.account_invoices", invoice.ids[0])
-                filename = name + '.pdf'
-                invoice_attachment = self.env['ir.attachment'].create({
-                    'name': filename,
-                    'type': 'binary',
-                    'datas': base64.b64encode(report[0]),
-                    'res_model': 'pos.order',
-                    'res_id': self.ids[0],
-                    'mimetype': 'application/x-pdf'
-                })
-                attachment += [(4, invoice_attachment.id)]
+                attachment += [(4, invoice._get_fel_pdf_attachment().id)]
 
         return attachment
 
@@ -0,0 +1,20 @@
+import logging
+from odoo import models
+
+_logger = logging.getLogger(__name__)
+
+
+class PosSession(models.Model):
+    _inherit = 'pos.session'
+
+    def _validate_session(self, *args, **kwargs):
+        """
+        En los puntos de venta con "Facturar al Cerrar la Sesión", factura en lote las órdenes
+        pagadas antes de generar el asiento de la sesión, que debe tenerlas ya facturadas.
+        """
+        for session in self.filtered(lambda session: session.config_id.fel_invoice_at_close):
+            orders = session.order_ids.filtered(lambda order: order.state == 'paid' and order.to_invoice and not order.account_move)
+            if orders:
+                _logger.info(f"🧾 Facturando {len(orders)} órdenes de la sesión {session.name} al cerrarla.")
+                orders._fel_invoice_at_session_close()
+        return super(PosSession, self)._validate_session(*args, **kwargs)
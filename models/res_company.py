@@ -1,5 +1,8 @@
 from odoo import models, fields
 
+FEL_TOKEN_FIELDS = {'fel_user', 'fel_password', 'fel_token'}
+
+
 class ResCompany(models.Model):
     _inherit = "res.company"
 
@@ -11,3 +14,21 @@ class ResCompany(models.Model):
         ('quarterly', 'Trimestral'),
         ('monthly', 'Mensual')
     ], string="Régimen ISR")
+    fel_contingency_manual = fields.Boolean("Contingencia FEL Activa",
+                                            help="Las facturas del POS se emiten en contingencia, sin llamar a la SAT.")
+    fel_contingency_auto = fields.Boolean("Contingencia FEL Automática",
+                                          help="Emitir en contingencia mientras el circuito de certificación esté abierto.")
+
+    def _is_fel_contingency_active(self):
+        """Indica si las facturas de la compañía deben emitirse en contingencia."""
+        self.ensure_one()
+        if self.fel_contingency_manual:
+            return True
+        return self.fel_contingency_auto and not self.env['fel.circuit.breaker']._is_available('certify', self)
+
+    def write(self, vals):
+        """Descarta el token FEL en memoria si cambian las credenciales o el token."""
+        res = super(ResCompany, self).write(vals)
+        if FEL_TOKEN_FIELDS.intersection(vals):
+            self.env['fel.token']._invalidate_token(self)
+        return res
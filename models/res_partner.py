@@ -2,6 +2,9 @@ import logging
 import requests
 import json
 from odoo import models, fields, api, _
+from ..tools import fel_http, fel_metrics
+from ..tools.fel_http import ServiceUnavailable
+from .fel_nit_cache import normalize_nit
 
 _logger = logging.getLogger(__name__)
 
@@ -10,56 +13,15 @@ class ResPartner(models.Model):
     _inherit = "res.partner"
 
     def _get_or_regenerate_token(self, company):
-        """Verifica si el token ha expirado y lo regenera si es necesario."""
-        token_data = json.loads(company.fel_token or '{}')
-
-        token_expiry = token_data.get('expira_en')
-        if token_expiry:
-            token_expiry = fields.Datetime.from_string(token_expiry.replace('T', ' ').split('.')[0])
-            token_expiry = fields.Datetime.context_timestamp(self, token_expiry)
-            now = fields.Datetime.context_timestamp(self, fields.Datetime.now())
-
-            if now < token_expiry:
-                return token_data.get('Token')
-
-        _logger.info("🔄 Token ha expirado, regenerando...")
-
-        # Obtener URL del API de autenticación
-        api_url = self.env['ir.config_parameter'].sudo().get_param('fel_token_url')
-        if not api_url:
-            raise Exception("❌ URL de API de token no configurada en parámetros del sistema.")
-
-        # Construir payload con credenciales
-        username = f"GT.{company.vat.zfill(12)}.{company.fel_user}"
-        payload = {
-            "Username": username,
-            "Password": company.fel_password
-        }
-        headers = {"Content-Type": "application/json"}
-
-        try:
-            response = requests.post(api_url, headers=headers, json=payload, timeout=10)
-            response_data = response.json()
-
-            if response.status_code == 200 and response_data.get("Token"):
-                token_data = {
-                    "Token": response_data["Token"],
-                    "expira_en": response_data["expira_en"],
-                    "otorgado_a": response_data["otorgado_a"]
-                }
-                company.write({'fel_token': json.dumps(token_data)})
-                return response_data["Token"]
-            else:
-                _logger.error(f"❌ Error al obtener nuevo token: {response_data}")
-                raise Exception(f"Error al obtener nuevo token: {response_data.get('message')}")
-        except Exception as e:
-            _logger.error(f"❌ Error al conectar con API de token: {str(e)}")
-            raise Exception(f"Error al conectar con API de token: {str(e)}")
+        """Devuelve un token vigente para la compañía, regenerándolo si es necesario."""
+        return self.env['fel.token']._get_token(company)
 
     @api.model
     def verify_nit(self, vat, company_id=None):
-        """Verifica un NIT usando el API de Digifact con la compañía correcta."""
-        
+        """
+        Verifica un NIT usando el API de Digifact con la compañía correcta.
+        Los resultados se guardan en `fel.nit.cache`, así las consultas repetidas no llaman al API.
+        """
         # 🔹 Si se proporciona un company_id, lo usamos; si no, usamos la compañía en la sesión.
         company = self.env['res.company'].browse(company_id)
 
@@ -67,14 +29,40 @@ class ResPartner(models.Model):
             pos_session = self.env['pos.session'].search([('user_id', '=', self.env.uid)], limit=1)
             company = pos_session.company_id if pos_session else self.env.company
 
-        
+        nit = normalize_nit(vat)
+        nit_cache = self.env['fel.nit.cache'].sudo()
+        with fel_metrics.track(self.env.cr.dbname, 'nit_lookup', company.id) as tracker:
+            cached_result = nit_cache._get_cached_result(nit)
+            if cached_result is not None:
+                tracker.outcome = 'cache'
+                return cached_result
+
+            # La consulta se hace desde el POS: no debe pasar del plazo de la petición
+            with fel_http.deadline(self.env['fel.settings']._get_deadline('pos')):
+                result, cacheable = self._fetch_nit_info(vat, company)
+            if not cacheable:
+                tracker.outcome = 'error'
+            elif not result['valid']:
+                tracker.outcome = 'invalid'
+
+        if cacheable:
+            nit_cache._store_result(nit, result)
+        return result
+
+    @api.model
+    def _fetch_nit_info(self, vat, company):
+        """
+        Consulta el NIT en el API de Digifact.
+        Devuelve el resultado y si puede guardarse en caché: solo las respuestas definitivas
+        (NIT válido o NIT inexistente) se guardan, nunca los errores de conexión o autenticación.
+        """
         # Obtener o regenerar el token con la compañía correcta
         token = self._get_or_regenerate_token(company)
 
         _logger.info("🔑 Token obtenido correctamente para la compañía: %s", company.name)
 
         # Obtener URL del API desde los parámetros del sistema
-        api_url = self.env['ir.config_parameter'].sudo().get_param('fel_nit_validation_url')
+        api_url = self.env['fel.settings']._get().nit_validation_url
         if not api_url:
             raise Exception("❌ URL de API de validación de NIT no configurada en parámetros del sistema.")
 
@@ -97,26 +85,27 @@ class ResPartner(models.Model):
         }
 
         try:
-            response = requests.get(api_url, params=params, headers=headers, timeout=10)
+            options = fel_http.get_transport_options(self.env)
+            response = fel_http.get(api_url, params=params, headers=headers, timeout=10, endpoint='nit', **options)
             response.raise_for_status()
             data = response.json()
             _logger.info("📩 Respuesta del API: %s", json.dumps(data, indent=2))
 
             if "Message" in data:
-                return {"valid": False, "error": data["Message"]}
+                return {"valid": False, "error": data["Message"]}, False
 
             if "REQUEST" in data and data["REQUEST"][0]["Respuesta"] == 0:
-                return {"valid": False, "error": data["REQUEST"][0]["Mensaje"]}
+                return {"valid": False, "error": data["REQUEST"][0]["Mensaje"]}, True
 
             if "RESPONSE" in data and data["RESPONSE"][0]["NIT"]:
                 return {
                     "valid": True,
                     "company_name": data["RESPONSE"][0].get("NOMBRE", ""),
                     "address": data["RESPONSE"][0].get("Direccion", ""),
-                }
+                }, True
 
-            return {"valid": False, "error": "El NIT no tiene información disponible"}
+            return {"valid": False, "error": "El NIT no tiene información disponible"}, True
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ServiceUnavailable) as e:
             _logger.error("❌ Error en la consulta del NIT: %s", str(e))
-            return {"valid": False, "error": "No se pudo conectar con el API"}
+            return {"valid": False, "error": "No se pudo conectar con el API"}, False
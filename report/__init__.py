@@ -0,0 +1 @@
+from . import fel_status_report
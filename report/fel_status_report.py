@@ -0,0 +1,64 @@
+import logging
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+REPORT_TIMEZONE = 'America/Guatemala'  # Zona horaria de los días del reporte
+
+
+class FelStatusReport(models.Model):
+    """
+    Estado FEL de las órdenes de POS facturadas: certificadas, pendientes y fallidas por
+    compañía, punto de venta y día.
+    Se respalda en una vista materializada, así el reporte se lee de una tabla pequeña ya
+    agregada; el cron la refresca sin bloquear las lecturas.
+    """
+    _name = 'fel.status.report'
+    _description = 'Reporte de Estado FEL'
+    _auto = False
+    _order = 'date desc'
+
+    date = fields.Date("Día", readonly=True)
+    company_id = fields.Many2one('res.company', string="Compañía", readonly=True)
+    config_id = fields.Many2one('pos.config', string="Punto de Venta", readonly=True)
+    certified_count = fields.Integer("Certificadas", readonly=True)
+    pending_count = fields.Integer("Pendientes", readonly=True)
+    failed_count = fields.Integer("Fallidas", readonly=True)
+    total_count = fields.Integer("Total", readonly=True)
+
+    def init(self):
+        self.env.cr.execute(f"DROP MATERIALIZED VIEW IF EXISTS {self._table} CASCADE")
+        self.env.cr.execute(f"""
+            CREATE MATERIALIZED VIEW {self._table} AS (
+                SELECT row_number() OVER (ORDER BY day, company_id, config_id) AS id,
+                       day AS date, company_id, config_id,
+                       count(*) FILTER (WHERE certified) AS certified_count,
+                       count(*) FILTER (WHERE NOT certified AND NOT failed) AS pending_count,
+                       count(*) FILTER (WHERE NOT certified AND failed) AS failed_count,
+                       count(*) AS total_count
+                  FROM (
+                        SELECT po.company_id,
+                               ps.config_id,
+                               (po.date_order AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date AS day,
+                               coalesce(po.certified, FALSE) AS certified,
+                               (po.state = 'error' OR EXISTS (
+                                    SELECT 1
+                                      FROM fel_certification_queue q
+                                     WHERE q.move_id = po.account_move AND q.state = 'failed'
+                               )) AS failed
+                          FROM pos_order po
+                          JOIN pos_session ps ON ps.id = po.session_id
+                         WHERE po.account_move IS NOT NULL
+                           AND po.amount_total >= 0
+                       ) orders
+                 GROUP BY day, company_id, config_id
+            )
+        """, {'tz': REPORT_TIMEZONE})
+        # Índice único: lo exige REFRESH ... CONCURRENTLY
+        self.env.cr.execute(f"CREATE UNIQUE INDEX {self._table}_key_index ON {self._table} (date, company_id, config_id)")
+
+    @api.model
+    def _cron_refresh(self):
+        """ Recalcula la vista materializada sin bloquear a quienes la están consultando. """
+        self.env.cr.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {self._table}")
+        _logger.info("📊 Reporte de estado FEL actualizado.")
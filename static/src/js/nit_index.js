@@ -0,0 +1,134 @@
+/** @odoo-module **/
+
+odoo.define("digifact.nit_index", function (require) {
+    "use strict";
+
+    const rpc = require("web.rpc");
+
+    const DB_NAME = "digifact_nit_index";
+    const DB_VERSION = 1;
+    const STORE_NAME = "nits";
+    const STORED_TTL = 7 * 24 * 3600 * 1000; // 7 días, igual que la caché del servidor
+
+    function normalizeNit(vat) {
+        return (vat || "").replace(/[\s-]/g, "").toUpperCase();
+    }
+
+    /**
+     * Índice de NITs del POS.
+     * Responde al instante con los clientes ya cargados en el POS y con los NITs verificados
+     * guardados en IndexedDB; el resto se consulta al servidor sin bloquear la UI.
+     * Las consultas simultáneas del mismo NIT comparten una sola petición.
+     */
+    class NitIndex {
+        constructor() {
+            this.byNit = new Map();
+            this.inflight = new Map();
+            this.indexedPartnerCount = 0;
+            this.dbPromise = null;
+        }
+
+        /**
+         * Indexa por NIT los clientes cargados en el POS; solo se recorre de nuevo
+         * cuando el POS carga clientes nuevos.
+         */
+        indexPartners(posDB) {
+            if (!posDB || posDB.partner_sorted.length === this.indexedPartnerCount) {
+                return;
+            }
+            for (const partner of Object.values(posDB.partner_by_id)) {
+                const nit = normalizeNit(partner.vat);
+                if (nit && nit !== "CF" && !this.byNit.has(nit)) {
+                    this.byNit.set(nit, {
+                        valid: true,
+                        company_name: partner.name,
+                        address: partner.street || "",
+                    });
+                }
+            }
+            this.indexedPartnerCount = posDB.partner_sorted.length;
+        }
+
+        lookup(vat, companyId, posDB) {
+            const nit = normalizeNit(vat);
+            this.indexPartners(posDB);
+
+            if (this.byNit.has(nit)) {
+                return Promise.resolve(this.byNit.get(nit));
+            }
+            if (!this.inflight.has(nit)) {
+                const promise = this._lookup(vat, nit, companyId).finally(() => this.inflight.delete(nit));
+                this.inflight.set(nit, promise);
+            }
+            return this.inflight.get(nit);
+        }
+
+        async _lookup(vat, nit, companyId) {
+            const stored = await this._readStored(nit);
+            if (stored && Date.now() - stored.fetched_at < STORED_TTL) {
+                this.byNit.set(nit, stored.result);
+                return stored.result;
+            }
+
+            // 📌 shadow: la petición no bloquea la pantalla del POS
+            const result = await rpc.query({
+                model: "res.partner",
+                method: "verify_nit",
+                args: [vat, companyId],
+            }, { shadow: true });
+
+            if (result.valid) {
+                this.byNit.set(nit, result);
+                this._store(nit, result);
+            }
+            return result;
+        }
+
+        _openDB() {
+            if (!this.dbPromise) {
+                this.dbPromise = new Promise((resolve) => {
+                    if (!window.indexedDB) {
+                        resolve(null);
+                        return;
+                    }
+                    const request = window.indexedDB.open(DB_NAME, DB_VERSION);
+                    request.onupgradeneeded = () => {
+                        request.result.createObjectStore(STORE_NAME, { keyPath: "nit" });
+                    };
+                    request.onsuccess = () => resolve(request.result);
+                    request.onerror = () => resolve(null);
+                });
+            }
+            return this.dbPromise;
+        }
+
+        async _readStored(nit) {
+            const db = await this._openDB();
+            if (!db) {
+                return null;
+            }
+            return new Promise((resolve) => {
+                const request = db.transaction(STORE_NAME, "readonly").objectStore(STORE_NAME).get(nit);
+                request.onsuccess = () => resolve(request.result || null);
+                request.onerror = () => resolve(null);
+            });
+        }
+
+        async _store(nit, result) {
+            const db = await this._openDB();
+            if (db) {
+                db.transaction(STORE_NAME, "readwrite").objectStore(STORE_NAME).put({
+                    nit,
+                    result,
+                    fetched_at: Date.now(),
+                });
+            }
+        }
+    }
+
+    return {
+        NitIndex,
+        nitIndex: new NitIndex(),
+        normalizeNit,
+    };
+});
@@ -8,7 +8,7 @@ if (!odoo.__loaded_partner_vat_verification__) {
 
         const { patch } = require("@web/core/utils/patch");
         const PartnerDetailsEdit = require("point_of_sale.PartnerDetailsEdit");
-        const rpc = require("web.rpc");
+        const { nitIndex, normalizeNit } = require("digifact.nit_index");
 
         patch(PartnerDetailsEdit.prototype, "digifact_patch_partner_vat", {
             async verifyVAT() {
@@ -25,19 +25,21 @@ if (!odoo.__loaded_partner_vat_verification__) {
                     return;
                 }
 
-                this.env.services.ui.block();
+                // 📌 La verificación corre en segundo plano: el cajero puede seguir trabajando
+                this.showNotification("Verificando NIT...", 1500);
 
                 try {
                     const session = this.env.pos ? this.env.pos.config : null;
                     const company_id = session ? session.company_id[0] : this.env.company.id;
+                    const posDB = this.env.pos ? this.env.pos.db : null;
 
-                    const result = await rpc.query({
-                        model: "res.partner",
-                        method: "verify_nit",
-                        args: [vatNumber, company_id],
-                    });
+                    const result = await nitIndex.lookup(vatNumber, company_id, posDB);
 
-                    this.env.services.ui.unblock();
+                    // 📌 Ignorar la respuesta si el NIT cambió mientras se verificaba
+                    const currentVat = this.changes.vat || this.props.partner.vat;
+                    if (normalizeNit(currentVat) !== normalizeNit(vatNumber)) {
+                        return;
+                    }
 
                     if (result.valid) {
                         console.warn("✅ NIT válido, actualizando datos del cliente...");
@@ -55,8 +57,6 @@ if (!odoo.__loaded_partner_vat_verification__) {
                         });
                     }
                 } catch (error) {
-                    this.env.services.ui.unblock();
-                    
                     console.error("❌ Error al verificar el NIT:", error);
                     this.showPopup("ErrorPopup", {
                         title: "Error de Conexión",
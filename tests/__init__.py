@@ -0,0 +1,7 @@
+from . import test_dte_builder
+from . import test_fel_benchmark
+from . import test_fel_certification_queue
+from . import test_fel_certification_request
+from . import test_fel_circuit_breaker
+from . import test_fel_nit_cache
+from . import test_pos_session_close
@@ -0,0 +1,128 @@
+"""
+Utilidades de las pruebas y los benchmarks FEL.
+
+Cada benchmark se mide en varias rondas y se reporta la mejor (operaciones por segundo),
+junto con la memoria asignada en una llamada medida con tracemalloc. Los resultados se
+comparan con `benchmark_baselines.json`; con FEL_BENCHMARK_UPDATE=1 se guardan como nuevas
+líneas base y con FEL_BENCHMARK_STRICT=1 una regresión hace fallar la prueba.
+Un benchmark sin línea base hace fallar la prueba: su medición se guarda en el archivo, que
+debe revisarse y confirmarse en el repositorio (idealmente medida en la máquina de referencia).
+"""
+import os
+import json
+import time
+import logging
+import tracemalloc
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+_logger = logging.getLogger(__name__)
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_baselines.json')
+BENCHMARK_ROUNDS = 5  # Rondas por benchmark; se reporta la mejor
+BENCHMARK_MIN_TIME = 0.2  # Segundos mínimos de cada ronda
+REGRESSION_TOLERANCE = 0.25  # Caída de ops/s respecto a la línea base que se considera regresión
+
+
+def measure(func, rounds=BENCHMARK_ROUNDS, min_time=BENCHMARK_MIN_TIME):
+    """Mide `func`: mejores operaciones por segundo y memoria (pico y retenida) de una llamada, en KiB."""
+    func()  # Calentamiento: cachés del proceso e imports
+    best = 0.0
+    for _round in range(rounds):
+        ops = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            ops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, ops / elapsed)
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ops_per_sec': round(best, 2),
+        'peak_kib': round((peak - before) / 1024, 1),
+        'retained_kib': round((current - before) / 1024, 1),
+    }
+
+
+def load_baselines():
+    try:
+        with open(BASELINES_PATH) as baselines_file:
+            return json.load(baselines_file)
+    except FileNotFoundError:
+        return {}
+
+
+class FelTestCursorMixin:
+    """
+    Las transacciones propias del módulo (`registry.cursor()`: circuito, idempotencia, errores)
+    se hacen dentro de la transacción de la prueba, que se revierte al terminar.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+
+class FelBenchmarkCase(AccountTestInvoicingCommon):
+    """Caso base: mide, compara con la línea base y, al terminar, guarda los resultados si se pidió."""
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.baselines = load_baselines()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        # Con FEL_BENCHMARK_UPDATE=1 se guardan todas las mediciones; si no, solo las que no tenían línea base
+        if os.environ.get('FEL_BENCHMARK_UPDATE'):
+            new_baselines = cls.results
+        else:
+            new_baselines = {name: result for name, result in cls.results.items() if name not in cls.baselines}
+        if new_baselines:
+            baselines = load_baselines()
+            baselines.update(new_baselines)
+            with open(BASELINES_PATH, 'w') as baselines_file:
+                json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+                baselines_file.write("\n")
+            _logger.info(f"💾 Líneas base de {len(new_baselines)} benchmarks guardadas en {BASELINES_PATH}")
+        super().tearDownClass()
+
+    def bench(self, name, func):
+        # Cada benchmark es una subprueba: una falla no impide medir los siguientes
+        with self.subTest(benchmark=name):
+            return self._bench(name, func)
+
+    def _bench(self, name, func):
+        result = measure(func)
+        self.results[name] = result
+
+        baseline = self.baselines.get(name)
+        if not baseline:
+            _logger.info(f"⏱ {name}: {result['ops_per_sec']} ops/s, pico {result['peak_kib']} KiB, "
+                         f"retenido {result['retained_kib']} KiB (sin línea base)")
+            if os.environ.get('FEL_BENCHMARK_UPDATE'):
+                return result
+            self.fail(f"{name} no tenía línea base: la medición se guardó en {BASELINES_PATH}; "
+                      f"revísela y confírmela en el repositorio.")
+
+        change = result['ops_per_sec'] / baseline['ops_per_sec'] - 1
+        _logger.info(f"⏱ {name}: {result['ops_per_sec']} ops/s ({change:+.0%}), pico {result['peak_kib']} KiB "
+                     f"(base {baseline['peak_kib']} KiB), retenido {result['retained_kib']} KiB")
+        if change < -REGRESSION_TOLERANCE:
+            message = (f"Regresión en {name}: {result['ops_per_sec']} ops/s contra "
+                       f"{baseline['ops_per_sec']} ops/s de la línea base ({change:+.0%}).")
+            if os.environ.get('FEL_BENCHMARK_STRICT'):
+                self.fail(message)
+            _logger.warning(f"⚠ {message}")
+        return result
@@ -0,0 +1,186 @@
+"""
+Pruebas del constructor del DTE: escape de los textos y mismo documento que la plantilla
+f-string que lo precedía.
+"""
+from lxml import etree
+from odoo.tests import tagged
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from ..tools import dte_builder
+from ..tools.dte_builder import DteLine
+
+
+def _legacy_invoice_xml(invoice_data, tipo_frase, codigo_escenario):
+    """Plantilla con la que `_generate_invoice_xml` armaba el DTE antes del constructor (sin escape)."""
+    frase = f'<dte:Frase TipoFrase="{tipo_frase}" CodigoEscenario="{codigo_escenario}"/>' if tipo_frase and codigo_escenario else ''
+    items = "".join(f'''
+        <dte:Item NumeroLinea="{i + 1}" BienOServicio="B">
+            <dte:Cantidad>{p['cantidad']:.4f}</dte:Cantidad>
+            <dte:UnidadMedida>CA</dte:UnidadMedida>
+            <dte:Descripcion>{p['descripcion']}</dte:Descripcion>
+            <dte:PrecioUnitario>{p['precio_unitario']:.4f}</dte:PrecioUnitario>
+            <dte:Precio>{p['subtotal']:.4f}</dte:Precio>
+            <dte:Descuento>0</dte:Descuento>
+            <dte:Impuestos>
+                <dte:Impuesto>
+                <dte:NombreCorto>IVA</dte:NombreCorto>
+                <dte:CodigoUnidadGravable>1</dte:CodigoUnidadGravable>
+                <dte:MontoGravable>{p['subtotal'] / 1.12:.4f}</dte:MontoGravable>
+                <dte:MontoImpuesto>{(p['subtotal'] / 1.12) * 0.12:.4f}</dte:MontoImpuesto>
+                </dte:Impuesto>
+            </dte:Impuestos>
+            <dte:Total>{p['subtotal']:.4f}</dte:Total>
+        </dte:Item>''' for i, p in enumerate(invoice_data['productos']))
+    total_tax = (sum(p['subtotal'] for p in invoice_data['productos']) / 1.12) * 0.12
+    return f"""
+    <?xml version='1.0' encoding='UTF-8'?>
+    <dte:GTDocumento
+        xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+        xmlns:dte="http://www.sat.gob.gt/dte/fel/0.2.0"
+        Version="0.1"
+    >
+        <dte:SAT ClaseDocumento="dte">
+            <dte:DTE ID="DatosCertificados">
+                <dte:DatosEmision ID="DatosEmision">
+                <dte:DatosGenerales
+                    Tipo="FACT"
+                    FechaHoraEmision="{invoice_data['fecha_emision']}"
+                    CodigoMoneda="{invoice_data['moneda']}"
+                />
+                <dte:Emisor
+                    NITEmisor="{invoice_data['nit_emisor']}"
+                    NombreEmisor="{invoice_data['nombre_emisor']}"
+                    CodigoEstablecimiento="{invoice_data['codigo_establecimiento']}"
+                    NombreComercial="{invoice_data['nombre_establecimiento']}"
+                    AfiliacionIVA="GEN"
+                >
+                    <dte:DireccionEmisor>
+                        <dte:Direccion>{invoice_data['direccion_emisor']}</dte:Direccion>
+                        <dte:CodigoPostal>0100</dte:CodigoPostal>
+                        <dte:Municipio>GUATEMALA</dte:Municipio>
+                        <dte:Departamento>GUATEMALA</dte:Departamento>
+                        <dte:Pais>GT</dte:Pais>
+                    </dte:DireccionEmisor>
+                </dte:Emisor>
+                <dte:Receptor
+                    NombreReceptor="{invoice_data['nombre_receptor']}"
+                    IDReceptor="{invoice_data['nit_receptor']}"
+                >
+                    <dte:DireccionReceptor>
+                        <dte:Direccion>GUATEMALA</dte:Direccion>
+                        <dte:CodigoPostal>01010</dte:CodigoPostal>
+                        <dte:Municipio>GUATEMALA</dte:Municipio>
+                        <dte:Departamento>GUATEMALA</dte:Departamento>
+                        <dte:Pais>GT</dte:Pais>
+                    </dte:DireccionReceptor>
+                </dte:Receptor>
+                <dte:Frases>
+                    {frase}
+                </dte:Frases>
+                <dte:Items>
+                    {items}
+                </dte:Items>
+                <dte:Totales>
+                    <dte:TotalImpuestos>
+                        <dte:TotalImpuesto NombreCorto="IVA" TotalMontoImpuesto="{total_tax:.4f}"/>
+                    </dte:TotalImpuestos>
+                    <dte:GranTotal>{invoice_data['monto_total']:.4f}</dte:GranTotal>
+                </dte:Totales>
+                </dte:DatosEmision>
+            </dte:DTE>
+        </dte:SAT>
+    </dte:GTDocumento>""".strip().encode()
+
+
+def _canonical(xml):
+    """Forma canónica (C14N) del documento, sin los espacios entre nodos."""
+    root = etree.fromstring(xml)
+    for element in root.iter():
+        if element.text is not None and not element.text.strip():
+            element.text = None
+        if element.tail is not None and not element.tail.strip():
+            element.tail = None
+    return etree.tostring(root, method='c14n')
+
+
+@tagged('post_install', '-at_install')
+class TestDteBuilder(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data['company']
+        cls.company.write({'vat': '12345678', 'street': '6a Avenida 1-23 Zona 1', 'regimen_ISR': 'monthly'})
+        cls.pos_config = cls.env['pos.config'].new({
+            'name': 'Caja FEL',
+            'establishment_id': '2',
+            'establishment_name': 'Sucursal Centro',
+        })
+
+    def _legacy_data(self, products, nombre_receptor="Consumidor Final"):
+        return {
+            'nit_emisor': self.company.vat,
+            'nombre_emisor': self.company.name,
+            'codigo_establecimiento': self.pos_config.establishment_id,
+            'nombre_establecimiento': self.pos_config.establishment_name,
+            'direccion_emisor': self.company.street,
+            'nit_receptor': 'CF',
+            'nombre_receptor': nombre_receptor,
+            'fecha_emision': '2024-01-31T10:20:30',
+            'moneda': 'GTQ',
+            'monto_total': sum(product['subtotal'] for product in products),
+            'productos': products,
+        }
+
+    def _builder_data(self, legacy_data):
+        """Los mismos datos en el formato del constructor, con los montos que calculaba la plantilla."""
+        lines = [DteLine(p['descripcion'], p['cantidad'], p['precio_unitario'], p['subtotal'],
+                         p['subtotal'] / 1.12, (p['subtotal'] / 1.12) * 0.12)
+                 for p in legacy_data['productos']]
+        return dict(legacy_data, productos=lines,
+                    total_impuestos=(sum(p['subtotal'] for p in legacy_data['productos']) / 1.12) * 0.12)
+
+    def _build(self, invoice_data):
+        return dte_builder.build_invoice_xml(dte_builder.build_header(self.company, self.pos_config), invoice_data)
+
+    def test_same_document_as_legacy_template(self):
+        products = [
+            {'descripcion': f"Producto {index}", 'cantidad': 1.0 + index % 3,
+             'precio_unitario': 10.5 + index, 'subtotal': (1.0 + index % 3) * (10.5 + index)}
+            for index in range(25)
+        ]
+        legacy_data = self._legacy_data(products)
+        self.assertEqual(_canonical(self._build(self._builder_data(legacy_data))),
+                         _canonical(_legacy_invoice_xml(legacy_data, 1, 2)))
+
+    def test_same_document_without_frases(self):
+        self.company.regimen_ISR = False
+        legacy_data = self._legacy_data([{'descripcion': "Servicio", 'cantidad': 1.0,
+                                          'precio_unitario': 112.0, 'subtotal': 112.0}])
+        self.assertEqual(_canonical(self._build(self._builder_data(legacy_data))),
+                         _canonical(_legacy_invoice_xml(legacy_data, None, None)))
+
+    def test_escapes_text_and_attributes(self):
+        name = 'Tienda <Doña & "Hijos">'
+        description = "Café & <Pan> 'dulce'"
+        legacy_data = self._legacy_data([{'descripcion': description, 'cantidad': 2.0,
+                                          'precio_unitario': 5.6, 'subtotal': 11.2}], nombre_receptor=name)
+
+        # La plantilla anterior producía un documento inválido, que el certificador rechazaba
+        with self.assertRaises(etree.XMLSyntaxError):
+            _canonical(_legacy_invoice_xml(legacy_data, 1, 2))
+
+        root = etree.fromstring(self._build(self._builder_data(legacy_data)))
+        namespaces = {'dte': dte_builder.DTE_NS}
+        self.assertEqual(root.find('.//dte:Receptor', namespaces).get('NombreReceptor'), name)
+        self.assertEqual(root.find('.//dte:Item/dte:Descripcion', namespaces).text, description)
+
+    def test_adenda_only_with_internal_reference(self):
+        invoice_data = self._builder_data(self._legacy_data([{'descripcion': "Producto", 'cantidad': 1.0,
+                                                              'precio_unitario': 10.0, 'subtotal': 10.0}]))
+        namespaces = {'dte': dte_builder.DTE_NS}
+
+        root = etree.fromstring(self._build(invoice_data))
+        self.assertIsNone(root.find('.//dte:Adenda', namespaces))
+
+        root = etree.fromstring(self._build(dict(invoice_data, referencia_interna="INV/2024/00001")))
+        self.assertEqual(root.find('.//dte:Adenda/REFERENCIA_INTERNA', namespaces).text, "INV/2024/00001")
@@ -0,0 +1,119 @@
+"""
+Benchmarks de las rutas críticas de FEL, sin red.
+
+Corren con las pruebas normales (post_install); para ejecutar solo los benchmarks:
+    odoo-bin -d <bd> -i Odoo16-Digifact --test-tags fel_benchmark --stop-after-init
+"""
+import json
+from datetime import timedelta
+from unittest.mock import patch
+from odoo import fields, Command
+from odoo.tests import tagged
+from .common import FelBenchmarkCase
+from ..tools.dte_builder import DteLine
+from ..models import fel_token
+from ..models.fel_qr_code import render_qr
+
+LINE_COUNTS = (1, 50, 500, 5000)
+FAKE_TOKEN = "Bearer benchmark"
+
+
+@tagged('-at_install', 'post_install', 'fel_benchmark')
+class TestFelBenchmark(FelBenchmarkCase):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data['company']
+        cls.company.write({
+            'vat': '12345678',
+            'fel_user': 'benchmark',
+            'fel_password': 'benchmark',
+            'regimen_ISR': 'monthly',
+        })
+        cls.pos_config = cls.env['pos.config'].new({
+            'name': 'Benchmark',
+            'establishment_id': '1',
+            'establishment_name': 'Benchmark',
+        })
+        cls.invoices = {count: cls._create_benchmark_invoice(count) for count in LINE_COUNTS}
+
+    @classmethod
+    def _create_benchmark_invoice(cls, line_count):
+        return cls.env['account.move'].create({
+            'move_type': 'out_invoice',
+            'partner_id': cls.partner_a.id,
+            'invoice_date': fields.Date.today(),
+            'invoice_line_ids': [
+                Command.create({
+                    'name': f"Producto {index}",
+                    'product_id': cls.product_a.id,
+                    'quantity': 1 + index % 5,
+                    'price_unit': 10.0 + index % 100,
+                }) for index in range(line_count)
+            ],
+        })
+
+    def _synthetic_invoice_data(self, line_count):
+        products = []
+        for index in range(line_count):
+            quantity, price_unit = 1.0 + index % 5, 10.0 + index % 100
+            total = quantity * price_unit
+            products.append(DteLine(f"Producto <{index}> & cía", quantity, price_unit, total, total / 1.12, total - total / 1.12))
+        return {
+            'nit_receptor': 'CF',
+            'nombre_receptor': 'Consumidor Final',
+            'fecha_emision': '2024-01-31T10:20:30',
+            'numero_acceso': None,
+            'moneda': 'GTQ',
+            'monto_total': sum(product.precio for product in products),
+            'total_impuestos': sum(product.monto_impuesto for product in products),
+            'productos': products,
+        }
+
+    def test_generate_invoice_xml(self):
+        move = self.invoices[1]
+        for line_count in LINE_COUNTS:
+            invoice_data = self._synthetic_invoice_data(line_count)
+            self.bench(f"generate_invoice_xml[{line_count}]",
+                       lambda: move._generate_invoice_xml(invoice_data, self.pos_config))
+
+    def test_prepare_fel_invoice_data(self):
+        with patch.object(type(self.env['fel.token']), '_get_token', return_value=FAKE_TOKEN):
+            for line_count in LINE_COUNTS:
+                move = self.invoices[line_count]
+
+                def prepare():
+                    # Sin caché del ORM, como en la primera certificación de la factura
+                    self.env.invalidate_all()
+                    return move._prepare_fel_invoice_data(self.pos_config)
+
+                self.bench(f"prepare_fel_invoice_data[{line_count}]", prepare)
+
+    def test_generate_qr_code(self):
+        move = self.invoices[1]
+        move.write({'fel_number': '123456789', 'fel_authorization_number': 'ABCDEF01-2345-6789-ABCD-EF0123456789'})
+        qr_url = move._get_qr_url_fel()
+
+        self.bench("render_qr[png]", lambda: render_qr(qr_url, 'png'))
+        self.bench("render_qr[svg]", lambda: render_qr(qr_url, 'svg'))
+        self.bench("generate_qr_code_fel[cached]", move._generate_qr_code_fel)
+
+    def test_token_parsing(self):
+        expiry = fields.Datetime.now() + timedelta(hours=12)
+        token_json = json.dumps({
+            'Token': FAKE_TOKEN,
+            'expira_en': expiry.strftime('%Y-%m-%dT%H:%M:%S.123'),
+            'otorgado_a': 'benchmark',
+        })
+
+        def parse():
+            token_data = json.loads(token_json)
+            return fel_token._is_token_fresh(fel_token._parse_token_expiry(token_data['expira_en']))
+
+        self.bench("parse_token", parse)
+
+        # Ruta común: el token vigente ya está en la caché del proceso
+        key = (self.env.cr.dbname, self.company.id)
+        with patch.dict(fel_token._token_cache, {key: (FAKE_TOKEN, expiry)}):
+            self.bench("get_token[cached]", lambda: self.env['fel.token']._get_token(self.company))
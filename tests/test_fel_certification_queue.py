@@ -0,0 +1,75 @@
+"""
+Pruebas de la cola de certificación: espera exponencial entre intentos y reprogramación sin
+consumir un intento cuando se agota el plazo antes de enviar.
+"""
+from datetime import timedelta
+from unittest.mock import patch
+from odoo import fields
+from odoo.tests import tagged
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from ..models.fel_certification_queue import QUEUE_BACKOFF_BASE, QUEUE_BACKOFF_MAX, QUEUE_MAX_ATTEMPTS
+from ..tools.fel_http import DeadlineExceeded
+
+
+@tagged('post_install', '-at_install')
+class TestFelCertificationQueue(AccountTestInvoicingCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.queue = self.env['fel.certification.queue']
+        self.move = self.init_invoice('out_invoice', amounts=[112.0], post=True)
+        self.job = self.queue.create({'move_id': self.move.id})
+
+    def _process(self, **certify_kwargs):
+        with patch.object(self.registry['account.move'], '_certify_invoice_with_sat', **certify_kwargs) as certify:
+            self.job._process()
+        return certify
+
+    def test_backoff_delay(self):
+        self.assertEqual([self.queue._get_backoff_delay(attempts) for attempts in range(1, 5)],
+                         [QUEUE_BACKOFF_BASE, QUEUE_BACKOFF_BASE * 2, QUEUE_BACKOFF_BASE * 4, QUEUE_BACKOFF_BASE * 8])
+        self.assertEqual(self.queue._get_backoff_delay(0), QUEUE_BACKOFF_BASE)
+        self.assertEqual(self.queue._get_backoff_delay(20), QUEUE_BACKOFF_MAX)
+
+    def test_deadline_does_not_consume_attempt(self):
+        before = fields.Datetime.now()
+        self._process(side_effect=DeadlineExceeded("Sin plazo para llamar a la SAT"))
+        self.assertRecordValues(self.job, [{'state': 'pending', 'attempts': 0}])
+        self.assertIn("Sin plazo", self.job.last_error)
+        self.assertLessEqual(self.job.next_attempt_at, fields.Datetime.now())
+        self.assertGreaterEqual(self.job.next_attempt_at, before)
+        self.assertFalse(self.move.certified)
+
+    def test_failure_schedules_retry(self):
+        before = fields.Datetime.now()
+        self._process(side_effect=Exception("Error 500 de Digifact"))
+        self.assertRecordValues(self.job, [{'state': 'pending', 'attempts': 1}])
+        self.assertGreaterEqual(self.job.next_attempt_at, before + timedelta(seconds=QUEUE_BACKOFF_BASE))
+        self.assertLessEqual(self.job.next_attempt_at, fields.Datetime.now() + timedelta(seconds=QUEUE_BACKOFF_BASE))
+
+    def test_last_attempt_marks_failed(self):
+        self.job.attempts = QUEUE_MAX_ATTEMPTS - 1
+        self._process(side_effect=Exception("NIT del receptor inválido"))
+        self.assertRecordValues(self.job, [{'state': 'failed', 'attempts': QUEUE_MAX_ATTEMPTS}])
+        self.assertFalse(self.move.certified)
+        self.assertIn("NIT del receptor inválido", self.move.note)
+        self.assertTrue(self.env['fel.certification.error'].search([('move_id', '=', self.move.id)]))
+
+    def test_success(self):
+        certify = self._process(return_value={
+            'fel_number': '123456789',
+            'fel_reference': 'ABCD1234',
+            'fel_authorization_number': 'ABCD1234-075B-4E6C-9A1D-0123456789AB',
+            'fel_certificate_date': '2024-01-31T10:20:30',
+            'signed_xml': None,
+        })
+        certify.assert_called_once()
+        self.assertRecordValues(self.job, [{'state': 'done', 'attempts': 1, 'last_error': False}])
+        self.assertRecordValues(self.move, [{'certified': True, 'fel_number': '123456789'}])
+        self.assertTrue(self.move.ref.startswith('ABCD1234-123456789'))
+
+    def test_certified_move_is_skipped(self):
+        self.move.certified = True
+        certify = self._process(return_value={})
+        certify.assert_not_called()
+        self.assertEqual(self.job.state, 'done')
@@ -0,0 +1,95 @@
+"""
+Pruebas del registro de idempotencia: un solo envío por factura y reutilización de la autorización.
+"""
+from unittest.mock import Mock
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from ..models.fel_certification_request import DEDUP_STALE_SECONDS
+from ..tools.fel_http import OutcomeUnknown
+from .common import FelTestCursorMixin
+
+
+@tagged('post_install', '-at_install')
+class TestFelCertificationRequest(FelTestCursorMixin, AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.certification_data = {
+            'fel_number': '123456789',
+            'fel_reference': 'ABCD1234',
+            'fel_authorization_number': 'ABCD1234-075B-4E6C-9A1D-0123456789AB',
+            'fel_certificate_date': '2024-01-31T10:20:30',
+            'signed_xml': b'<dte:GTDocumento/>',
+        }
+
+    def setUp(self):
+        super().setUp()
+        self.dedup = self.env['fel.certification.request']
+        self.move = self.init_invoice('out_invoice', amounts=[112.0], post=True)
+
+    def test_claim_then_busy(self):
+        self.assertEqual(self.dedup._try_claim(self.move), ('owner', None))
+        self.assertEqual(self.dedup._try_claim(self.move), ('busy', None))
+
+    def test_done_is_reused(self):
+        self.dedup._try_claim(self.move)
+        self.dedup._finish(self.move, self.certification_data)
+        self.assertEqual(self.dedup._try_claim(self.move), ('done', self.certification_data))
+        self.assertEqual(self.dedup._get_done_results(self.move.ids), {self.move.id: self.certification_data})
+
+    def test_certify_once_sends_once(self):
+        send = Mock(return_value=self.certification_data)
+        self.assertEqual(self.dedup._certify_once(self.move, send), self.certification_data)
+        self.assertEqual(self.dedup._certify_once(self.move, send), self.certification_data)
+        send.assert_called_once()
+
+    def test_failed_can_be_claimed_again(self):
+        self.dedup._try_claim(self.move)
+        self.dedup._finish(self.move, Exception("NIT del receptor inválido"))
+        self.assertEqual(self.dedup._try_claim(self.move), ('owner', None))
+
+    def test_unknown_blocks_resend(self):
+        send = Mock(side_effect=OutcomeUnknown("Timeout de lectura"))
+        with self.assertRaises(OutcomeUnknown):
+            self.dedup._certify_once(self.move, send)
+        self.assertEqual(self.dedup._try_claim(self.move), ('unknown', None))
+        with self.assertRaises(UserError):
+            self.dedup._certify_once(self.move, send)
+        send.assert_called_once()
+
+        # Confirmado en Digifact que no se autorizó: puede enviarse de nuevo
+        self.dedup._release_unknown(self.move, "No existe en Digifact")
+        self.assertEqual(self.dedup._try_claim(self.move), ('owner', None))
+
+    def test_stale_in_flight_becomes_unknown(self):
+        self.dedup._try_claim(self.move)
+        self.env.cr.execute("""
+            UPDATE fel_certification_request
+               SET started_at = started_at - %s * interval '1 second'
+             WHERE move_id = %s
+        """, (DEDUP_STALE_SECONDS + 1, self.move.id))
+        self.assertEqual(self.dedup._try_claim(self.move), ('unknown', None))
+
+    def test_manual_confirmation(self):
+        self.env.user.groups_id |= self.env.ref('account.group_account_manager')
+        self.dedup._try_claim(self.move)
+        self.dedup._finish(self.move, OutcomeUnknown("Conexión cortada"))
+        self.env.invalidate_all()
+        request = self.dedup.search([('move_id', '=', self.move.id)])
+        self.assertEqual(request.state, 'unknown')
+
+        with self.assertRaises(UserError):
+            request.action_confirm_authorized()
+        request.write({
+            'fel_number': self.certification_data['fel_number'],
+            'fel_authorization_number': self.certification_data['fel_authorization_number'],
+        })
+        request.action_confirm_authorized()
+        self.assertEqual(self.dedup._try_claim(self.move)[0], 'done')
+
+    def test_finish_creates_missing_row(self):
+        # La conciliación guarda autorizaciones de facturas que nunca pasaron por `_try_claim`
+        self.dedup._finish(self.move, self.certification_data)
+        self.assertEqual(self.dedup._try_claim(self.move), ('done', self.certification_data))
@@ -0,0 +1,97 @@
+"""
+Pruebas del circuit breaker FEL: cerrado → abierto → en prueba, y qué errores cuentan como fallo.
+"""
+from odoo.tests import tagged
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from ..tools.fel_http import ServiceUnavailable, DeadlineExceeded
+from .common import FelTestCursorMixin
+
+
+@tagged('post_install', '-at_install')
+class TestFelCircuitBreaker(FelTestCursorMixin, AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data['company']
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = self.env['fel.circuit.breaker']
+        self.threshold = self.env['fel.settings']._get().circuit_failure_threshold
+
+    def _state(self, endpoint='certify'):
+        return self.breaker._get_status(endpoint, self.company)[0]
+
+    def _open(self, endpoint='certify'):
+        for _i in range(self.threshold):
+            self.breaker._record_failure(endpoint, self.company)
+
+    def _expire(self, endpoint='certify'):
+        """Vence la ventana de apertura (o de prueba) sin esperar."""
+        self.env.cr.execute("""
+            UPDATE fel_circuit_breaker
+               SET opened_until = (now() at time zone 'UTC') - interval '1 second',
+                   probe_until = (now() at time zone 'UTC') - interval '1 second'
+             WHERE endpoint = %s AND company_id = %s
+        """, (endpoint, self.company.id))
+
+    def test_opens_at_threshold(self):
+        self.assertTrue(self.breaker._check('certify', self.company))
+        for _i in range(self.threshold - 1):
+            self.breaker._record_failure('certify', self.company)
+        self.assertEqual(self._state(), 'closed')
+        self.assertFalse(self.breaker._check('certify', self.company))
+
+        self.breaker._record_failure('certify', self.company)
+        self.assertEqual(self._state(), 'open')
+        self.assertFalse(self.breaker._is_available('certify', self.company))
+        with self.assertRaises(ServiceUnavailable):
+            self.breaker._check('certify', self.company)
+
+    def test_half_open_single_probe(self):
+        self._open()
+        self._expire()
+        self.assertTrue(self.breaker._is_available('certify', self.company))
+
+        # Solo un llamador pasa como prueba; los demás siguen fallando rápido
+        self.assertFalse(self.breaker._check('certify', self.company))
+        self.assertEqual(self._state(), 'half_open')
+        with self.assertRaises(ServiceUnavailable):
+            self.breaker._check('certify', self.company)
+
+    def test_probe_failure_reopens(self):
+        self._open()
+        self._expire()
+        self.breaker._check('certify', self.company)
+        self.breaker._record_failure('certify', self.company)
+        self.assertEqual(self._state(), 'open')
+        with self.assertRaises(ServiceUnavailable):
+            self.breaker._check('certify', self.company)
+
+    def test_probe_success_closes(self):
+        self._open()
+        self._expire()
+        self.breaker._call('certify', self.company, lambda: 'ok')
+        self.assertEqual(self.breaker._get_status('certify', self.company)[:2], ('closed', 0))
+        self.assertTrue(self.breaker._check('certify', self.company))
+
+    def test_only_service_errors_count(self):
+        def raise_error(error):
+            raise error
+
+        with self.assertRaises(DeadlineExceeded):
+            self.breaker._call('certify', self.company, raise_error, DeadlineExceeded("Sin plazo"))
+        with self.assertRaises(ValueError):
+            self.breaker._call('certify', self.company, raise_error, ValueError("Rechazado por la SAT"))
+        self.assertEqual(self.breaker._get_status('certify', self.company)[:2], ('closed', 0))
+
+        with self.assertRaises(ServiceUnavailable):
+            self.breaker._call('certify', self.company, raise_error, ServiceUnavailable("503"))
+        self.assertEqual(self.breaker._get_status('certify', self.company)[:2], ('closed', 1))
+
+    def test_endpoints_are_independent(self):
+        self._open('document')
+        self.assertEqual(self._state('document'), 'open')
+        self.assertTrue(self.breaker._is_available('certify', self.company))
+        self.assertTrue(self.breaker._check('certify', self.company))
@@ -0,0 +1,83 @@
+"""
+Pruebas de la caché de verificación de NIT: aciertos, vencimiento y qué resultados se guardan.
+"""
+from unittest.mock import patch
+from odoo.tests import tagged
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+from ..models import fel_nit_cache
+from ..tools import fel_metrics
+
+VALID_RESULT = {"valid": True, "company_name": "DISTRIBUIDORA EJEMPLO, S.A.", "address": "CIUDAD"}
+INVALID_RESULT = {"valid": False, "error": "NIT no encontrado"}
+
+
+@tagged('post_install', '-at_install')
+class TestFelNitCache(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.company = cls.company_data['company']
+
+    def setUp(self):
+        super().setUp()
+        # La caché en memoria es del proceso: no debe arrastrar entradas de otras pruebas
+        fel_nit_cache._nit_lru.clear()
+        self.addCleanup(fel_nit_cache._nit_lru.clear)
+        # Las métricas se guardan en otra conexión, fuera de la transacción de la prueba
+        patcher = patch.object(fel_metrics, 'observe')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.settings = self.env['fel.settings']._get()
+
+    def _verify(self, vat, result, cacheable=True):
+        with patch.object(self.registry['res.partner'], '_fetch_nit_info', return_value=(result, cacheable)) as fetch:
+            verified = self.env['res.partner'].verify_nit(vat, self.company.id)
+        return verified, fetch.call_count
+
+    def _age(self, nit, seconds):
+        """Envejece la entrada guardada del NIT y vacía la caché en memoria."""
+        self.env.cr.execute("""
+            UPDATE fel_nit_cache SET fetched_at = fetched_at - %s * interval '1 second' WHERE nit = %s
+        """, (seconds, nit))
+        self.env.invalidate_all()
+        fel_nit_cache._nit_lru.clear()
+
+    def test_cache_hit(self):
+        self.assertEqual(self._verify('1234567-8', VALID_RESULT), (VALID_RESULT, 1))
+        # El mismo NIT escrito de otra forma usa la misma entrada, sin llamar al API
+        self.assertEqual(self._verify(' 12345678 ', VALID_RESULT), (VALID_RESULT, 0))
+
+        # Otro proceso (sin la caché en memoria) lo encuentra en la tabla
+        fel_nit_cache._nit_lru.clear()
+        self.assertEqual(self._verify('12345678', VALID_RESULT), (VALID_RESULT, 0))
+
+    def test_expired_entry_is_fetched_again(self):
+        self._verify('12345678', VALID_RESULT)
+        self._age('12345678', self.settings.nit_cache_ttl - 60)
+        self.assertEqual(self._verify('12345678', VALID_RESULT)[1], 0)
+
+        self._age('12345678', 120)
+        self.assertEqual(self._verify('12345678', VALID_RESULT)[1], 1)
+
+    def test_invalid_nit_expires_sooner(self):
+        self._verify('87654321', INVALID_RESULT)
+        self.assertEqual(self._verify('87654321', INVALID_RESULT), (INVALID_RESULT, 0))
+
+        self._age('87654321', self.settings.nit_cache_negative_ttl + 1)
+        self.assertEqual(self._verify('87654321', INVALID_RESULT)[1], 1)
+
+    def test_errors_are_not_cached(self):
+        error = {"valid": False, "error": "Error de conexión con Digifact"}
+        self._verify('12345678', error, cacheable=False)
+        self.assertEqual(self._verify('12345678', error, cacheable=False)[1], 1)
+        self.assertFalse(self.env['fel.nit.cache'].search([('nit', '=', '12345678')]))
+
+    def test_memory_entry_expires(self):
+        key = (self.env.cr.dbname, '12345678')
+        with patch.object(fel_nit_cache.time, 'monotonic', return_value=1000.0):
+            fel_nit_cache._lru_put(key, VALID_RESULT, 60)
+            self.assertEqual(fel_nit_cache._lru_get(key), VALID_RESULT)
+        with patch.object(fel_nit_cache.time, 'monotonic', return_value=1060.0):
+            self.assertIsNone(fel_nit_cache._lru_get(key))
+        self.assertNotIn(key, fel_nit_cache._nit_lru)
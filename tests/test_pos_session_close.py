@@ -0,0 +1,67 @@
+"""
+Pruebas de "Facturar al Cerrar la Sesión": las órdenes sincronizadas quedan sin factura y se
+facturan en lote al cerrar la sesión.
+"""
+from odoo.tests import tagged
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+from ..models.account_move import SESSION_CLOSE_PENDING_NOTE
+
+
+@tagged('post_install', '-at_install')
+class TestPosSessionClose(TestPoSCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        cls.product = cls.create_product('Producto FEL', cls.categ_basic, 112.0, 50.0)
+        cls.basic_config.fel_invoice_at_close = True
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.basic_config
+
+    def _sync_order(self):
+        """Sincroniza una orden pagada como lo hace el POS y la devuelve."""
+        order_data = self.create_ui_order_data([(self.product, 1)], customer=self.customer, is_invoiced=True)
+        result = self.env['pos.order'].create_from_ui([order_data])
+        return self.env['pos.order'].browse(result[0]['id'])
+
+    def test_invoices_at_session_close(self):
+        session = self.open_new_session()
+        orders = self._sync_order() | self._sync_order()
+        self.assertEqual(orders.mapped('state'), ['paid', 'paid'])
+        self.assertFalse(orders.account_move)
+
+        session.action_pos_session_validate()
+        self.assertEqual(session.state, 'closed')
+        self.assertEqual(orders.mapped('state'), ['invoiced', 'invoiced'])
+        self.assertEqual(len(orders.account_move), 2)
+        self.assertEqual(set(orders.account_move.mapped('state')), {'posted'})
+        self.assertEqual(orders.account_move.pos_config_id, self.config)
+        # La compañía no certifica: no hay nada pendiente
+        self.assertFalse(any(orders.account_move.mapped('fel_session_close_pending')))
+
+    def test_pending_certification_after_close(self):
+        if 'tipo_gasto' not in self.env['account.move']._fields:
+            self.skipTest("La factura certificable necesita el campo tipo_gasto")
+        self.env['ir.config_parameter'].sudo().set_param('certify_allowed_companies', str(self.config.company_id.id))
+
+        session = self.open_new_session()
+        order = self._sync_order()
+        self.assertFalse(order.account_move)
+
+        session.action_pos_session_validate()
+        self.assertRecordValues(order.account_move, [{
+            'certified': False,
+            'fel_session_close_pending': True,
+            'note': SESSION_CLOSE_PENDING_NOTE,
+        }])
+        # Las facturas del cierre se certifican en lote, no una por una desde la cola
+        self.assertFalse(self.env['fel.certification.queue'].search([('move_id', '=', order.account_move.id)]))
+
+    def test_invoices_on_sync_without_option(self):
+        self.config.fel_invoice_at_close = False
+        self.open_new_session()
+        order = self._sync_order()
+        self.assertEqual(order.state, 'invoiced')
+        self.assertEqual(order.account_move.pos_config_id, self.config)
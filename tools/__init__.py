@@ -0,0 +1,3 @@
+from . import dte_builder
+from . import fel_http
+from . import fel_metrics
@@ -0,0 +1,207 @@
+"""
+Constructor del XML del DTE (GTDocumento) que se envía a certificar.
+
+El encabezado del emisor (emisor, establecimiento y frases) se arma una sola vez por
+compañía y punto de venta y se reutiliza; las líneas se escriben una por una con el
+serializador incremental de lxml, por lo que la memoria no crece con el número de líneas
+más allá del propio documento. lxml escapa todos los textos y atributos.
+Los montos de cada línea (base gravable e impuesto) vienen ya calculados por Odoo en
+`DteLine`; aquí solo se formatean.
+"""
+import threading
+from collections import namedtuple
+from io import BytesIO
+from lxml import etree
+
+DTE_NS = "http://www.sat.gob.gt/dte/fel/0.2.0"
+XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
+NSMAP = {'dte': DTE_NS, 'xsi': XSI_NS}
+
+HEADER_CACHE_SIZE = 256
+
+# Línea del DTE: precio es el total de la línea con impuestos
+DteLine = namedtuple('DteLine', 'descripcion cantidad precio_unitario precio monto_gravable monto_impuesto')
+
+# (base de datos, compañía, punto de venta, fechas de modificación) -> encabezado
+_header_cache = {}
+_header_cache_lock = threading.Lock()
+
+
+def _q(tag):
+    return f"{{{DTE_NS}}}{tag}"
+
+
+def _text(value):
+    """Convierte un valor del ORM en texto; False/None se escriben vacíos."""
+    if value is None or value is False:
+        return ""
+    return str(value)
+
+
+def _node(tag, attrs=None, text=None, children=()):
+    """Nodo del encabezado: (tag, atributos, texto, hijos)."""
+    return (tag, {key: _text(value) for key, value in (attrs or {}).items()}, text, tuple(children))
+
+
+def _write_node(xf, node):
+    tag, attrs, text, children = node
+    with xf.element(_q(tag), attrs):
+        if text is not None:
+            xf.write(_text(text))
+        for child in children:
+            _write_node(xf, child)
+
+
+def _get_frase(regimen_isr):
+    """TipoFrase y CodigoEscenario según el régimen ISR de la compañía."""
+    if regimen_isr == 'quarterly':
+        return 1, 1
+    if regimen_isr == 'monthly':
+        return 1, 2
+    return None, None
+
+
+def build_header(company, pos_config):
+    """Arma el encabezado del emisor (emisor, dirección y frases) para la compañía y el punto de venta."""
+    tipo_frase, codigo_escenario = _get_frase(company.regimen_ISR)
+    frases = []
+    if tipo_frase and codigo_escenario:
+        frases.append(_node('Frase', {'TipoFrase': tipo_frase, 'CodigoEscenario': codigo_escenario}))
+
+    emisor = _node('Emisor', {
+        'NITEmisor': company.vat,
+        'NombreEmisor': company.name,
+        'CodigoEstablecimiento': pos_config.establishment_id or "1",
+        'NombreComercial': pos_config.establishment_name or "NAPARI",
+        'AfiliacionIVA': "GEN",
+    }, children=[
+        _node('DireccionEmisor', children=[
+            _node('Direccion', text=company.street),
+            _node('CodigoPostal', text="0100"),
+            _node('Municipio', text="GUATEMALA"),
+            _node('Departamento', text="GUATEMALA"),
+            _node('Pais', text="GT"),
+        ]),
+    ])
+    return {
+        'emisor': emisor,
+        'frases': _node('Frases', children=frases),
+        'regimen_isr': company.regimen_ISR,
+        'tipo_frase': tipo_frase,
+        'codigo_escenario': codigo_escenario,
+    }
+
+
+def get_header(company, pos_config):
+    """
+    Devuelve el encabezado en caché para (compañía, punto de venta).
+    La llave incluye las fechas de modificación, así que editar la compañía o el punto
+    de venta genera un encabezado nuevo.
+    """
+    key = (company.env.cr.dbname, company.id, pos_config.id, company.write_date, pos_config.write_date)
+    header = _header_cache.get(key)
+    if header is None:
+        header = build_header(company, pos_config)
+        with _header_cache_lock:
+            if len(_header_cache) >= HEADER_CACHE_SIZE:
+                _header_cache.clear()
+            _header_cache[key] = header
+    return header
+
+
+def _write_receptor(xf, invoice_data):
+    with xf.element(_q('Receptor'), {
+        'NombreReceptor': _text(invoice_data['nombre_receptor']),
+        'IDReceptor': _text(invoice_data['nit_receptor']),
+    }):
+        with xf.element(_q('DireccionReceptor')):
+            for tag, value in (('Direccion', "GUATEMALA"), ('CodigoPostal', "01010"), ('Municipio', "GUATEMALA"),
+                               ('Departamento', "GUATEMALA"), ('Pais', "GT")):
+                with xf.element(_q(tag)):
+                    xf.write(value)
+
+
+def _write_item(xf, line_number, line):
+    """Escribe una línea (DteLine) del DTE y devuelve su impuesto."""
+    with xf.element(_q('Item'), {'NumeroLinea': str(line_number), 'BienOServicio': "B"}):
+        for tag, value in (
+            ('Cantidad', f"{line.cantidad:.4f}"),
+            ('UnidadMedida', "CA"),
+            ('Descripcion', _text(line.descripcion)),
+            ('PrecioUnitario', f"{line.precio_unitario:.4f}"),
+            ('Precio', f"{line.precio:.4f}"),
+            ('Descuento', "0"),
+        ):
+            with xf.element(_q(tag)):
+                xf.write(value)
+        with xf.element(_q('Impuestos')), xf.element(_q('Impuesto')):
+            for tag, value in (
+                ('NombreCorto', "IVA"),
+                ('CodigoUnidadGravable', "1"),
+                ('MontoGravable', f"{line.monto_gravable:.4f}"),
+                ('MontoImpuesto', f"{line.monto_impuesto:.4f}"),
+            ):
+                with xf.element(_q(tag)):
+                    xf.write(value)
+        with xf.element(_q('Total')):
+            xf.write(f"{line.precio:.4f}")
+    return line.monto_impuesto
+
+
+def write_invoice_xml(out, header, invoice_data):
+    """Escribe el GTDocumento de la factura en el archivo binario `out`."""
+    with etree.xmlfile(out, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        with xf.element(_q('GTDocumento'), {'Version': "0.1"}, nsmap=NSMAP), \
+                xf.element(_q('SAT'), {'ClaseDocumento': "dte"}):
+            _write_dte(xf, header, invoice_data)
+            if invoice_data.get('referencia_interna'):
+                # Solo con la consulta por referencia activa; sin ella el DTE no lleva Adenda
+                with xf.element(_q('Adenda')), xf.element('REFERENCIA_INTERNA'):
+                    xf.write(_text(invoice_data['referencia_interna']))
+
+
+def _write_dte(xf, header, invoice_data):
+    """Escribe el nodo DTE con los datos de emisión, receptor, ítems y totales."""
+    with xf.element(_q('DTE'), {'ID': "DatosCertificados"}), \
+            xf.element(_q('DatosEmision'), {'ID': "DatosEmision"}):
+        datos_generales = {
+            'Tipo': "FACT",
+            'FechaHoraEmision': _text(invoice_data['fecha_emision']),
+            'CodigoMoneda': _text(invoice_data['moneda']),
+        }
+        if invoice_data.get('numero_acceso'):
+            # Factura emitida en contingencia
+            datos_generales['NumeroAcceso'] = _text(invoice_data['numero_acceso'])
+        with xf.element(_q('DatosGenerales'), datos_generales):
+            pass
+        _write_node(xf, header['emisor'])
+        _write_receptor(xf, invoice_data)
+        _write_node(xf, header['frases'])
+
+        lines_tax = 0.0
+        with xf.element(_q('Items')):
+            for line_number, line in enumerate(invoice_data['productos'], start=1):
+                lines_tax += _write_item(xf, line_number, line)
+
+        # El total de impuestos sale de las líneas de impuesto de la factura; si no viene, de las líneas
+        total_tax = invoice_data.get('total_impuestos')
+        if total_tax is None:
+            total_tax = lines_tax
+
+        with xf.element(_q('Totales')):
+            with xf.element(_q('TotalImpuestos')):
+                with xf.element(_q('TotalImpuesto'), {
+                    'NombreCorto': "IVA",
+                    'TotalMontoImpuesto': f"{total_tax:.4f}",
+                }):
+                    pass
+            with xf.element(_q('GranTotal')):
+                xf.write(f"{invoice_data['monto_total']:.4f}")
+
+
+def build_invoice_xml(header, invoice_data):
+    """Devuelve el GTDocumento de la factura como bytes UTF-8."""
+    out = BytesIO()
+    write_invoice_xml(out, header, invoice_data)
+    return out.getvalue()
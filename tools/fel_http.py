@@ -0,0 +1,240 @@
+"""
+Transporte HTTP compartido para las llamadas a Digifact (token, certificación y NIT).
+
+Cada proceso mantiene una `requests.Session` por URL base con un pool de conexiones
+keep-alive, de modo que las llamadas reutilizan la conexión TCP+TLS ya abierta.
+Las llamadas idempotentes pueden reintentarse con espera exponencial y jitter.
+
+Cada llamada respeta el plazo del punto de entrada que la originó (sincronización del POS,
+certificación manual o cron), fijado con `deadline()`. El timeout de lectura se adapta a la
+latencia observada de cada endpoint y nunca excede el tiempo que le queda al llamador.
+"""
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+import requests
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10  # Conexiones keep-alive por URL base
+DEFAULT_RETRIES = 2  # Reintentos para llamadas idempotentes
+DEFAULT_BACKOFF = 0.5  # Segundos base de la espera entre reintentos
+MAX_BACKOFF = 5.0  # Espera máxima entre reintentos
+RETRY_STATUSES = frozenset({502, 503, 504})
+CONNECT_TIMEOUT = 5.0  # Segundos máximos para abrir la conexión
+MIN_READ_TIMEOUT = 2.0  # Timeout de lectura mínimo por defecto
+LATENCY_WINDOW = 200  # Duraciones recientes que se guardan por endpoint
+LATENCY_MIN_SAMPLES = 20  # Con menos muestras se usa el timeout máximo de la llamada
+LATENCY_PERCENTILE = 99  # Percentil de la latencia observada que define el timeout
+LATENCY_MULTIPLIER = 3  # El timeout de lectura es este múltiplo del percentil observado
+DEADLINE_MARGIN = 1.0  # Segundos que se reservan al llamador para guardar el resultado
+
+
+class ServiceUnavailable(Exception):
+    """El servicio no respondió: error de conexión, timeout, respuesta 5xx o circuito abierto."""
+
+
+class DeadlineExceeded(ServiceUnavailable):
+    """El plazo del llamador no alcanza para hacer la llamada; no se envió nada."""
+
+
+class OutcomeUnknown(ServiceUnavailable):
+    """La petición pudo llegar al servicio pero no hubo respuesta válida: no se sabe si se procesó."""
+
+
+# Plazo (time.monotonic) del punto de entrada actual; None si no tiene límite
+_deadline = contextvars.ContextVar('fel_http_deadline', default=None)
+
+# endpoint -> duraciones recientes (segundos) de las respuestas, por proceso
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+@contextmanager
+def deadline_at(monotonic_deadline):
+    """Limita las llamadas del bloque al instante `monotonic_deadline`; un plazo exterior más corto se respeta."""
+    current = _deadline.get()
+    if monotonic_deadline is not None and current is not None:
+        monotonic_deadline = min(monotonic_deadline, current)
+    token = _deadline.set(monotonic_deadline if monotonic_deadline is not None else current)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def deadline(seconds):
+    """Limita a `seconds` las llamadas hechas dentro del bloque (`with fel_http.deadline(20): ...`); 0 o None: sin plazo."""
+    return deadline_at(time.monotonic() + seconds if seconds else None)
+
+
+def get_deadline():
+    """Plazo actual (time.monotonic) o None. Los hilos no lo heredan: debe pasarse con `deadline=`."""
+    return _deadline.get()
+
+
+def get_remaining(monotonic_deadline=None):
+    """Segundos que quedan del plazo dado o del actual; None si no hay plazo."""
+    monotonic_deadline = monotonic_deadline if monotonic_deadline is not None else _deadline.get()
+    if monotonic_deadline is None:
+        return None
+    return monotonic_deadline - time.monotonic()
+
+
+def observe_latency(endpoint, seconds):
+    """Registra la duración de una respuesta del endpoint."""
+    with _latencies_lock:
+        samples = _latencies.get(endpoint)
+        if samples is None:
+            samples = _latencies[endpoint] = deque(maxlen=LATENCY_WINDOW)
+        samples.append(seconds)
+
+
+def get_latency_percentile(endpoint, percent=LATENCY_PERCENTILE):
+    """Percentil de las duraciones recientes del endpoint, o None si aún no hay suficientes muestras."""
+    with _latencies_lock:
+        samples = sorted(_latencies.get(endpoint, ()))
+    if len(samples) < LATENCY_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, len(samples) * percent // 100)]
+
+
+def get_timeouts(endpoint, max_timeout, min_timeout=MIN_READ_TIMEOUT, monotonic_deadline=None):
+    """
+    Devuelve (connect, read) para la siguiente llamada al endpoint. El timeout de lectura es
+    LATENCY_MULTIPLIER veces el p99 observado, entre `min_timeout` y `max_timeout`, y se recorta
+    al tiempo que le queda al llamador. Lanza DeadlineExceeded si ese tiempo no alcanza ni para
+    `min_timeout`: es mejor no enviar que cortar una llamada que el servidor sí procesará.
+    """
+    observed = get_latency_percentile(endpoint)
+    read_timeout = max_timeout
+    if observed is not None and max_timeout:
+        read_timeout = min(max_timeout, max(min_timeout, observed * LATENCY_MULTIPLIER))
+    connect_timeout = CONNECT_TIMEOUT if not max_timeout else min(CONNECT_TIMEOUT, max_timeout)
+
+    remaining = get_remaining(monotonic_deadline)
+    if remaining is not None:
+        budget = remaining - DEADLINE_MARGIN
+        if budget < min_timeout:
+            raise DeadlineExceeded(f"Sin tiempo para llamar a {endpoint}: quedan {max(remaining, 0):.1f} s del plazo.")
+        read_timeout = min(read_timeout, budget) if read_timeout else budget
+        connect_timeout = min(connect_timeout, budget)
+    return connect_timeout, read_timeout
+
+
+# (pid, URL base) -> requests.Session; el pid evita compartir sockets entre workers tras un fork
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_base_url(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url, pool_size=DEFAULT_POOL_SIZE):
+    """Devuelve la sesión del proceso para la URL base de `url`, creándola si no existe."""
+    key = (os.getpid(), _get_base_url(url))
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _sessions[key] = session
+    return session
+
+
+def get_transport_options(env):
+    """
+    Configuración del transporte, tomada de la configuración FEL en caché, con el plazo del
+    punto de entrada actual; así las llamadas hechas desde otros hilos también lo respetan.
+    """
+    settings = env['fel.settings']._get()
+    return {
+        'pool_size': settings.http_pool_size,
+        'retries': settings.http_retries,
+        'backoff': settings.http_backoff,
+        'deadline': _deadline.get(),
+    }
+
+
+def may_have_been_sent(error):
+    """
+    Indica si la petición pudo llegar al servidor antes del error de transporte `error`.
+    Solo los errores al abrir la conexión (timeout de conexión, DNS, conexión rechazada o TLS)
+    garantizan que no se envió nada; un timeout de lectura o una conexión cortada no.
+    """
+    if isinstance(error, (requests.ConnectTimeout, requests.exceptions.SSLError, requests.exceptions.ProxyError)):
+        return False
+    if isinstance(error, requests.ConnectionError):
+        cause = error.args[0] if error.args else None
+        if isinstance(cause, MaxRetryError):
+            cause = cause.reason
+        return not isinstance(cause, NewConnectionError)
+    return isinstance(error, requests.RequestException)
+
+
+def _get_backoff_delay(attempt, backoff):
+    """Espera exponencial con jitter completo para el reintento número `attempt`."""
+    return random.uniform(0, min(MAX_BACKOFF, backoff * (2 ** (attempt - 1))))
+
+
+def request(method, url, retries=0, backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE, timeout=None,
+            min_timeout=MIN_READ_TIMEOUT, deadline=None, endpoint=None, **kwargs):
+    """
+    Envía una petición usando la sesión compartida.
+    Con `retries` > 0 reintenta ante errores de conexión, timeouts y respuestas 502/503/504;
+    solo debe usarse en llamadas idempotentes.
+    `timeout` es el máximo de lectura; el real se adapta a la latencia de `endpoint` y al
+    plazo `deadline` (time.monotonic), que por defecto es el del punto de entrada actual.
+    """
+    session = get_session(url, pool_size)
+    endpoint = endpoint or _get_base_url(url) + urlsplit(url).path
+    deadline = deadline if deadline is not None else _deadline.get()
+    attempt = 0
+    while True:
+        timeouts = get_timeouts(endpoint, timeout, min_timeout, deadline)
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, timeout=timeouts, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if isinstance(e, requests.ReadTimeout):
+                # Se registra como una respuesta que tardó todo el timeout: si el servicio se volvió
+                # más lento, el percentil sube y los siguientes timeouts se amplían
+                observe_latency(endpoint, timeouts[1])
+            if attempt >= retries:
+                raise
+            _logger.warning("Reintentando %s %s tras error: %s", method, url, e)
+        else:
+            if response.status_code < 500:
+                observe_latency(endpoint, time.monotonic() - start)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                return response
+            _logger.warning("Reintentando %s %s tras respuesta %s", method, url, response.status_code)
+            response.close()  # Devuelve la conexión al pool antes de reintentar
+        attempt += 1
+        delay = _get_backoff_delay(attempt, backoff)
+        remaining = get_remaining(deadline)
+        if remaining is not None and remaining - delay - DEADLINE_MARGIN < min_timeout:
+            raise DeadlineExceeded(f"Sin tiempo para reintentar la llamada a {endpoint}.")
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
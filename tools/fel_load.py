@@ -0,0 +1,313 @@
+"""
+Prueba de carga de punta a punta contra el Digifact simulado (`tools/mock_digifact.py`).
+
+Reproduce N sesiones de POS concurrentes que sincronizan órdenes facturadas con
+`create_from_ui` (que llega a `_create_invoice` y encola la certificación) y, en paralelo,
+consultas de NIT con `verify_nit`. Cada sesión usa su propio cursor y confirma cada orden,
+como un POS real. Reporta throughput, latencias p50/p95/p99 y las esperas por bloqueos de
+PostgreSQL vistas durante la prueba.
+
+Solo debe correr en una base de datos de pruebas: crea órdenes y facturas reales. Desde un
+shell de Odoo, con los parámetros fel_*_url apuntando al servidor simulado. El nombre
+técnico del módulo se toma del registro (`_module`), como MODULE_NAME en la cola; puede no
+ser un identificador válido de Python, por eso se importa con importlib:
+    import importlib
+    fel_load = importlib.import_module(f"odoo.addons.{env['fel.settings']._module}.tools.fel_load")
+    fel_load.run(env, config_ids=[1, 2, 3, 4], orders_per_session=100, nit_lookups=500)
+
+Con `drain_timeout` espera además a que los crons de la cola certifiquen las facturas; para
+eso el servidor de Odoo (con crons) debe estar corriendo sobre la misma base de datos.
+"""
+import time
+import uuid
+import random
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from odoo import api, fields, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+LOCK_SAMPLE_INTERVAL = 0.1  # Segundos entre cada muestra de pg_stat_activity
+DRAIN_POLL_INTERVAL = 2  # Segundos entre cada revisión de facturas certificadas
+PERCENTILES = (50, 95, 99)
+
+
+def _percentile(sorted_values, percent):
+    """Percentil por rango más cercano de una lista ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    """Resumen de una operación: cantidad, errores, operaciones por segundo y percentiles en ms."""
+    sorted_values = sorted(latencies)
+    summary = {
+        'count': len(sorted_values),
+        'errors': errors,
+        'throughput': len(sorted_values) / elapsed if elapsed else 0.0,
+    }
+    for percent in PERCENTILES:
+        summary[f'p{percent}_ms'] = round(_percentile(sorted_values, percent) * 1000, 1)
+    return summary
+
+
+class _Recorder:
+    """Latencias y errores por operación, compartidos entre los hilos."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = Counter()
+
+    def add(self, operation, seconds):
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+
+    def fail(self, operation):
+        with self.lock:
+            self.errors[operation] += 1
+
+
+class _LockMonitor(threading.Thread):
+    """Muestrea las sesiones de la base de datos que esperan un bloqueo mientras corre la prueba."""
+
+    def __init__(self, registry):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.stop_event = threading.Event()
+        self.samples = 0
+        self.waiting_samples = 0
+        self.max_waiting = 0
+        self.wait_seconds = 0.0
+        self.queries = Counter()
+
+    def run(self):
+        with self.registry.cursor() as cr:
+            while not self.stop_event.wait(LOCK_SAMPLE_INTERVAL):
+                cr.execute("""
+                    SELECT left(regexp_replace(query, '\\s+', ' ', 'g'), 80)
+                      FROM pg_stat_activity
+                     WHERE datname = current_database()
+                       AND wait_event_type = 'Lock'
+                """)
+                waiting = [query for query, in cr.fetchall()]
+                cr.rollback()
+                self.samples += 1
+                if waiting:
+                    self.waiting_samples += 1
+                    self.max_waiting = max(self.max_waiting, len(waiting))
+                    self.wait_seconds += len(waiting) * LOCK_SAMPLE_INTERVAL
+                    self.queries.update(waiting)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def report(self):
+        return {
+            'samples': self.samples,
+            'samples_with_waits': self.waiting_samples,
+            'max_waiting_sessions': self.max_waiting,
+            'approx_wait_seconds': round(self.wait_seconds, 1),
+            'top_waiting_queries': self.queries.most_common(3),
+        }
+
+
+def _build_order(env, session, partner, products, lines_per_order, sequence):
+    """Orden en el formato que envía el POS a `create_from_ui`, con impuestos calculados como el POS."""
+    config = session.config_id
+    payment_method = config.payment_method_ids[:1]
+    order_uid = f"{session.id:05d}-{uuid.uuid4().hex[:3]}-{sequence:04d}"
+    lines = []
+    amount_total = amount_tax = 0.0
+    for product in random.sample(products, min(lines_per_order, len(products))):
+        qty = random.randint(1, 5)
+        taxes = product.taxes_id.filtered(lambda tax: tax.company_id == config.company_id)
+        computed = taxes.compute_all(product.lst_price, config.currency_id, qty, product=product, partner=partner)
+        amount_total += computed['total_included']
+        amount_tax += computed['total_included'] - computed['total_excluded']
+        lines.append([0, 0, {
+            'product_id': product.id,
+            'qty': qty,
+            'price_unit': product.lst_price,
+            'discount': 0,
+            'price_subtotal': computed['total_excluded'],
+            'price_subtotal_incl': computed['total_included'],
+            'tax_ids': [(6, 0, taxes.ids)],
+            'pack_lot_ids': [],
+        }])
+    amount_total = config.currency_id.round(amount_total)
+    return {
+        'id': order_uid,
+        'to_invoice': True,
+        'data': {
+            'name': f"Orden {order_uid}",
+            'uid': order_uid,
+            'sequence_number': sequence,
+            'pos_session_id': session.id,
+            'user_id': env.uid,
+            'partner_id': partner.id,
+            'pricelist_id': config.pricelist_id.id,
+            'fiscal_position_id': False,
+            'creation_date': fields.Datetime.to_string(fields.Datetime.now()),
+            'amount_total': amount_total,
+            'amount_tax': config.currency_id.round(amount_tax),
+            'amount_paid': amount_total,
+            'amount_return': 0,
+            'to_invoice': True,
+            'lines': lines,
+            'statement_ids': [[0, 0, {
+                'payment_method_id': payment_method.id,
+                'amount': amount_total,
+                'name': fields.Datetime.to_string(fields.Datetime.now()),
+            }]],
+        },
+    }
+
+
+def _replay_session(registry, uid, session_id, partner_id, product_ids, orders, lines_per_order, recorder):
+    """Sincroniza las órdenes de una sesión una por una, cada una en su propia transacción."""
+    with registry.cursor() as cr:
+        env = api.Environment(cr, uid, {})
+        session = env['pos.session'].browse(session_id)
+        partner = env['res.partner'].browse(partner_id)
+        products = list(env['product.product'].browse(product_ids))
+        for sequence in range(1, orders + 1):
+            order = _build_order(env, session, partner, products, lines_per_order, sequence)
+            start = time.perf_counter()
+            try:
+                env['pos.order'].create_from_ui([order])
+                cr.commit()
+            except Exception as e:
+                cr.rollback()
+                recorder.fail('create_from_ui')
+                _logger.warning(f"⚠ Orden {order['id']} no sincronizada: {e}")
+            else:
+                recorder.add('create_from_ui', time.perf_counter() - start)
+            env.invalidate_all()
+
+
+def _replay_nit_lookups(registry, uid, company_id, vats, recorder):
+    """Consulta los NIT en su propia transacción, como el POS al buscar un cliente."""
+    with registry.cursor() as cr:
+        env = api.Environment(cr, uid, {})
+        for vat in vats:
+            start = time.perf_counter()
+            try:
+                env['res.partner'].verify_nit(vat, company_id)
+                cr.commit()
+            except Exception as e:
+                cr.rollback()
+                recorder.fail('verify_nit')
+                _logger.warning(f"⚠ Consulta del NIT {vat} fallida: {e}")
+            else:
+                recorder.add('verify_nit', time.perf_counter() - start)
+
+
+def _open_sessions(env, config_ids):
+    """Sesión abierta de cada punto de venta; se abre una si no la hay."""
+    sessions = env['pos.session']
+    for config in env['pos.config'].browse(config_ids):
+        session = config.current_session_id
+        if not session:
+            session = env['pos.session'].create({'config_id': config.id, 'user_id': env.uid})
+            session.action_pos_session_open()
+        sessions |= session
+    return sessions
+
+
+def _wait_certified(env, start_date, company_ids, timeout):
+    """Espera a que las facturas creadas desde `start_date` queden certificadas; devuelve (certificadas, pendientes, segundos)."""
+    start = time.monotonic()
+    domain = [('move_type', '=', 'out_invoice'), ('create_date', '>=', start_date), ('company_id', 'in', company_ids)]
+    while True:
+        env.cr.rollback()
+        env.invalidate_all()
+        certified = env['account.move'].search_count(domain + [('certified', '=', True)])
+        pending = env['account.move'].search_count(domain + [('certified', '=', False)])
+        elapsed = time.monotonic() - start
+        if not pending or elapsed >= timeout:
+            return certified, pending, elapsed
+        time.sleep(DRAIN_POLL_INTERVAL)
+
+
+def run(env, config_ids, orders_per_session=50, lines_per_order=3, nit_lookups=0, nit_workers=4,
+        partner_id=None, product_ids=None, drain_timeout=0, uid=SUPERUSER_ID):
+    """
+    Ejecuta la prueba de carga: una sesión concurrente por punto de venta de `config_ids` y
+    `nit_lookups` consultas de NIT repartidas en `nit_workers` hilos. Devuelve el reporte (dict)
+    y lo escribe en el log.
+    """
+    configs = env['pos.config'].browse(config_ids)
+    company = configs[:1].company_id
+    partner = env['res.partner'].browse(partner_id) if partner_id else \
+        env['res.partner'].search([('vat', '=', 'CF')], limit=1) or company.partner_id
+    products = env['product.product'].browse(product_ids) if product_ids else env['product.product'].search([
+        ('available_in_pos', '=', True), ('sale_ok', '=', True), ('lst_price', '>', 0),
+        ('company_id', 'in', [False, company.id]),
+    ], limit=20)
+    if not products:
+        raise Exception("No hay productos disponibles en el POS para la prueba de carga.")
+
+    sessions = _open_sessions(env, config_ids)
+    env.cr.commit()
+    start_date = fields.Datetime.now()
+
+    registry = env.registry
+    recorder = _Recorder()
+    monitor = _LockMonitor(registry)
+    # NIT aleatorios: cada consulta llega al API en lugar de resolverse en la caché
+    vats = [str(random.randint(1000000, 99999999)) for _index in range(nit_lookups)]
+    nit_chunks = [vats[index::nit_workers] for index in range(nit_workers)] if vats else []
+
+    _logger.info(f"🚀 Prueba de carga FEL: {len(sessions)} sesiones x {orders_per_session} órdenes, "
+                 f"{nit_lookups} consultas de NIT.")
+    monitor.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sessions) + len(nit_chunks)) as executor:
+        futures = [
+            executor.submit(_replay_session, registry, uid, session.id, partner.id, products.ids,
+                            orders_per_session, lines_per_order, recorder)
+            for session in sessions
+        ] + [
+            executor.submit(_replay_nit_lookups, registry, uid, company.id, chunk, recorder)
+            for chunk in nit_chunks
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    monitor.stop()
+
+    report = {
+        'elapsed_seconds': round(elapsed, 2),
+        'operations': {
+            operation: summarize(latencies, recorder.errors[operation], elapsed)
+            for operation, latencies in recorder.latencies.items()
+        },
+        'lock_waits': monitor.report(),
+    }
+    if drain_timeout:
+        certified, pending, drain_seconds = _wait_certified(env, start_date, configs.company_id.ids, drain_timeout)
+        report['certification'] = {
+            'certified': certified,
+            'pending': pending,
+            'seconds': round(drain_seconds, 1),
+            'throughput': certified / (elapsed + drain_seconds),
+        }
+
+    for operation, summary in report['operations'].items():
+        _logger.info(f"📊 {operation}: {summary['count']} ok, {summary['errors']} errores, "
+                     f"{summary['throughput']:.1f}/s, p50 {summary['p50_ms']} ms, "
+                     f"p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms")
+    locks = report['lock_waits']
+    _logger.info(f"🔒 Esperas por bloqueos: {locks['samples_with_waits']}/{locks['samples']} muestras, "
+                 f"hasta {locks['max_waiting_sessions']} sesiones, ~{locks['approx_wait_seconds']} s en total.")
+    if 'certification' in report:
+        certification = report['certification']
+        _logger.info(f"✅ Certificación: {certification['certified']} certificadas, {certification['pending']} "
+                     f"pendientes tras {certification['seconds']} s.")
+    return report
@@ -0,0 +1,141 @@
+"""
+Métricas de las operaciones FEL (token, certificación, NIT, QR y XML).
+
+Cada observación solo suma en memoria del proceso: una búsqueda del bucket y un
+diccionario protegido por un lock, sin tocar la base de datos. Un hilo de fondo del
+proceso suma cada FLUSH_INTERVAL segundos los acumulados a la tabla `fel_metric`, en
+una transacción propia, y así el endpoint `/metrics` ve los valores de todos los workers.
+Las peticiones del POS y de la certificación nunca pagan ese volcado.
+"""
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+import odoo
+from .fel_http import ServiceUnavailable
+
+_logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 10  # Segundos entre cada volcado a la base de datos
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+# base de datos -> {(operación, compañía, resultado): ([conteo por bucket], [suma por bucket])}
+_pending = {}
+_pending_lock = threading.Lock()
+# (pid, hilo) del volcado de fondo; el pid evita dar por vivo un hilo que no sobrevivió a un fork
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def observe(dbname, operation, company_id, outcome, seconds):
+    """Registra una observación en memoria; el hilo de fondo la vuelca a la base de datos."""
+    index = bisect_left(BUCKETS, seconds)
+    key = (operation, company_id, outcome)
+    with _pending_lock:
+        series = _pending.setdefault(dbname, {}).get(key)
+        if series is None:
+            series = _pending[dbname][key] = ([0] * len(BUCKETS), [0.0] * len(BUCKETS))
+        series[0][index] += 1
+        series[1][index] += seconds
+    _ensure_flusher()
+
+
+def _ensure_flusher():
+    """Inicia el hilo de volcado del proceso si aún no existe."""
+    global _flusher
+    pid = os.getpid()
+    if _flusher is not None and _flusher[0] == pid:
+        return
+    with _flusher_lock:
+        if _flusher is not None and _flusher[0] == pid:
+            return
+        thread = threading.Thread(target=_flush_loop, name='fel-metrics-flush', daemon=True)
+        _flusher = (pid, thread)
+        thread.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with _pending_lock:
+            dbnames = list(_pending)
+        for dbname in dbnames:
+            try:
+                flush(dbname)
+            except Exception:
+                _logger.exception("❌ Error al volcar las métricas FEL.")
+
+
+class _Tracker:
+    __slots__ = ('outcome',)
+
+    def __init__(self):
+        self.outcome = None
+
+
+@contextmanager
+def track(dbname, operation, company_id):
+    """
+    Mide la duración del bloque. El resultado es 'success', 'unavailable' (ServiceUnavailable)
+    o 'error'; el bloque puede fijar otro asignando `tracker.outcome`.
+    """
+    tracker = _Tracker()
+    start = time.perf_counter()
+    try:
+        yield tracker
+    except ServiceUnavailable:
+        tracker.outcome = tracker.outcome or 'unavailable'
+        raise
+    except Exception:
+        tracker.outcome = tracker.outcome or 'error'
+        raise
+    finally:
+        observe(dbname, operation, company_id, tracker.outcome or 'success', time.perf_counter() - start)
+
+
+def _take(dbname):
+    with _pending_lock:
+        return _pending.pop(dbname, None)
+
+
+def _restore(dbname, pending):
+    """Devuelve a memoria los acumulados que no se pudieron volcar."""
+    with _pending_lock:
+        current = _pending.setdefault(dbname, {})
+        for key, (counts, sums) in pending.items():
+            series = current.get(key)
+            if series is None:
+                current[key] = (counts, sums)
+                continue
+            for index in range(len(BUCKETS)):
+                series[0][index] += counts[index]
+                series[1][index] += sums[index]
+
+
+def flush(dbname):
+    """Suma a la tabla `fel_metric` los acumulados del proceso para la base de datos."""
+    pending = _take(dbname)
+    if not pending:
+        return
+    rows = []
+    # Orden fijo de las filas: dos workers volcando a la vez no se bloquean entre sí
+    for (operation, company_id, outcome), (counts, sums) in sorted(pending.items()):
+        for index, le in enumerate(BUCKETS):
+            if counts[index]:
+                rows.append((operation, company_id, outcome, le, counts[index], sums[index]))
+    try:
+        with odoo.sql_db.db_connect(dbname).cursor() as cr:
+            values = ", ".join(["(%s, %s, %s, %s, %s, %s, (now() at time zone 'UTC'), (now() at time zone 'UTC'))"] * len(rows))
+            cr.execute(f"""
+                INSERT INTO fel_metric (operation, company_id, outcome, le, count, total_seconds, create_date, write_date)
+                VALUES {values}
+                ON CONFLICT (operation, company_id, outcome, le) DO UPDATE
+                   SET count = fel_metric.count + EXCLUDED.count,
+                       total_seconds = fel_metric.total_seconds + EXCLUDED.total_seconds,
+                       write_date = EXCLUDED.write_date
+            """, [value for row in rows for value in row])
+    except Exception:
+        _logger.warning("⚠ No se pudieron guardar las métricas FEL, se reintentará más tarde.", exc_info=True)
+        _restore(dbname, pending)
@@ -0,0 +1,253 @@
+"""
+Servidor local que imita a Digifact (token, certificación y NIT) para pruebas de carga.
+
+No depende de Odoo ni de la red; se ejecuta como script:
+    python3 tools/mock_digifact.py --port 8089 --latency 0.3 --jitter 0.1 --error-rate 0.02
+
+y se configura en Odoo con los parámetros del sistema:
+    fel_token_url           http://127.0.0.1:8089/token
+    fel_certify_url         http://127.0.0.1:8089/certify
+    fel_nit_validation_url  http://127.0.0.1:8089/nit
+
+La consulta de DTE por referencia interna (TIPO=GET_DOCUMENTS_BY_REFERENCE) es la que usa la
+conciliación con `fel_reconcile_reference_lookup` activo; el servidor la simula tal como la
+espera el módulo, no como la publica Digifact.
+
+La latencia, la tasa de errores 5xx, la de rechazos y la de timeouts pueden fijarse para
+todos los endpoints (`--latency 0.3`) o para uno solo (`--latency certify=1.2`).
+"""
+import re
+import json
+import time
+import uuid
+import base64
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+_logger = logging.getLogger(__name__)
+
+ENDPOINTS = ('token', 'certify', 'nit')
+DEFAULT_HANG_SECONDS = 75  # Espera de un "timeout": supera el timeout de todas las llamadas del módulo
+TOKEN_LIFETIME = timedelta(days=1)
+REFERENCE_PATTERN = re.compile(rb'<REFERENCIA_INTERNA>([^<]*)</REFERENCIA_INTERNA>')
+
+
+class MockSettings:
+    """Comportamiento de cada endpoint: latencia, jitter y tasas de error, rechazo y timeout."""
+
+    def __init__(self, hang_seconds=DEFAULT_HANG_SECONDS, seed=None):
+        self.hang_seconds = hang_seconds
+        self.values = {name: {endpoint: 0.0 for endpoint in ENDPOINTS}
+                       for name in ('latency', 'jitter', 'error_rate', 'reject_rate', 'timeout_rate')}
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def set(self, name, spec):
+        """Aplica `valor` a todos los endpoints o `endpoint=valor` a uno solo."""
+        endpoint, _sep, value = spec.rpartition('=')
+        if endpoint and endpoint not in ENDPOINTS:
+            raise ValueError(f"Endpoint desconocido: {endpoint}")
+        for target in ([endpoint] if endpoint else ENDPOINTS):
+            self.values[name][target] = float(value)
+
+    def get(self, name, endpoint):
+        return self.values[name][endpoint]
+
+    def roll(self, name, endpoint):
+        """Indica si esta petición debe fallar según la tasa `name` del endpoint."""
+        with self.random_lock:
+            return self.random.random() < self.get(name, endpoint)
+
+    def delay(self, endpoint):
+        with self.random_lock:
+            jitter = self.random.uniform(-1, 1) * self.get('jitter', endpoint)
+        return max(0.0, self.get('latency', endpoint) + jitter)
+
+
+class MockState:
+    """Documentos certificados y contadores de peticiones, compartidos entre los hilos del servidor."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.references = {}
+        self.next_number = 1
+        self.counters = {}
+
+    def count(self, endpoint, outcome):
+        with self.lock:
+            self.counters[(endpoint, outcome)] = self.counters.get((endpoint, outcome), 0) + 1
+
+    def certify(self, xml):
+        with self.lock:
+            number = self.next_number
+            self.next_number += 1
+            authorization = str(uuid.uuid4()).upper()
+            document = {
+                "Codigo": 1,
+                "Mensaje": "Documento certificado (simulado)",
+                "NUMERO": str(number),
+                "Serie": authorization[:8],
+                "Autorizacion": authorization,
+                "Fecha_de_certificacion": datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+                "ResponseDATA1": base64.b64encode(xml).decode(),
+            }
+            self.documents[authorization] = document
+            reference = REFERENCE_PATTERN.search(xml or b"")
+            if reference:
+                self.references[reference.group(1).decode()] = document
+            return document
+
+    def get_document(self, authorization):
+        with self.lock:
+            return self.documents.get(authorization)
+
+    def get_documents_by_reference(self, references):
+        with self.lock:
+            return [dict(self.references[reference], ReferenciaInterna=reference)
+                    for reference in references if reference in self.references]
+
+
+class MockDigifactHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como el transporte del módulo
+
+    @property
+    def settings(self):
+        return self.server.mock_settings
+
+    @property
+    def state(self):
+        return self.server.mock_state
+
+    def log_message(self, format, *args):
+        _logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _handle(self, method):
+        parts = urlsplit(self.path)
+        endpoint = parts.path.strip('/').split('/')[-1]
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        body = self._read_body()
+        if endpoint not in ENDPOINTS:
+            self.state.count(endpoint or '/', 'not_found')
+            self._send_json(404, {"message": "Endpoint no simulado"})
+            return
+
+        # 🔹 Fallas configuradas: timeout, error del servidor o latencia normal
+        if self.settings.roll('timeout_rate', endpoint):
+            self.state.count(endpoint, 'timeout')
+            time.sleep(self.settings.hang_seconds)
+        else:
+            time.sleep(self.settings.delay(endpoint))
+        if self.settings.roll('error_rate', endpoint):
+            self.state.count(endpoint, 'error')
+            self._send_json(503, {"message": "Servicio no disponible (simulado)"})
+            return
+
+        handler = getattr(self, f"_handle_{endpoint}")
+        status, payload, outcome = handler(method, query, body)
+        self.state.count(endpoint, outcome)
+        self._send_json(status, payload)
+
+    def _handle_token(self, method, query, body):
+        try:
+            credentials = json.loads(body or b"{}")
+        except ValueError:
+            credentials = {}
+        if not credentials.get('Username'):
+            return 400, {"message": "Usuario requerido"}, 'reject'
+        return 200, {
+            "Token": f"Bearer mock-{uuid.uuid4().hex}",
+            "expira_en": (datetime.now() + TOKEN_LIFETIME).strftime('%Y-%m-%dT%H:%M:%S.000'),
+            "otorgado_a": credentials['Username'],
+        }, 'success'
+
+    def _handle_certify(self, method, query, body):
+        if query.get('TIPO') == 'GET_DOCUMENT':
+            document = self.state.get_document(query.get('GUID'))
+            if not document:
+                return 404, {"Codigo": 0, "Mensaje": "Documento no encontrado"}, 'not_found'
+            return 200, document, 'success'
+        if query.get('TIPO') == 'GET_DOCUMENTS_BY_REFERENCE':
+            references = [reference for reference in query.get('REFERENCIAS', '').split('|') if reference]
+            return 200, {"DOCUMENTOS": self.state.get_documents_by_reference(references)}, 'success'
+
+        if self.settings.roll('reject_rate', 'certify'):
+            return 200, {"Codigo": 0, "Mensaje": "DTE rechazado (simulado)", "ResponseDATA1": ""}, 'reject'
+        return 200, self.state.certify(body), 'success'
+
+    def _handle_nit(self, method, query, body):
+        nit = query.get('DATA2', '').partition('|')[2]
+        if self.settings.roll('reject_rate', 'nit') or not nit:
+            return 200, {"REQUEST": [{"Respuesta": 0, "Mensaje": "NIT no existe (simulado)"}]}, 'reject'
+        return 200, {"RESPONSE": [{"NIT": nit, "NOMBRE": f"CONTRIBUYENTE {nit}", "Direccion": "CIUDAD"}]}, 'success'
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+def make_server(host='127.0.0.1', port=8089, settings=None):
+    """Crea el servidor simulado (sin iniciarlo); `server.serve_forever()` lo atiende."""
+    server = ThreadingHTTPServer((host, port), MockDigifactHandler)
+    server.daemon_threads = True
+    server.mock_settings = settings or MockSettings()
+    server.mock_state = MockState()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor Digifact simulado para pruebas de carga FEL.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    for name, help_text in (
+            ('latency', "segundos de respuesta"),
+            ('jitter', "variación aleatoria (+/-) de la latencia, en segundos"),
+            ('error-rate', "fracción de respuestas HTTP 503"),
+            ('reject-rate', "fracción de DTE o NIT rechazados"),
+            ('timeout-rate', "fracción de peticiones que no responden a tiempo")):
+        parser.add_argument(f'--{name}', action='append', default=[], metavar='[ENDPOINT=]VALOR',
+                            help=f"{help_text}; endpoints: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--hang', type=float, default=DEFAULT_HANG_SECONDS,
+                        help="segundos que espera una petición con timeout")
+    parser.add_argument('--seed', type=int, help="semilla para repetir la misma secuencia de fallas")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    settings = MockSettings(hang_seconds=args.hang, seed=args.seed)
+    for name in ('latency', 'jitter', 'error_rate', 'reject_rate', 'timeout_rate'):
+        for spec in getattr(args, name):
+            settings.set(name, spec)
+
+    server = make_server(args.host, args.port, settings)
+    _logger.info(f"🧪 Digifact simulado en http://{args.host}:{args.port} (/token, /certify, /nit)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for (endpoint, outcome), count in sorted(server.mock_state.counters.items()):
+            _logger.info(f"📊 {endpoint} {outcome}: {count}")
+
+
+if __name__ == '__main__':
+    main()
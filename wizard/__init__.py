@@ -0,0 +1 @@
+from . import fel_recertify_wizard
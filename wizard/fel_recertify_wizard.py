@@ -0,0 +1,51 @@
+from odoo import models, fields, api, _
+from odoo.exceptions import AccessError, UserError
+from ..models.fel_recertify_batch import RECERTIFY_CHUNK_SIZE, RECERTIFY_MAX_WORKERS
+
+
+class FelRecertifyWizard(models.TransientModel):
+    _name = 'fel.recertify.wizard'
+    _description = 'Certificación FEL Masiva'
+
+    move_ids = fields.Many2many('account.move', string="Facturas")
+    max_workers = fields.Integer("Certificaciones en Paralelo", default=RECERTIFY_MAX_WORKERS, required=True)
+    chunk_size = fields.Integer("Facturas por Lote", default=RECERTIFY_CHUNK_SIZE, required=True,
+                                help="Se confirma la transacción después de cada lote.")
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super(FelRecertifyWizard, self).default_get(fields_list)
+        if self.env.context.get('active_model') == 'account.move' and 'move_ids' in fields_list:
+            res['move_ids'] = [(6, 0, self.env.context.get('active_ids', []))]
+        return res
+
+    def action_certify(self):
+        """
+        Crea la certificación masiva de las facturas seleccionadas y la deja al cron, que las
+        certifica por lotes con envíos en paralelo. Abre la certificación para seguir su avance.
+        """
+        self.ensure_one()
+
+        # 🔹 Verificar que el usuario tiene permisos de Administrador de Contabilidad
+        if not self.env.user.has_group('account.group_account_manager'):
+            raise AccessError(_("No tienes permisos para certificar facturas."))
+        if self.max_workers < 1 or self.chunk_size < 1:
+            raise UserError(_("Las certificaciones en paralelo y las facturas por lote deben ser mayores que cero."))
+
+        moves = self.move_ids.filtered(lambda move: not move.certified)
+        if not moves:
+            raise UserError(_("Las facturas seleccionadas ya están certificadas."))
+
+        batch = self.env['fel.recertify.batch'].create({
+            'max_workers': self.max_workers,
+            'chunk_size': self.chunk_size,
+            'line_ids': [(0, 0, {'move_id': move.id}) for move in moves],
+        })
+        batch._trigger_cron()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': batch._name,
+            'res_id': batch.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }